@@ -0,0 +1,256 @@
+# Runs the reconciliation for several brokers and accounts on one shared worker pool.
+#
+#   python batch.py batch.json --workers 8
+#
+# batch.json:
+# {
+#     "workers": 8,
+#     "parallel_runs": 4,               (optional, runs driven at the same time, defaults to min(workers, 4))
+#     "memory_limit": "1G",
+#     "queue": "compute/queue.db",      (optional, the notes are then extracted by work_queue.py workers)
+#     "queue_timeout": 600,             (optional, a run fails after this many seconds without a note finished by the workers)
+#     "profile": true,                  (optional, time spent per stage in the summary of each run)
+#     "trace_path": "compute/traces",   (optional, <trace_path>/<run>.jsonl timings per contract note)
+#     "cprofile_path": "compute/prof",  (optional, <cprofile_path>/<run>.prof cProfile stats)
+#     "summary_path": "compute/batch_summary.json",
+#     "runs": [
+#         {"broker": "Zerodha", "account": "ABC123",
+#          "input_path_prefix": "data/ABC123", "compute_path_prefix": "compute/ABC123",
+#          "start_date": "2022-04-01", "end_date": "2023-04-01",
+#          "broker_options": {"output_format": "xlsx"}}      (optional, keyword arguments of the Broker)
+#     ]
+# }
+
+import argparse
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+
+from brokers import create_broker
+from reconciliation import write_reconciliation_report
+from work_queue import get_work_queue
+from utils.memory import set_memory_budget
+from utils.profiling import get_profiler
+
+
+DEFAULT_PARALLEL_RUNS = 4
+
+
+def load_batch_config(config_file_path):
+    with open(config_file_path) as f:
+        config = json.load(f)
+
+    if not config.get('runs'):
+        raise RuntimeError(f"batch config '{config_file_path}' has no runs")
+
+    for run in config['runs']:
+        if 'broker' not in run:
+            raise RuntimeError(f"run {run} does not specify a broker")
+
+    return config
+
+
+def create_run_broker(run, memory_limit=None):
+    broker_options = {}
+    if memory_limit is not None:
+        broker_options['cnote_memory_limit'] = memory_limit
+    broker_options.update(run.get('broker_options', {}))
+    return create_broker(run['broker'],
+                         input_path_prefix=run.get('input_path_prefix', 'data'),
+                         compute_path_prefix=run.get('compute_path_prefix', 'compute'),
+                         **broker_options)
+
+
+def get_run_name(run):
+    if run.get('account'):
+        return f"{run['broker']}:{run['account']}"
+    return run['broker']
+
+
+def get_run_profiler(run, profile=False, trace_path=None, cprofile_path=None):
+    file_name = get_run_name(run).replace(':', '_')
+    return get_profiler(profile=profile,
+                        trace_file_path=os.path.join(trace_path, f'{file_name}.jsonl') if trace_path else None,
+                        cprofile_file_path=os.path.join(cprofile_path, f'{file_name}.prof') if cprofile_path else None)
+
+
+def run_broker(run, executor, dry_run=False, memory_limit=None, queue_path=None, queue_timeout=0, profile_options=None):
+    summary = {
+        'name': get_run_name(run),
+        'broker': run['broker'],
+        'account': run.get('account'),
+        'start_date': run.get('start_date'),
+        'end_date': run.get('end_date'),
+        'timings': {},
+        'status': 'ok',
+    }
+    start_date = run.get('start_date')
+    end_date = run.get('end_date')
+
+    run_start = time.perf_counter()
+    queue = None
+    # The cProfile stats are those of the thread driving the run, the extraction in the pool is in the per note timings
+    profiler = get_run_profiler(run, **(profile_options or {}))
+    if profiler is not None:
+        profiler.start()
+    try:
+        broker = create_run_broker(run, memory_limit=memory_limit)
+        # A queue connection per run, as the runs are driven from separate threads
+        if queue_path is not None:
+            queue = get_work_queue(queue_path, wait_timeout=queue_timeout)
+
+        # The ledger load runs on the pool alongside the contract note extraction
+        stage_start = time.perf_counter()
+        ledger_future = broker.submit_read_ledger(start_date=start_date, end_date=end_date, executor=executor)
+
+        broker.read_contract_notes(start_date=start_date,
+                                   end_date=end_date,
+                                   dry_run=dry_run,
+                                   max_count=run.get('max_count', 0),
+                                   executor=executor,
+                                   profiler=profiler,
+                                   queue=queue)
+        summary['timings']['contract_notes'] = time.perf_counter() - stage_start
+
+        (broker.tradeledger_df, summary['timings']['ledger']) = ledger_future.result()
+
+        stage_start = time.perf_counter()
+        broker.reconcile(start_date=start_date, end_date=end_date)
+        summary['timings']['reconcile'] = time.perf_counter() - stage_start
+
+        stage_start = time.perf_counter()
+        broker.report()
+        summary['outputs'] = write_broker_outputs(broker, dry_run=dry_run)
+        summary['timings']['report'] = time.perf_counter() - stage_start
+
+        # The aggregate holds the notes of every date, only those reconciled for the run's range are counted
+        summary['contract_notes'] = int(broker.reconciled_df['ContractNotes'].sum())
+        summary['ledger_entries'] = len(broker.tradeledger_df)
+        summary['missing_entries'] = len(broker.missing_missing_df)
+        summary['amount_mismatches'] = len(broker.mismatch_df)
+        summary['failures'] = [{'document': result.pdf_file_path, 'error': result.error}
+                               for result in broker.cnote_failures]
+    except Exception as e:
+        traceback.print_exc()
+        summary['status'] = 'error'
+        summary['error'] = f"{type(e).__name__}: {e}"
+    finally:
+        if queue is not None:
+            queue.close()
+        if profiler is not None:
+            profiler.close()
+            summary['profile'] = profiler.summary()
+
+    summary['timings']['total'] = time.perf_counter() - run_start
+    return summary
+
+
+def write_broker_outputs(broker, dry_run=False):
+    if dry_run:
+        return {}
+
+    output_folder = os.path.dirname(broker.charges_file_path)
+    os.makedirs(output_folder, exist_ok=True)
+
+    missing_file_path = os.path.join(output_folder, 'missing_entries.csv')
+    broker.missing_missing_df.to_csv(missing_file_path, index=False)
+    write_reconciliation_report(broker.reconciled_df, broker.reconciliation_file_path)
+    return {
+        'charges': broker.charges_file_path,
+        'missing_entries': missing_file_path,
+        'reconciliation': broker.reconciliation_file_path,
+    }
+
+
+def run_batch(config, *, workers=None, parallel_runs=None, dry_run=False, memory_limit=None, queue_path=None, queue_timeout=None,
+              profile_options=None):
+    runs = config['runs']
+    if workers is None:
+        workers = config.get('workers') or os.cpu_count()
+    if parallel_runs is None:
+        parallel_runs = config.get('parallel_runs') or min(workers, DEFAULT_PARALLEL_RUNS)
+    if memory_limit is None:
+        memory_limit = config.get('memory_limit')
+    if queue_path is None:
+        queue_path = config.get('queue')
+    if queue_timeout is None:
+        queue_timeout = config.get('queue_timeout', 0)
+    if profile_options is None:
+        profile_options = {'profile': config.get('profile', False),
+                           'trace_path': config.get('trace_path'),
+                           'cprofile_path': config.get('cprofile_path')}
+
+    batch_start = time.perf_counter()
+    summary = {
+        'started': datetime.now().isoformat(timespec='seconds'),
+        'workers': workers,
+        'parallel_runs': parallel_runs,
+        'runs': [],
+    }
+
+    # Up to parallel_runs runs are driven from their own threads while all of them share one bounded
+    # process pool, so the extraction of one broker keeps the cores busy while another reconciles.
+    # Every run holds its ledger and charges aggregate in memory, hence the bound on the threads.
+    # With a memory_limit, every worker of the pool gets it as its memory budget
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=set_memory_budget if memory_limit is not None else None,
+                             initargs=(memory_limit,)) as executor:
+        with ThreadPoolExecutor(max_workers=min(parallel_runs, len(runs))) as run_executor:
+            futures = [run_executor.submit(run_broker, run, executor, dry_run, memory_limit, queue_path, queue_timeout,
+                                           profile_options)
+                       for run in runs]
+            summary['runs'] = [future.result() for future in futures]
+
+    summary['timings'] = {'total': time.perf_counter() - batch_start}
+    for stage in ['ledger', 'contract_notes', 'reconcile', 'report']:
+        summary['timings'][stage] = sum(run['timings'].get(stage, 0) for run in summary['runs'])
+    summary['status'] = 'ok' if all(run['status'] == 'ok' for run in summary['runs']) else 'error'
+
+    return summary
+
+
+def write_batch_summary(summary, summary_file_path):
+    output_folder = os.path.dirname(summary_file_path)
+    if output_folder and not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+
+    with open(summary_file_path, 'w') as f:
+        json.dump(summary, f, indent=4, default=str)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Reconcile charges for several brokers and accounts")
+    parser.add_argument('config', help="batch config file (json)")
+    parser.add_argument('--workers', type=int, default=None, help="size of the shared worker pool")
+    parser.add_argument('--parallel-runs', type=int, default=None,
+                        help=f"number of runs driven at the same time, defaults to min(workers, {DEFAULT_PARALLEL_RUNS})")
+    parser.add_argument('--summary', default=None, help="run summary file (json)")
+    parser.add_argument('--dry-run', action='store_true')
+    parser.add_argument('--memory-limit', default=None, help="memory limit per worker, e.g. 1G")
+    parser.add_argument('--queue', default=None, help="work queue (.db or folder) served by work_queue.py workers")
+    parser.add_argument('--queue-timeout', type=float, default=None,
+                        help="fail a run after this many seconds without a note finished by the queue workers")
+    parser.add_argument('--profile', action='store_true', help="add the time spent per stage to the run summaries")
+    parser.add_argument('--trace', default=None, help="folder of the per contract note timings of each run, implies --profile")
+    parser.add_argument('--cprofile', default=None, help="folder of the cProfile stats of each run, implies --profile")
+    args = parser.parse_args(args)
+
+    config = load_batch_config(args.config)
+    profile_options = None
+    if args.profile or args.trace or args.cprofile:
+        profile_options = {'profile': args.profile, 'trace_path': args.trace, 'cprofile_path': args.cprofile}
+    summary = run_batch(config, workers=args.workers, parallel_runs=args.parallel_runs, dry_run=args.dry_run, memory_limit=args.memory_limit,
+                        queue_path=args.queue, queue_timeout=args.queue_timeout, profile_options=profile_options)
+
+    summary_file_path = args.summary or config.get('summary_path', os.path.join('compute', 'batch_summary.json'))
+    write_batch_summary(summary, summary_file_path)
+    print(f"Batch summary written to '{summary_file_path}'")
+
+    return 0 if summary['status'] == 'ok' else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,67 @@
+# Per call overhead of utils.debug.debug_log with logging on and off.
+#
+#   python -m benchmarks.bench_debug_log --calls 20000
+
+import argparse
+import contextlib
+import inspect
+import io
+import json
+import time
+
+import pandas as pd
+
+from utils import debug
+from utils.debug import debug_log, df_print, lazy
+
+
+def legacy_print_file_function(offset=0, end="\n"):
+    # The location lookup debug_log used before, kept for comparison
+    caller_frame_record = inspect.stack()[offset + 1]
+    info = inspect.getframeinfo(caller_frame_record[0])
+    print('[{}:{} {}()]'.format(info.filename, info.lineno, info.function), end=end)
+
+
+def legacy_debug_log(*args):
+    legacy_print_file_function(offset=1, end=" ")
+    print(*args)
+
+
+def time_per_call(func, calls):
+    start = time.perf_counter()
+    for i in range(calls):
+        func(i)
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per call overhead of debug_log in microseconds")
+    parser.add_argument('--calls', type=int, default=20000)
+    args = parser.parse_args()
+
+    df = pd.DataFrame({'a': range(3)})
+    results = {}
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        results['legacy_on'] = time_per_call(lambda i: legacy_debug_log("value:", i), args.calls)
+        results['on'] = time_per_call(lambda i: debug_log("value:", i), args.calls)
+        results['on_without_location'] = time_per_call(lambda i: debug_log("value:", i, location=False), args.calls)
+        results['df_print_on'] = time_per_call(lambda i: df_print(df), args.calls // 10)
+
+    results['inactive_fstring'] = time_per_call(lambda i: debug_log(f"value: {i} {df.shape}", active=False), args.calls)
+    results['inactive_lazy'] = time_per_call(lambda i: debug_log(lazy(lambda: f"value: {i} {df.shape}"), active=False), args.calls)
+
+    debug.set_log_level(debug.INFO)
+    results['below_level'] = time_per_call(lambda i: debug_log("value:", i), args.calls)
+    debug.set_log_level(debug.DEBUG)
+
+    debug.enable_logging(False)
+    results['globally_off'] = time_per_call(lambda i: debug_log("value:", i), args.calls)
+    results['df_print_globally_off'] = time_per_call(lambda i: df_print(df), args.calls)
+    debug.enable_logging(True)
+
+    print(json.dumps({'microseconds_per_call': results}, indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+# Compares the legacy extraction (page count with pypdf, then camelot on the page list)
+# with the page targeted extraction of broker.get_summary_dataframe_from_pdf.
+#
+#   python -m benchmarks.bench_page_loading <cnotes_folder> --num-last-pages 2 --num-columns 5
+
+import argparse
+import json
+import os
+import time
+
+import camelot
+
+from broker import get_pdf_number_of_pages, get_summary_dataframe, get_summary_dataframe_from_pdf
+
+
+def get_bytes_read():
+    # rchar counts the bytes returned by read() calls of this process (Linux only)
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def legacy_summary_dataframe_from_pdf(pdf_file_path, *, num_last_pages=0, summary_match_func=None):
+    cnote_num_pages = get_pdf_number_of_pages(pdf_file_path)
+    if num_last_pages > 0:
+        last_pages_str = ",".join(str(cnote_num_pages - i) for i in range(num_last_pages) if cnote_num_pages - i > 0)
+    else:
+        last_pages_str = "all"
+
+    tables = camelot.read_pdf(pdf_file_path, pages=last_pages_str)
+    return get_summary_dataframe(tables, summary_match_func)
+
+
+def measure(func, pdf_file_paths, **kwargs):
+    timings = []
+    bytes_read = []
+    for pdf_file_path in pdf_file_paths:
+        start_bytes = get_bytes_read()
+        start = time.perf_counter()
+        func(pdf_file_path, **kwargs)
+        timings.append(time.perf_counter() - start)
+        end_bytes = get_bytes_read()
+        if start_bytes is not None:
+            bytes_read.append(end_bytes - start_bytes)
+
+    return {
+        'notes': len(pdf_file_paths),
+        'mean_seconds_per_note': sum(timings) / len(timings) if timings else None,
+        'mean_bytes_read_per_note': sum(bytes_read) / len(bytes_read) if bytes_read else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per note wall time and bytes read of summary table extraction")
+    parser.add_argument('cnotes_folder')
+    parser.add_argument('--num-last-pages', type=int, default=2)
+    parser.add_argument('--num-columns', type=int, required=True, help="number of columns of the summary table")
+    parser.add_argument('--max-count', type=int, default=20)
+    args = parser.parse_args()
+
+    def match_func(df, page_num=None):
+        return df.shape[1] == args.num_columns
+
+    pdf_file_paths = []
+    for (root, dirs, files) in os.walk(args.cnotes_folder):
+        pdf_file_paths.extend(os.path.join(root, file) for file in sorted(files) if file.lower().endswith('.pdf'))
+    pdf_file_paths = pdf_file_paths[:args.max_count]
+
+    kwargs = {'num_last_pages': args.num_last_pages, 'summary_match_func': match_func}
+    results = {
+        'before': measure(legacy_summary_dataframe_from_pdf, pdf_file_paths, **kwargs),
+        'after': measure(get_summary_dataframe_from_pdf, pdf_file_paths, **kwargs),
+    }
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == '__main__':
+    main()
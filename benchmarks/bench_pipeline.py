@@ -0,0 +1,149 @@
+# Throughput and peak memory of the extraction pipeline on synthetic contract notes.
+#
+#   python -m benchmarks.bench_pipeline --sizes 10,100,1000 --output bench_results.json
+#
+# Every (broker, size) case runs in its own process so that its peak RSS is not inflated
+# by the cases before it. The synthetic data is generated once under --data-dir and reused.
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.synthetic import synthetic_generators
+
+
+def get_peak_rss_bytes():
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+
+def prepare_data(data_dir, broker_name, size):
+    prefix = os.path.join(data_dir, f"{broker_name}-{size}")
+    marker_path = os.path.join(prefix, '.complete')
+    if not os.path.exists(marker_path):
+        synthetic_generators[broker_name](prefix, size)
+        with open(marker_path, 'w') as f:
+            f.write(datetime.now().isoformat())
+    return prefix
+
+
+def run_case(broker_name, size, data_dir, workers=1, engine='camelot', sample_count=10):
+    from broker import Broker, get_charges_aggregate_df_from_pdf, process_contractnotes_folder, process_financialledger_file
+    from brokers import broker_configs
+    from reconciliation import reconcile_amounts
+    from utils.debug import enable_logging
+
+    prefix = prepare_data(data_dir, broker_name, size)
+    broker = Broker(broker_name, input_path_prefix=prefix, compute_path_prefix=tempfile.mkdtemp(),
+                    cnote_engine=engine, **broker_configs[broker_name])
+    enable_logging(False)
+
+    result = {'broker': broker_name, 'notes': size, 'workers': workers, 'engine': engine}
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        pdf_file_paths = sorted(os.path.join(broker.cnote_folder_path, file) for file in os.listdir(broker.cnote_folder_path))
+        samples = pdf_file_paths[:sample_count]
+        if engine == 'tuned':
+            # Calibrated once before the timings, as it would be for a broker
+            broker.calibrate_lattice(sample_count=3)
+        start = time.perf_counter()
+        for pdf_file_path in samples:
+            get_charges_aggregate_df_from_pdf(pdf_file_path, '2000-01-01',
+                                              num_last_pages=broker.cnote_num_last_pages,
+                                              numeric_columns=broker.charges_numeric_columns,
+                                              summary_match_func=broker.summary_match_func,
+                                              summary_post_process_func=broker.summary_post_process_func,
+                                              text_layout=broker.cnote_text_layout,
+                                              lattice_settings=broker.lattice_settings)
+        result['seconds_per_note'] = (time.perf_counter() - start) / len(samples)
+
+        start = time.perf_counter()
+        charges_df = process_contractnotes_folder(broker.cnote_folder_path,
+                                                  num_last_pages=broker.cnote_num_last_pages,
+                                                  summary_match_func=broker.summary_match_func,
+                                                  summary_post_process_func=broker.summary_post_process_func,
+                                                  numeric_columns=broker.charges_numeric_columns,
+                                                  date_column=broker.charges_date_column,
+                                                  workers=workers,
+                                                  text_layout=broker.cnote_text_layout,
+                                                  lattice_settings=broker.lattice_settings,
+                                                  dry_run=True)
+        seconds = time.perf_counter() - start
+        result['process_contractnotes_folder'] = {
+            'seconds': seconds,
+            'notes_extracted': len(charges_df),
+            'notes_per_second': len(charges_df) / seconds if seconds else None,
+        }
+
+        start = time.perf_counter()
+        ledger_df = process_financialledger_file(broker.fledger_path,
+                                                 date_column=broker.fledger_date_column,
+                                                 date_format=broker.fledger_date_format,
+                                                 post_process_func=broker.fledger_post_process_func)
+        result['process_financialledger_file'] = {'seconds': time.perf_counter() - start, 'rows': len(ledger_df)}
+
+        start = time.perf_counter()
+        reconciled_df = reconcile_amounts(ledger_df, charges_df,
+                                          ledger_date_column=broker.fledger_date_column,
+                                          charges_date_column=broker.charges_date_column,
+                                          charges_amount_column=broker.charges_amount_column,
+                                          ledger_debit_column=broker.fledger_debit_column,
+                                          ledger_credit_column=broker.fledger_credit_column,
+                                          tolerance=broker.reconcile_tolerance)
+        result['reconcile_amounts'] = {'seconds': time.perf_counter() - start, 'rows': len(reconciled_df)}
+
+    result['peak_rss_bytes'] = get_peak_rss_bytes()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic contract notes")
+    parser.add_argument('--sizes', default='10,100,1000', help="comma separated numbers of notes")
+    parser.add_argument('--brokers', default=','.join(synthetic_generators), help="comma separated broker names")
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--engine', default='camelot', choices=['camelot', 'text', 'tuned'])
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'cnote_benchmark_data'))
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--case', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case is not None:
+        (broker_name, size) = args.case.split(':')
+        print(json.dumps(run_case(broker_name, int(size), args.data_dir, workers=args.workers, engine=args.engine)))
+        return
+
+    results = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'cases': [],
+    }
+    for broker_name in args.brokers.split(','):
+        for size in [int(size) for size in args.sizes.split(',')]:
+            print(f"Running {broker_name} with {size} notes")
+            output = subprocess.run([sys.executable, '-m', 'benchmarks.bench_pipeline',
+                                     '--case', f"{broker_name}:{size}",
+                                     '--workers', str(args.workers),
+                                     '--engine', args.engine,
+                                     '--data-dir', args.data_dir],
+                                    check=True, capture_output=True, text=True).stdout
+            case = json.loads(output.strip().splitlines()[-1])
+            print(json.dumps(case, indent=4))
+            results['cases'].append(case)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=4)
+    print(f"Benchmark results written to '{args.output}'")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+# Offline generator of synthetic contract notes and ledgers laid out like the real broker data:
+#
+#   <prefix>/ContractNotes/<Broker>/<note>.pdf
+#   <prefix>/FinancialLedger/<Broker>/<Broker>_FinancialLedger_Transactions.xlsx
+#
+# The PDFs are written directly (ruled tables drawn with lines and Helvetica text) so that
+# Camelot lattice detects the tables without any PDF library being installed.
+
+import os
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+
+import pandas as pd
+
+
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+
+
+def escape_pdf_text(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def get_table_stream(rows, *, x0, y_top, column_widths, row_height=18, font_size=8):
+    num_rows = len(rows)
+    width = sum(column_widths)
+    height = row_height * num_rows
+
+    ops = ["0.5 w"]
+    for row_index in range(num_rows + 1):
+        y = y_top - row_index * row_height
+        ops.append(f"{x0} {y} m {x0 + width} {y} l S")
+
+    x = x0
+    for column_width in column_widths + [0]:
+        ops.append(f"{x} {y_top} m {x} {y_top - height} l S")
+        x += column_width
+
+    for (row_index, row) in enumerate(rows):
+        x = x0
+        for (column_index, cell) in enumerate(row):
+            if cell != "":
+                y = y_top - (row_index + 1) * row_height + 5
+                ops.append(f"BT /F1 {font_size} Tf {x + 3} {y} Td ({escape_pdf_text(cell)}) Tj ET")
+            x += column_widths[column_index]
+
+    return "\n".join(ops)
+
+
+def get_text_stream(lines, *, x0=40, y_top=800, font_size=10, line_height=14):
+    ops = []
+    for (index, line) in enumerate(lines):
+        ops.append(f"BT /F1 {font_size} Tf {x0} {y_top - index * line_height} Td ({escape_pdf_text(line)}) Tj ET")
+    return "\n".join(ops)
+
+
+def write_pdf(pdf_file_path, page_streams):
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_ids = []
+    for stream in page_streams:
+        data = stream.encode("latin-1")
+        page_ids.append(len(objects) + 1)
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects) + 2} 0 R >>".encode())
+        objects.append(f"<< /Length {len(data)} >>\nstream\n".encode() + data + b"\nendstream")
+
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    objects[1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode()
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for (index, obj) in enumerate(objects):
+        offsets.append(len(output))
+        output += f"{index + 1} 0 obj\n".encode() + obj + b"\nendobj\n"
+
+    xref_offset = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        output += f"{offset:010d} 00000 n \n".encode()
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode()
+
+    with open(pdf_file_path, "wb") as f:
+        f.write(output)
+
+
+def format_amount(value):
+    # Contract notes show debits in brackets
+    if value == 0:
+        return ""
+    if value < 0:
+        return f"({-value:,.2f})"
+    return f"{value:,.2f}"
+
+
+def random_amount(rng, low, high):
+    return Decimal(rng.randint(int(low * 100), int(high * 100))) / 100
+
+
+def get_trade_page_stream(rng, note_date, num_columns, num_rows=20):
+    rows = [[f"Col{column}" for column in range(num_columns)]]
+    for _ in range(num_rows):
+        rows.append([str(rng.randint(1, 99999)) for _ in range(num_columns)])
+    header = get_text_stream([f"CONTRACT NOTE {note_date.isoformat()}", "Trades executed"])
+    table = get_table_stream(rows, x0=30, y_top=760, column_widths=[int(535 / num_columns)] * num_columns, row_height=14)
+    return header + "\n" + table
+
+
+def get_zerodha_summary(rng):
+    equity_obligation = random_amount(rng, -50000, 50000)
+    fno_obligation = random_amount(rng, -20000, 20000) if rng.random() < 0.5 else Decimal(0)
+
+    labels = ["Pay in/Pay out obligation", "Taxable value of Supply (Brokerage)", "Exchange transaction charges",
+              "Clearing charges", "CGST", "SGST", "IGST", "STT", "SEBI turnover fees", "Stamp duty",
+              "Net amount receivable/(payable by client)"]
+    equity = [equity_obligation]
+    fno = [fno_obligation]
+    for label in labels[1:-1]:
+        equity.append(-random_amount(rng, 0, 40))
+        fno.append(-random_amount(rng, 0, 20) if fno_obligation else Decimal(0))
+    equity.append(sum(equity))
+    fno.append(sum(fno))
+
+    rows = [["", "Equity", "Equity (T+1)", "Futures and Options", "NET TOTAL"]]
+    for (label, equity_value, fno_value) in zip(labels, equity, fno):
+        rows.append([label, format_amount(equity_value), "", format_amount(fno_value), format_amount(equity_value + fno_value)])
+    return (rows, equity[-1] + fno[-1])
+
+
+def get_axisdirect_summary(rng):
+    labels = ["Pay In/Pay Out Obligation", "Brokerage", "Exchange Transaction Charges", "SEBI Fees",
+              "Taxable Value Of Supply", "CGST Rate", "CGST", "SGST Rate", "SGST", "IGST Rate", "IGST",
+              "UTGST Rate", "UTGST", "STT", "Stamp Duty", "Net Amount Receivable/Payable"]
+    rate_rows = [5, 7, 9, 11]
+    charge_rows = [1, 2, 3, 6, 8, 13, 14]
+
+    columns = {}
+    for column in ["NCL-EQUITY", "NCL F&O"]:
+        values = [Decimal(0)] * len(labels)
+        values[0] = random_amount(rng, -50000, 50000)
+        for row in charge_rows:
+            values[row] = -random_amount(rng, 0, 40)
+        values[4] = values[1] + values[2] + values[3]
+        values[15] = values[0] + sum(values[row] for row in charge_rows)
+        columns[column] = values
+
+    rows = [["Description", "NCL-EQUITY", "NCL F&O", "NCL CDX", "NCL COM", "Total(Net)"]]
+    for (row, label) in enumerate(labels):
+        if row in rate_rows:
+            rate = "9%" if row in [5, 7] else ""
+            rows.append([label, rate, rate, "", "", rate])
+            continue
+        equity = columns["NCL-EQUITY"][row]
+        fno = columns["NCL F&O"][row]
+        rows.append([label, format_amount(equity), format_amount(fno), "", "", format_amount(equity + fno)])
+
+    net_total = columns["NCL-EQUITY"][15] + columns["NCL F&O"][15]
+    return (rows, net_total)
+
+
+def get_note_dates(num_notes, start_date=date(2019, 4, 1)):
+    note_dates = []
+    current = start_date
+    while len(note_dates) < num_notes:
+        if current.weekday() < 5:
+            note_dates.append(current)
+        current += timedelta(days=1)
+    return note_dates
+
+
+def generate_zerodha_data(prefix, num_notes, *, seed=0, num_trade_pages=1):
+    rng = random.Random(seed)
+    cnotes_folder_path = os.path.join(prefix, 'ContractNotes', 'Zerodha')
+    os.makedirs(cnotes_folder_path, exist_ok=True)
+
+    ledger_rows = []
+    for note_date in get_note_dates(num_notes):
+        (rows, net_total) = get_zerodha_summary(rng)
+        pages = [get_trade_page_stream(rng, note_date, 8) for _ in range(num_trade_pages)]
+        pages.append(get_table_stream(rows, x0=30, y_top=700, column_widths=[200, 80, 70, 100, 80]))
+        write_pdf(os.path.join(cnotes_folder_path, f"Contract_Note_{note_date.isoformat()}.pdf"), pages)
+
+        ledger_rows.append({'Particulars': 'Net obligation', 'Posting Date': note_date.isoformat(),
+                            'Voucher Type': 'Book Voucher', 'Debit': float(max(-net_total, 0)), 'Credit': float(max(net_total, 0))})
+        if rng.random() < 0.2:
+            ledger_rows.append({'Particulars': 'Funds added', 'Posting Date': note_date.isoformat(),
+                                'Voucher Type': 'Bank Receipts', 'Debit': 0.0, 'Credit': float(random_amount(rng, 1000, 50000))})
+
+    write_ledger(prefix, 'Zerodha', pd.DataFrame(ledger_rows))
+    return cnotes_folder_path
+
+
+def generate_axisdirect_data(prefix, num_notes, *, seed=0, num_trade_pages=1):
+    rng = random.Random(seed)
+    cnotes_folder_path = os.path.join(prefix, 'ContractNotes', 'Axisdirect')
+    os.makedirs(cnotes_folder_path, exist_ok=True)
+
+    ledger_rows = []
+    for (index, note_date) in enumerate(get_note_dates(num_notes)):
+        (rows, net_total) = get_axisdirect_summary(rng)
+        pages = [get_trade_page_stream(rng, note_date, 12) for _ in range(num_trade_pages)]
+        pages.append(get_table_stream(rows, x0=20, y_top=760, column_widths=[170, 80, 80, 60, 60, 80]))
+        write_pdf(os.path.join(cnotes_folder_path, f"ContractNote_{note_date.strftime('%d%m%Y')}.pdf"), pages)
+
+        ledger_rows.append({'Trn Date': note_date.strftime('%d-%b-%y'), 'Bill No.': f"B{index:06d}",
+                            'Description': 'Bill', 'Debit': float(max(-net_total, 0)), 'Credit': float(max(net_total, 0))})
+        if rng.random() < 0.2:
+            ledger_rows.append({'Trn Date': note_date.strftime('%d-%b-%y'), 'Bill No.': None,
+                                'Description': 'Receipt', 'Debit': 0.0, 'Credit': float(random_amount(rng, 1000, 50000))})
+
+    write_ledger(prefix, 'Axisdirect', pd.DataFrame(ledger_rows))
+    return cnotes_folder_path
+
+
+def write_ledger(prefix, broker_name, ledger_df):
+    ledger_folder_path = os.path.join(prefix, 'FinancialLedger', broker_name)
+    os.makedirs(ledger_folder_path, exist_ok=True)
+    ledger_df.to_excel(os.path.join(ledger_folder_path, f"{broker_name}_FinancialLedger_Transactions.xlsx"), index=False)
+
+
+synthetic_generators = {
+    'Zerodha': generate_zerodha_data,
+    'Axisdirect': generate_axisdirect_data,
+}
@@ -1,22 +1,38 @@
-import decimal
 import os
-import camelot
-from pypdf import PdfReader
 import pandas as pd
 import numpy as np
 from decimal import Decimal, InvalidOperation
 import re
+import tempfile
+import time
+from concurrent.futures import Future
 from datetime import datetime
-from utils.debug import df_print, debug_log
+from utils.debug import df_print, debug_log, lazy
+from utils.parallel import iter_ordered, timed_call
+from utils.profiling import NULL_TIMER, get_stage_timer
+from utils.cache import ExtractionCache, get_function_identity, DEFAULT_CACHE_MAX_SIZE
+from utils.memory import MemoryGuard, NULL_MEMORY_GUARD, format_memory_size, get_memory_budget, parse_memory_size, set_memory_budget
+from charges_store import ExcelChargesStore, get_charges_store
+from text_extract import get_summary_dataframe_from_text, validate_summary_dataframe
+from ledger_cache import LedgerSnapshotCache, read_financialledger_file, filter_date_range
+from summary_layout import compile_summary_layout, materialize_charges
+from table_match import LayoutIndex, SummaryTableSpec, TableFingerprint
+from note_index import NoteDateIndex, get_date_from_name
+from journal import NoteJournal
+from charges_rollup import ChargesRollup
+from lattice_tuning import (CALIBRATION_CANDIDATES, DEFAULT_CALIBRATION_SAMPLES, DEFAULT_REGION_MARGIN, LatticeSettings,
+                            get_region, load_lattice_settings, save_lattice_settings)
+from reconciliation import (reconcile_amounts, summarize_reconciliation, write_reconciliation_report, read_reconciliation_report,
+                            DEFAULT_TOLERANCE, MISSING_STATUSES, STATUS_AMOUNT_MISMATCH, STATUS_MATCHED)
 
 
 whitespace_regex = r"^\s*$"
 bracketed_number_regex = r"^\(([\d.,]*)\)"
 date_regex_list = [
     # Zerodha
-    (r"(\d{4}-\d{2}-\d{2})","%Y-%m-%d"),
+    (re.compile(r"(\d{4}-\d{2}-\d{2})"), "%Y-%m-%d"),
     # Axisdirect
-    (r"(\d{8})\.","%d%m%Y"),
+    (re.compile(r"(\d{8})\."), "%d%m%Y"),
 ]
 
 
@@ -29,15 +45,7 @@ def convert_datestr_to_isostr(datestr, format):
 
 
 def get_date_from_string(input_str):
-    iso_str = None
-    for (date_regex, date_format) in date_regex_list:
-        match = re.search(date_regex, input_str)
-        if match is not None:
-            date_str = match.group(1)
-            iso_str = convert_datestr_to_isostr(date_str, date_format)
-            break
-
-    return iso_str
+    return get_date_from_name(input_str, date_regex_list)
 
 
 def get_dataframe_from_camelot_table(table):
@@ -50,7 +58,7 @@ def get_dataframe_from_camelot_table(table):
 
 def convert_to_decimal_or_blank(cell):
     if isinstance(cell, Decimal):
-        debug_log(f"cell value '{cell}' is already a Decimal", active=False)
+        debug_log(lazy(lambda: f"cell value '{cell}' is already a Decimal"), active=False)
         return cell
 
     input_value = cell
@@ -78,6 +86,46 @@ def convert_to_decimal_or_blank(cell):
     return value
 
 
+# Amounts are parsed into integers scaled by 10**DECIMAL_SCALE so that sums stay exact
+DECIMAL_SCALE = 4
+decimal_number_regex = r"(?P<open>\()?\s*(?P<minus>-)?\s*(?P<number>\d[\d,]*(?:\.\d*)?|\.\d+)(?P<trailing>\s*-)?"
+number_token_regex = r"\d[\d,]*(?:\.\d*)?|\.\d+"
+exponent_regex = r"\d[eE][-+]?\d"
+
+
+def parse_decimal_series(series, scale=DECIMAL_SCALE):
+    # Vectorized counterpart of convert_to_decimal_or_blank. Blank cells become 0, bracketed
+    # numbers and numbers with a trailing minus ('12.50-') are negative, thousands separators and
+    # surrounding text are ignored and cells without a number become <NA>. Digits beyond the scale
+    # are rounded half up. Cells with an exponent ('1e3'), more than one number ('2 lots 12.50') or
+    # a minus on both sides ('-12.50-') are ambiguous and become <NA> as well, rather than the first
+    # number of the cell.
+    text = series.astype('string').str.strip()
+    blank = text == ''
+    ambiguous = (text.str.count(number_token_regex) > 1) | text.str.contains(exponent_regex)
+
+    parts = text.str.extract(decimal_number_regex)
+    negative = parts['open'].notna() | parts['minus'].notna() | parts['trailing'].notna()
+    ambiguous = ambiguous | (parts['minus'].notna() & parts['trailing'].notna())
+
+    number = parts['number'].str.replace(',', '', regex=False)
+    integer_part = number.str.extract(r"^(\d*)", expand=False).replace('', '0')
+    fraction_part = number.str.extract(r"\.(\d*)$", expand=False).fillna('').str.pad(scale + 1, side='right', fillchar='0')
+
+    scaled = integer_part.astype('Int64') * (10 ** scale)
+    scaled = scaled + fraction_part.str.slice(0, scale).replace('', '0').astype('Int64')
+    scaled = scaled + (fraction_part.str.slice(scale, scale + 1).astype('Int64') >= 5).astype('Int64')
+    scaled = scaled.where(~negative.fillna(False), -scaled)
+
+    scaled[ambiguous.fillna(False)] = pd.NA
+    scaled[blank.fillna(False)] = 0
+    return scaled.astype('Int64')
+
+
+def parse_decimal_frame(df, scale=DECIMAL_SCALE):
+    return df.apply(lambda column: parse_decimal_series(column, scale=scale))
+
+
 def convert_to_decimal(cell, ignore=False):
     try:
         new_cell = round(Decimal(cell), 4)
@@ -91,31 +139,211 @@ def convert_to_decimal(cell, ignore=False):
     return new_cell
 
 
-def get_summary_dataframe(tables, match_func):
-    if match_func is None:
+def get_summary_dataframe(tables, match_func, page_num=None, timer=NULL_TIMER, table_spec=None, table_indices=None, match_info=None):
+    if match_func is None and table_spec is None:
         raise RuntimeError("match_func parameter is mandatory")
 
+    if table_indices is None:
+        table_indices = range(len(tables))
+
     match_df = None
-    for table in tables:
+    for table_index in table_indices:
+        table = tables[table_index]
         # import pdb; pdb.set_trace()
-        df = get_dataframe_from_camelot_table(table)
-        if match_func(df, page_num=table.page):
+        # The raw cells are checked first so that only the candidate tables are converted
+        if table_spec is not None:
+            with timer('fingerprint'):
+                mismatches = table_spec.get_mismatches(TableFingerprint(table.data))
+            if mismatches:
+                if match_info is not None:
+                    match_info.setdefault('mismatches', {})[(page_num, table_index)] = mismatches
+                continue
+
+        with timer('table_conversion'):
+            df = get_dataframe_from_camelot_table(table)
+        matched = True
+        if match_func is not None:
+            with timer('match'):
+                matched = match_func(df, page_num=page_num if page_num is not None else table.page)
+        if matched:
             match_df = df
+            if match_info is not None:
+                match_info['table_index'] = table_index
             break
 
     return match_df
 
 
+# The PDF stack (camelot pulls in OpenCV, pdfium and a pdf parser) is only imported by the
+# functions below that read PDFs, so ledger and report commands do not pay for it at startup.
 def get_pdf_number_of_pages(pdf_file_path):
+    from pypdf import PdfReader
     reader = PdfReader(pdf_file_path)
     return len(reader.pages)
 
 
+def get_last_page_numbers(num_pages, num_last_pages=0):
+    # Last page first, since that is where the summary tables sit
+    if num_last_pages > 0:
+        return [page_num for page_num in range(num_pages, num_pages - num_last_pages, -1) if page_num > 0]
+
+    return list(range(num_pages, 0, -1))
+
+
+def write_pdf_page(reader, page_num, output_file_path):
+    from pypdf import PdfWriter
+    writer = PdfWriter()
+    writer.add_page(reader.pages[page_num - 1])
+    with open(output_file_path, 'wb') as f:
+        writer.write(f)
+
+
+def get_summary_dataframe_from_text_layer(reader, page_nums, text_layout, timer=NULL_TIMER):
+    for page_num in page_nums:
+        with timer('text_extraction'):
+            summary_df = get_summary_dataframe_from_text(reader.pages[page_num - 1], text_layout)
+            if summary_df is not None and validate_summary_dataframe(summary_df, text_layout, parse_decimal_frame):
+                return summary_df
+
+    return None
+
+
+def iter_pdf_page_tables(reader, page_nums, *, pdf_file_path=None, memory_guard=NULL_MEMORY_GUARD, timer=NULL_TIMER,
+                         lattice_settings=None):
+    # Yields (page_num, tables) one page at a time. Each page is copied into a single page file
+    # so that Camelot does not reopen and split the whole document, and the tables of a page
+    # are released before the next page is read, so memory does not grow with the page count.
+    # Without lattice_settings the pages are read with Camelot's defaults.
+    import camelot
+
+    read_pdf_kwargs = lattice_settings.get_read_pdf_kwargs() if lattice_settings is not None else {}
+
+    (fd, page_file_path) = tempfile.mkstemp(suffix='.pdf')
+    os.close(fd)
+    try:
+        for page_num in page_nums:
+            # Checked before every page, once the tables of the previous one are released
+            memory_guard.check(f"before page {page_num} of '{pdf_file_path}'")
+            with timer('page_split'):
+                write_pdf_page(reader, page_num, page_file_path)
+            with timer('table_detection'):
+                try:
+                    tables = camelot.read_pdf(page_file_path, pages='1', **read_pdf_kwargs)
+                except Exception as e:
+                    # A failed allocation surfaces as a rendering error, which must not pass for a page without tables
+                    if get_memory_budget() is None:
+                        raise
+                    raise RuntimeError(f"table detection failed on page {page_num} within the memory budget of "
+                                       f"{format_memory_size(get_memory_budget())}: {type(e).__name__}: {e}") from e
+
+            print(f"{pdf_file_path}:  {len(tables)} Tables detected on page:{page_num} ")
+
+            yield (page_num, tables)
+            del tables
+    finally:
+        os.remove(page_file_path)
+
+
+def iter_pdf_tables(pdf_file_path, *, num_last_pages=0, memory_limit=None, timer=NULL_TIMER):
+    # Every table of a document, page by page, e.g. for the trade level tables of a large note
+    from pypdf import PdfReader
+    reader = PdfReader(pdf_file_path)
+    page_nums = range(1, len(reader.pages) + 1)
+    if num_last_pages > 0:
+        page_nums = page_nums[-num_last_pages:]
+
+    for (page_num, tables) in iter_pdf_page_tables(reader, page_nums, pdf_file_path=pdf_file_path,
+                                                   memory_guard=MemoryGuard(memory_limit), timer=timer):
+        for table in tables:
+            yield (page_num, table)
+
+
+def get_layout_drift(layout_index, position, num_pages, match_info):
+    preferred = layout_index.get_preferred() if layout_index is not None else None
+    if preferred is None or position == preferred:
+        return None
+
+    drift = f"summary table found at page offset {position[0]} table {position[1]} instead of page offset {preferred[0]} table {preferred[1]}"
+    mismatches = match_info.get('mismatches', {}).get((num_pages - preferred[0], preferred[1]))
+    if mismatches:
+        drift += f" ({'; '.join(mismatches)})"
+    return drift
+
+
+def get_summary_dataframe_from_pdf(pdf_file_path, *, num_last_pages=0, summary_match_func=None, text_layout=None,
+                                   table_spec=None, layout_index=None, match_info=None, memory_guard=NULL_MEMORY_GUARD,
+                                   lattice_settings=None, timer=NULL_TIMER):
+    # The note is opened once and its pages are read one at a time, the scan stops
+    # at the first page whose table is accepted by table_spec and summary_match_func.
+    # With a layout_index the position where the summary was found before is tried first.
+    from pypdf import PdfReader
+
+    with timer('pdf_open'):
+        reader = PdfReader(pdf_file_path)
+        cnote_num_pages = len(reader.pages)
+    # df_print(f"{pdf_file_path}: Number of pages:", cnote_num_pages)
+
+    page_nums = get_last_page_numbers(cnote_num_pages, num_last_pages=num_last_pages)
+    if layout_index is not None:
+        page_nums = layout_index.order_page_nums(page_nums, cnote_num_pages)
+    debug_log("page_nums:", page_nums)
+
+    if match_info is None:
+        match_info = {}
+
+    # Fixed layouts are first read from the text layer, Camelot is only used when that fails validation
+    if text_layout is not None:
+        summary_df = get_summary_dataframe_from_text_layer(reader, page_nums, text_layout, timer=timer)
+        if summary_df is not None:
+            return summary_df
+        debug_log(f"Text layer extraction failed for '{pdf_file_path}', falling back to camelot")
+
+    # Tuned lattice settings may only search the region where the calibration saw the summary table,
+    # so a note where they find nothing is read again with Camelot's defaults
+    for settings in ([lattice_settings, None] if lattice_settings is not None else [None]):
+        if settings is None and lattice_settings is not None:
+            debug_log(f"Summary table not found in '{pdf_file_path}' with lattice settings {lattice_settings}, retrying with the defaults")
+        page_tables = iter_pdf_page_tables(reader, page_nums, pdf_file_path=pdf_file_path, memory_guard=memory_guard, timer=timer,
+                                           lattice_settings=settings)
+        try:
+            for (page_num, tables) in page_tables:
+                # Positions are kept as (page offset from the last page, table index)
+                page_offset = cnote_num_pages - page_num
+                table_indices = None
+                if layout_index is not None:
+                    table_indices = layout_index.order_table_indices(page_offset, len(tables))
+                summary_df = get_summary_dataframe(tables, summary_match_func, page_num=page_num, timer=timer,
+                                                   table_spec=table_spec, table_indices=table_indices, match_info=match_info)
+                if summary_df is not None:
+                    match_info['position'] = (page_offset, match_info['table_index'])
+                    match_info['drift'] = get_layout_drift(layout_index, match_info['position'], cnote_num_pages, match_info)
+                    return summary_df
+        finally:
+            page_tables.close()
+
+    # Tables that look like the summary but are not, most likely a change of layout by the broker
+    mismatches = match_info.get('mismatches', {})
+    if mismatches:
+        details = '; '.join(f"page {page_num} table {table_index}: {', '.join(reasons)}"
+                            for ((page_num, table_index), reasons) in mismatches.items())
+        raise RuntimeError(f"Summary table not found in file '{pdf_file_path}' ({details})")
+
+    raise RuntimeError(f"Summary table not found in file '{pdf_file_path}'")
+
+
 def get_charges_aggregate_df_from_pdf(pdf_file_path, date, *,
                                       num_last_pages=0,
                                       numeric_columns=None,
                                       summary_match_func=None,
-                                      summary_post_process_func=None
+                                      summary_post_process_func=None,
+                                      cache=None,
+                                      text_layout=None,
+                                      table_spec=None,
+                                      layout_index=None,
+                                      match_info=None,
+                                      memory_limit=None,
+                                      lattice_settings=None,
+                                      timer=NULL_TIMER
                                       ):
     if pdf_file_path is None:
         raise RuntimeError(f"pdf_file_path is not provided")
@@ -131,43 +359,319 @@ def get_charges_aggregate_df_from_pdf(pdf_file_path, date, *,
 
     # df_print(pdf_file_path)
 
-    cnote_num_pages = get_pdf_number_of_pages(pdf_file_path)
-    # df_print(f"{pdf_file_path}: Number of pages:", cnote_num_pages)
+    try:
+        # The cache holds the matched summary table, so only the pandas post-processing is rerun on a hit
+        summary_df = None
+        if cache is not None:
+            with timer('cache'):
+                # The tables found by each engine and lattice settings can differ, they are cached apart
+                key_config = dict(num_last_pages=num_last_pages,
+                                  summary_match_func=get_function_identity(summary_match_func),
+                                  engine='text' if text_layout is not None else 'lattice')
+                if table_spec is not None:
+                    key_config['table_spec'] = table_spec.identity
+                if text_layout is not None:
+                    key_config['text_layout'] = text_layout
+                if lattice_settings is not None:
+                    key_config['lattice_settings'] = lattice_settings.to_dict()
+                cache_key = cache.make_key(pdf_file_path, **key_config)
+                summary_df = cache.get(cache_key)
 
-    if num_last_pages > 0:
-        page_list = []
-        for i in range(num_last_pages):
-            page_num = cnote_num_pages - i
-            if page_num > 0:
-                page_list.append(str(page_num))
-        last_pages_str = ",".join(page_list)
+        if summary_df is None:
+            summary_df = get_summary_dataframe_from_pdf(pdf_file_path,
+                                                        num_last_pages=num_last_pages,
+                                                        summary_match_func=summary_match_func,
+                                                        text_layout=text_layout,
+                                                        table_spec=table_spec,
+                                                        layout_index=layout_index,
+                                                        match_info=match_info,
+                                                        memory_guard=MemoryGuard(memory_limit),
+                                                        lattice_settings=lattice_settings,
+                                                        timer=timer)
+            if cache is not None:
+                with timer('cache'):
+                    cache.put(cache_key, summary_df)
+
+        # A ChargesRecord from a summary layout, or a DataFrame from a custom post-process function
+        with timer('post_process'):
+            return summary_post_process_func(pdf_file_path, date, summary_df.copy())
+    except ValueError as e:
+        debug_log(f"Error! {type(e)} reading file '{pdf_file_path}'")
+
+    return None
+
+
+def read_summary_table(page_file_path, page_num, *, summary_match_func=None, table_spec=None, read_pdf_kwargs=None):
+    # (camelot summary table or None, seconds spent in Camelot) for a single page file
+    import camelot
+
+    start = time.perf_counter()
+    tables = camelot.read_pdf(page_file_path, pages='1', **(read_pdf_kwargs or {}))
+    seconds = time.perf_counter() - start
+
+    match_info = {}
+    if get_summary_dataframe(tables, summary_match_func, page_num=page_num, table_spec=table_spec, match_info=match_info) is None:
+        return (None, seconds)
+    return (tables[match_info['table_index']], seconds)
+
+
+def calibrate_lattice_settings(pdf_file_paths, *, num_last_pages=0, summary_match_func=None, table_spec=None,
+                               candidates=CALIBRATION_CANDIDATES, region_margin=DEFAULT_REGION_MARGIN):
+    # The summary table of each sample note is first found with Camelot's defaults, then its page is
+    # read again with every candidate of lattice settings. Returns (settings, calibration details), the
+    # settings being the fastest candidate that gives a summary table with the same cells on every
+    # sample, or None when no candidate does.
+    from pypdf import PdfReader
+
+    samples = []
+    reference_seconds = 0
+    with tempfile.TemporaryDirectory() as temp_folder_path:
+        for pdf_file_path in pdf_file_paths:
+            reader = PdfReader(pdf_file_path)
+            for page_num in get_last_page_numbers(len(reader.pages), num_last_pages=num_last_pages):
+                page_file_path = os.path.join(temp_folder_path, f"{len(samples)}-{page_num}.pdf")
+                write_pdf_page(reader, page_num, page_file_path)
+                (table, seconds) = read_summary_table(page_file_path, page_num, summary_match_func=summary_match_func, table_spec=table_spec)
+                if table is not None:
+                    samples.append((page_file_path, page_num, table.data, table._bbox))
+                    reference_seconds += seconds
+                    break
+            else:
+                print(f"Summary table not found in '{pdf_file_path}', not used for the calibration")
+
+        if not samples:
+            raise RuntimeError("Summary table not found in any of the calibration notes")
+
+        region = get_region([bbox for (_, _, _, bbox) in samples], margin=region_margin)
+        results = []
+        for (engine, resolution, line_scale, use_region) in candidates:
+            settings = LatticeSettings(engine, resolution, line_scale, region if use_region else None)
+            read_pdf_kwargs = settings.get_read_pdf_kwargs()
+            identical = True
+            seconds = 0
+            for (page_file_path, page_num, cells, _) in samples:
+                (table, page_seconds) = read_summary_table(page_file_path, page_num, summary_match_func=summary_match_func,
+                                                           table_spec=table_spec, read_pdf_kwargs=read_pdf_kwargs)
+                seconds += page_seconds
+                if table is None or table.data != cells:
+                    identical = False
+                    break
+            results.append((settings, identical, seconds / len(samples)))
+
+    accepted = [(settings, seconds) for (settings, identical, seconds) in results if identical]
+    selected = min(accepted, key=lambda item: item[1])[0] if accepted else None
+    calibration = {'notes': list(pdf_file_paths),
+                   'pages': len(samples),
+                   'reference_ms_per_page': round(reference_seconds / len(samples) * 1000, 1),
+                   'candidates': [{'settings': repr(settings),
+                                   'identical': identical,
+                                   'ms_per_page': round(seconds * 1000, 1) if identical else None}
+                                  for (settings, identical, seconds) in results],
+                   'selected': repr(selected) if selected is not None else None}
+    return (selected, calibration)
+
+
+class ExtractionResult:
+    def __init__(self, pdf_file_path, date, charges=None, error=None):
+        self.pdf_file_path = pdf_file_path
+        self.date = date
+        self.charges = charges
+        self.error = error
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.timings = None
+        self.layout_position = None
+        self.layout_drift = None
+
+    def has_charges(self):
+        return self.charges is not None and not (isinstance(self.charges, pd.DataFrame) and self.charges.empty)
+
+
+def extract_contractnote(pdf_file_path, date, extract_kwargs):
+    # Runs in a pool worker when workers > 1, hence a module level function.
+    # Any exception is returned with the result so one bad note does not abort the run.
+    extract_kwargs = dict(extract_kwargs)
+    timer = get_stage_timer(extract_kwargs.pop('profile', False))
+
+    cache = extract_kwargs.get('cache')
+    if cache is not None:
+        (hits, misses) = (cache.hits, cache.misses)
+
+    match_info = {}
+    try:
+        with timer('total'):
+            charges = get_charges_aggregate_df_from_pdf(pdf_file_path, date, timer=timer, match_info=match_info, **extract_kwargs)
+        result = ExtractionResult(pdf_file_path, date, charges=charges)
+    except Exception as e:
+        result = ExtractionResult(pdf_file_path, date, error=f"{type(e).__name__}: {e}")
+    result.timings = timer.timings
+    result.layout_position = match_info.get('position')
+    result.layout_drift = match_info.get('drift')
+
+    # The counters of a worker's copy of the cache are sent back with the result
+    if cache is not None:
+        result.cache_hits = cache.hits - hits
+        result.cache_misses = cache.misses - misses
+
+    return result
+
+
+def get_processed_index(aggregate_df, *, date_column='Date', document_column='Document'):
+    # Built once per run so that the per-file check is a set lookup instead of a column scan.
+    # Aggregates written before the document column existed are indexed by date alone.
+    if not len(aggregate_df):
+        return set()
+
+    if document_column in aggregate_df.columns:
+        documents = aggregate_df[document_column].map(lambda x: os.path.normpath(x) if isinstance(x, str) else None)
     else:
-        last_pages_str = "all"
+        documents = [None] * len(aggregate_df)
 
-    debug_log("last_pages_str:", last_pages_str)
+    return set(zip(aggregate_df[date_column], documents))
 
-    try:
-        tables = camelot.read_pdf(pdf_file_path, pages=last_pages_str)
 
-        print(f"{pdf_file_path}:  {len(tables)} Tables detected on pages:{last_pages_str} ")
+def is_processed(processed_index, date, pdf_file_path):
+    return (date, os.path.normpath(pdf_file_path)) in processed_index or (date, None) in processed_index
 
-        summary_df = get_summary_dataframe(tables, summary_match_func)
-        if summary_df is None:
-            raise RuntimeError(f"Summary table not found in file '{pdf_file_path}'")
 
-        if summary_post_process_func is not None:
-            charges_sum_df = summary_post_process_func(pdf_file_path, date, summary_df)
+debug_process = True
 
-            df_print(charges_sum_df, active=False)
 
-            return charges_sum_df
-    except ValueError as e:
-        debug_log(f"Error! {type(e)} reading file '{pdf_file_path}'")
+def iter_contractnote_files(cnotes_folder_path, *, start_date=None, end_date=None, processed_index=None, verbose=None, note_index=None,
+                            dry_run=False):
+    # The notes are yielded in date order. Without a note_index the folder is listed into a
+    # throwaway index, with one only the directories changed since the last call are listed.
+    # A dry run refreshes the index in memory without saving it.
+    if verbose is None:
+        verbose = debug_process
 
-    return pd.DataFrame()
+    if note_index is None:
+        note_index = NoteDateIndex(cnotes_folder_path, date_patterns=date_regex_list)
+    note_index.refresh()
+    if not dry_run:
+        note_index.save()
+    selection = note_index.select(start_date, end_date)
+
+    # We ignore the files which are already present
+    jobs = [(pdf_file_path, date) for (date, pdf_file_path) in selection.notes
+            if not (processed_index and is_processed(processed_index, date, pdf_file_path))]
+
+    if verbose:
+        print(f"{len(jobs)} contract notes to read, skipped {selection.num_before} before start_date {start_date}, "
+              f"{selection.num_after} from end_date {end_date}, {selection.num_undated} without a date "
+              f"and {len(selection.notes) - len(jobs)} already read")
+
+    yield from jobs
+
+
+def iter_contractnotes(jobs, *,
+                       num_last_pages=0,
+                       summary_match_func=None,
+                       summary_post_process_func=None,
+                       numeric_columns=None,
+                       max_count=0,
+                       workers=1,
+                       cache=None,
+                       executor=None,
+                       profiler=None,
+                       text_layout=None,
+                       table_spec=None,
+                       layout_index=None,
+                       memory_limit=None,
+                       lattice_settings=None,
+                       queue=None,
+                       queue_spec=None,
+                       dry_run=False):
+    # Yields an ExtractionResult per (pdf_file_path, date) job, failures included, as soon as the note is extracted.
+    # A dry run learns the layout positions of the notes it reads without saving them.
+    # With a memory_limit, each note is checked against it between pages and the workers of
+    # the pool created here get it as their memory budget.
+    # With a work queue, the notes are extracted by the queue workers with the broker of queue_spec instead.
+    extract_kwargs = {
+        'num_last_pages': num_last_pages,
+        'numeric_columns': numeric_columns,
+        'summary_match_func': summary_match_func,
+        'summary_post_process_func': summary_post_process_func,
+        'cache': cache,
+        'text_layout': text_layout,
+        'table_spec': table_spec,
+        'layout_index': layout_index,
+        'memory_limit': memory_limit,
+        'lattice_settings': lattice_settings,
+        'profile': profiler is not None,
+    }
+
+    if queue is not None:
+        from work_queue import iter_queue_results
+        results = iter_queue_results(queue, jobs, dict(queue_spec, profile=profiler is not None))
+    else:
+        if executor is not None:
+            workers = getattr(executor, '_max_workers', workers)
+        if workers > 1:
+            print(f"Extracting contract notes using {workers} workers")
+
+        results = iter_ordered(extract_contractnote,
+                               ((pdf_file_path, date, extract_kwargs) for (pdf_file_path, date) in jobs),
+                               workers=workers,
+                               executor=executor,
+                               initializer=set_memory_budget if memory_limit is not None else None,
+                               initargs=(memory_limit,))
 
+    count = 0
+    try:
+        for result in results:
+            if cache is not None and workers > 1:
+                cache.hits += result.cache_hits
+                cache.misses += result.cache_misses
 
-debug_process = True
+            if result.error is None and result.has_charges():
+                count += 1
+
+            # The index is only updated here, the workers get a copy of it
+            if layout_index is not None and result.layout_position is not None:
+                layout_index.record(result.layout_position)
+            if result.layout_drift is not None:
+                print(f"Layout drift in '{result.pdf_file_path}': {result.layout_drift}")
+
+            if profiler is not None:
+                profiler.record(result.pdf_file_path, result.timings, date=result.date, error=result.error)
+                profiler.count('contract_notes')
+                if result.error is not None:
+                    profiler.count('contract_note_failures')
+                if result.layout_drift is not None:
+                    profiler.count('layout_drift')
+
+            yield result
+
+            # Checked right after a success so that no further note gets extracted
+            if max_count > 0 and count >= max_count:
+                print(f"Max count {max_count} reached")
+                break
+    finally:
+        results.close()
+        if layout_index is not None and not dry_run:
+            layout_index.save()
+
+
+def iter_contractnotes_folder(cnotes_folder_path, *,
+                              start_date=None,
+                              end_date=None,
+                              processed_index=None,
+                              note_index=None,
+                              dry_run=False,
+                              **kwargs):
+    if not os.path.exists(cnotes_folder_path):
+        raise RuntimeError(f"folder '{cnotes_folder_path}' does not exist")
+
+    print(f"Traversing contract notes folder '{cnotes_folder_path}'")
+    jobs = iter_contractnote_files(cnotes_folder_path,
+                                   start_date=start_date,
+                                   end_date=end_date,
+                                   processed_index=processed_index,
+                                   note_index=note_index,
+                                   dry_run=dry_run)
+
+    return iter_contractnotes(jobs, dry_run=dry_run, **kwargs)
 
 
 def process_contractnotes_folder(cnotes_folder_path, *,
@@ -176,140 +680,179 @@ def process_contractnotes_folder(cnotes_folder_path, *,
                                  summary_match_func=None,
                                  summary_post_process_func=None,
                                  date_column='Date',
+                                 document_column='Document',
                                  numeric_columns=None,
                                  start_date=None,
                                  end_date=None,
                                  max_count=0,
-                                 dry_run=False):
-    if not os.path.exists(cnotes_folder_path):
-        raise RuntimeError(f"folder '{cnotes_folder_path}' does not exist")
+                                 dry_run=False,
+                                 workers=1,
+                                 failures=None,
+                                 cache=None,
+                                 charges_store=None,
+                                 executor=None,
+                                 profiler=None,
+                                 text_layout=None,
+                                 table_spec=None,
+                                 layout_index=None,
+                                 memory_limit=None,
+                                 lattice_settings=None,
+                                 note_index=None,
+                                 journal=None,
+                                 rollup=None,
+                                 queue=None,
+                                 queue_spec=None):
+    if charges_store is None and charges_aggregate_file_path is not None:
+        charges_store = ExcelChargesStore(charges_aggregate_file_path)
+
+    # The journal only makes sense for a run whose results end up in a store
+    if dry_run or charges_store is None:
+        journal = None
+
+    run_timer = profiler.run_timer if profiler is not None else NULL_TIMER
+
+    # Only the columns needed for the resume check are read here
+    index_df = pd.DataFrame()
+    if charges_store is not None:
+        if not dry_run:
+            charges_store.import_excel_aggregate()
+        with run_timer('store_read_index'):
+            index_df = charges_store.read(columns=[date_column, document_column])
+
+    processed_index = get_processed_index(index_df, date_column=date_column, document_column=document_column)
+
+    if failures is None:
+        failures = []
 
     count = 0
-
-    aggregate_df = pd.DataFrame()
-    if charges_aggregate_file_path is not None:
-        if os.path.exists(charges_aggregate_file_path):
-            print(f"Reading charges aggregate file '{charges_aggregate_file_path}'")
-            aggregate_df = pd.read_excel(charges_aggregate_file_path)
-        else:
-            aggregate_df = pd.DataFrame()
-
-    print(f"Traversing contract notes folder '{cnotes_folder_path}'")
-    for (root, dirs, files) in os.walk(cnotes_folder_path):
-        files.sort()
-        for file in files:
-            if max_count > 0 and count >= max_count:
-                print(f"Max count {max_count} reached")
-                break
-
-            # We could have a custom function here
-            date = get_date_from_string(file)
-            if date is None:
-                if debug_process:
-                    print(f"Could not find date in file '{file}'")
-                continue
-
-            if start_date:
-                if date < start_date:
-                    if debug_process:
-                        print(f"date {date} is earlier than start_date {start_date}")
+    charges_list = []
+
+    # The notes extracted by an interrupted run are taken from the journal instead of being extracted again.
+    # They count towards max_count like the notes extracted by this run.
+    journaled = []
+    if journal is not None:
+        resumed = journal.get_extracted(processed_index, start_date=start_date, end_date=end_date)
+        if max_count > 0:
+            resumed = resumed[:max_count]
+        if resumed:
+            print(f"Resuming {len(resumed)} contract notes from journal '{journal.journal_file_path}'")
+        for (date, document, charges) in resumed:
+            processed_index.add((date, document))
+            journaled.append(document)
+            charges_list.append(charges)
+            count += 1
+
+    if max_count > 0 and count >= max_count:
+        print(f"Max count {max_count} reached")
+    else:
+        results = iter_contractnotes_folder(cnotes_folder_path,
+                                            num_last_pages=num_last_pages,
+                                            summary_match_func=summary_match_func,
+                                            summary_post_process_func=summary_post_process_func,
+                                            numeric_columns=numeric_columns,
+                                            start_date=start_date,
+                                            end_date=end_date,
+                                            max_count=max_count - count if max_count > 0 else 0,
+                                            workers=workers,
+                                            cache=cache,
+                                            processed_index=processed_index,
+                                            executor=executor,
+                                            profiler=profiler,
+                                            text_layout=text_layout,
+                                            table_spec=table_spec,
+                                            layout_index=layout_index,
+                                            memory_limit=memory_limit,
+                                            lattice_settings=lattice_settings,
+                                            note_index=note_index,
+                                            queue=queue,
+                                            queue_spec=queue_spec,
+                                            dry_run=dry_run)
+        try:
+            for result in results:
+                if journal is not None:
+                    journal.append(result)
+                    journaled.append(result.pdf_file_path)
+
+                if result.error is not None:
+                    print(f"Error! {result.error} processing file '{result.pdf_file_path}'")
+                    failures.append(result)
                     continue
 
-            if end_date:
-                if date >= end_date:
-                    if debug_process:
-                        print(f"date {date} is later than end_date {end_date}")
-                    continue
+                if result.has_charges():
+                    charges_list.append(result.charges)
+                    count += 1
+        finally:
+            results.close()
+            if journal is not None:
+                journal.close()
+
+    # The per note records become a DataFrame only once, at the end of the run
+    charges_df = materialize_charges(charges_list)
+
+    if failures:
+        print(f"{len(failures)} contract notes failed:")
+        for result in failures:
+            print(f"    {result.pdf_file_path}: {result.error}")
+
+    if cache is not None:
+        print(f"Extraction cache: {cache.hits} hits, {cache.misses} misses")
+        if profiler is not None:
+            profiler.count('cache_hits', cache.hits)
+            profiler.count('cache_misses', cache.misses)
+
+    if count > 0 and charges_store is not None:
+        # We convert the decimal columns to float
+        # aggregate_df = aggregate_df.map(float)
+        previous_signature = charges_store.get_signature() if rollup is not None else None
+        with run_timer('store_append'):
+            charges_store.append(charges_df, dry_run=dry_run)
+        # The period totals only get the new rows added, they are not grouped again from the whole aggregate
+        if rollup is not None and not dry_run:
+            with run_timer('rollup_update'):
+                rollup.update(charges_store, previous_signature, added_df=charges_df)
+
+    # The notes of this run are in the store now, the journal keeps those left out by the date range or max_count
+    if journal is not None:
+        journal.clear(journaled)
 
-            # We ignore the files which are already present
-            if len(aggregate_df):
-                if len(aggregate_df[aggregate_df[date_column] == date]):
-                    continue
+    aggregate_df = pd.DataFrame()
+    if charges_store is not None:
+        with run_timer('store_read'):
+            aggregate_df = charges_store.read()
 
-            pdf_file_path = os.path.join(root, file)
-
-            charges_sum_df = get_charges_aggregate_df_from_pdf(pdf_file_path,
-                                                               date,
-                                                               num_last_pages=num_last_pages,
-                                                               numeric_columns=numeric_columns,
-                                                               summary_match_func=summary_match_func,
-                                                               summary_post_process_func=summary_post_process_func
-                                                               )
-            if not charges_sum_df.empty:
-                aggregate_df = pd.concat([aggregate_df, charges_sum_df], axis=0)
-                count += 1
+    if dry_run or charges_store is None:
+        aggregate_df = pd.concat([aggregate_df, charges_df], axis=0)
 
     if aggregate_df is not None:
         df_print(aggregate_df, active=True)  # Show
 
-    if count > 0:
-        # We convert the decimal columns to float
-        # aggregate_df = aggregate_df.map(float)
-        create_output_file(aggregate_df, charges_aggregate_file_path, dry_run=dry_run)
-
     return aggregate_df
 
 
-def process_financialledger_file(data_file, *, date_column='Date', date_format=None, post_process_func=None, start_date=None, end_date=None, max_count=0):
-    fledger_df = pd.read_excel(data_file)
+def process_financialledger_file(data_file, *, date_column='Date', date_format=None, post_process_func=None, start_date=None, end_date=None, max_count=0, cache=None):
+    if cache is not None:
+        fledger_df = cache.load(data_file, date_column=date_column, date_format=date_format)
+    else:
+        fledger_df = read_financialledger_file(data_file, date_column=date_column, date_format=date_format)
 
-    if date_format is not None:
-        fledger_df[date_column] = fledger_df[date_column].map(lambda x: convert_datestr_to_isostr(x, date_format) )
+    fledger_df = filter_date_range(fledger_df, date_column, start_date=start_date, end_date=end_date)
 
     if post_process_func is not None:
         fledger_df = post_process_func(fledger_df)
 
+    if max_count > 0:
+        fledger_df = fledger_df.head(max_count)
+
     df_print(fledger_df, active=True, shape=True)
 
     return fledger_df
 
 
-def reconcile_charges_and_ledger(ledger_df, charges_df, *, ledger_date_column='Date', charges_date_column='Date'):
-    # df_print(ledger_df)
-    # df_print(charges_df)
-
-    # We will do an outer join
-    merged_df = ledger_df.merge(charges_df, left_on=ledger_date_column, right_on=charges_date_column, how='outer')
-    # df_print(merged_df)
-    return merged_df
-
-
-def find_missing_entries(joined_df, *, ledger_date_column='Date', charges_date_column='Date'):
-    mismatch_df = joined_df[joined_df[ledger_date_column] != joined_df[charges_date_column]]
-    # df_print(mismatch_df)
-    return mismatch_df
-
-
 def pd_set_options():
     pd.set_option('display.max_columns', None)
     pd.set_option('display.width', 1000)
 
 
-def generate_report_from_unmatched(unmatched_df, *, on=None, left_on=None, right_on=None, left_report=None, right_report=None):
-    if len(unmatched_df) > 0:
-        for index,row in unmatched_df.iterrows():
-            # We use the value for right in left and vice-versa since it is missing
-            if pd.isna(row[left_on]):
-                print(f"Report '{left_report}' has missing entry for date {row[right_on]}")
-            if pd.isna(row[right_on]):
-                print(f"Report '{right_report}' has missing entry for date {row[left_on]}")
-
-
-def create_output_file(charges_df, output_file_path, dry_run=False):
-    if dry_run:
-        return
-
-    output_folder = os.path.dirname(output_file_path)
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
-
-    if not dry_run:
-        if charges_df is not None:
-            # print(charges_df.map(type))
-            charges_df.to_excel(output_file_path)
-
-
-
 class Provider:
     def __init__(self, name, type):
         self.name = name
@@ -317,7 +860,9 @@ class Provider:
 
 
 class Broker(Provider):
-    output_format = 'xlsx'
+    # The charges aggregate is kept in a partitioned columnar store, 'xlsx' keeps it in one workbook
+    output_format = 'parquet'
+    export_format = 'xlsx'
 
     def __init__(self, name, *,
                  input_path_prefix='data',
@@ -329,12 +874,76 @@ class Broker(Provider):
                  charges_date_column='Date',
                  charges_numeric_columns=None,
                  summary_match_func=None,
-                 summary_post_process_func=None):
+                 summary_post_process_func=None,
+                 summary_layout=None,
+                 cnote_cache=False,
+                 cnote_cache_max_size=DEFAULT_CACHE_MAX_SIZE,
+                 output_format=None,
+                 fledger_cache=False,
+                 cnote_engine='camelot',
+                 cnote_text_layout=None,
+                 summary_table=None,
+                 cnote_memory_limit=None,
+                 cnote_index=True,
+                 cnote_journal=True,
+                 charges_amount_column=None,
+                 charges_rollup=None,
+                 fledger_debit_column='Debit',
+                 fledger_credit_column='Credit',
+                 reconcile_tolerance=DEFAULT_TOLERANCE):
         super(Broker, self).__init__(name, "Broker")
+        self.input_path_prefix = input_path_prefix
+        self.compute_path_prefix = compute_path_prefix
+        if output_format is not None:
+            self.output_format = output_format
         self.fledger_path = os.path.join(input_path_prefix, f'FinancialLedger/{self.name}/{self.name}_FinancialLedger_Transactions.xlsx')
         self.cnote_folder_path = os.path.join(input_path_prefix, f'ContractNotes/{self.name}')
         self.charges_file_path = os.path.join(compute_path_prefix, self.name, f'charges.{self.output_format}')
+        self.charges_export_file_path = os.path.join(compute_path_prefix, self.name, f'charges.{self.export_format}')
+        self.reconciliation_file_path = os.path.join(compute_path_prefix, self.name, 'reconciliation.csv')
+        # An aggregate kept in a workbook before is imported by the first run with a columnar store
+        self.charges_store = get_charges_store(self.charges_file_path,
+                                               output_format=self.output_format,
+                                               date_column=charges_date_column,
+                                               excel_file_path=os.path.join(compute_path_prefix, self.name, 'charges.xlsx'))
+        self.cnote_cache_folder_path = os.path.join(compute_path_prefix, self.name, 'cache')
+        self.extraction_cache = None
+        self.fledger_cache = None
+        if fledger_cache:
+            self.fledger_cache = LedgerSnapshotCache(os.path.join(compute_path_prefix, self.name, 'ledger_cache'))
+        if cnote_cache:
+            self.extraction_cache = ExtractionCache(self.cnote_cache_folder_path, max_size=cnote_cache_max_size)
+        # The dates of the notes are parsed from their file names once and kept in a sorted index,
+        # which is listed again only for the directories that changed
+        self.note_index = None
+        if cnote_index:
+            self.note_index = NoteDateIndex(self.cnote_folder_path,
+                                            date_patterns=date_regex_list,
+                                            index_file_path=os.path.join(compute_path_prefix, self.name, 'note_index.json'))
+        # Every extracted note is journaled, so an interrupted read_contract_notes resumes where it stopped
+        self.cnote_journal = None
+        if cnote_journal:
+            self.cnote_journal = NoteJournal(os.path.join(compute_path_prefix, self.name, 'journal.jsonl'))
+        # With a charges_rollup spec, the totals by period and segment are kept up to date with the aggregate
+        self.charges_rollup = None
+        if charges_rollup is not None:
+            self.charges_rollup = ChargesRollup(os.path.join(compute_path_prefix, self.name, 'rollup.json'),
+                                                charges_rollup,
+                                                date_column=charges_date_column,
+                                                scale=DECIMAL_SCALE)
         self.summary_match_func = summary_match_func
+        # With a summary_table spec, the tables are fingerprinted before any conversion and the
+        # position of the summary table is learned in a per broker layout index
+        self.summary_table_spec = None
+        self.layout_index = None
+        if summary_table is not None:
+            self.summary_table_spec = SummaryTableSpec(summary_table)
+            self.layout_index = LayoutIndex(os.path.join(compute_path_prefix, self.name, 'layout_index.json'))
+        if summary_layout is not None:
+            if summary_post_process_func is not None:
+                raise RuntimeError(f"summary_layout and summary_post_process_func can not be both provided")
+            # Compiled once here instead of rebuilding the row lists for every note
+            summary_post_process_func = compile_summary_layout(summary_layout, parse_decimal_series, DECIMAL_SCALE)
         self.summary_post_process_func = summary_post_process_func
         self.fledger_post_process_func = fledger_post_process_func
         self.fledger_date_column = fledger_date_column
@@ -342,24 +951,112 @@ class Broker(Provider):
         self.cnote_num_last_pages = cnote_num_last_pages
         self.charges_date_column = charges_date_column
         self.charges_numeric_columns = charges_numeric_columns
+        self.charges_amount_column = charges_amount_column
+        self.fledger_debit_column = fledger_debit_column
+        self.fledger_credit_column = fledger_credit_column
+        self.reconcile_tolerance = reconcile_tolerance
+
+        if cnote_engine not in ['camelot', 'text', 'tuned']:
+            raise RuntimeError(f"cnote_engine '{cnote_engine}' is not supported")
+        if cnote_engine == 'text' and cnote_text_layout is None:
+            raise RuntimeError(f"cnote_engine 'text' needs a cnote_text_layout")
+        self.cnote_engine = cnote_engine
+        self.cnote_cache = cnote_cache
+        self.cnote_cache_max_size = cnote_cache_max_size
+        self.cnote_memory_limit = parse_memory_size(cnote_memory_limit)
+        self.cnote_text_layout = cnote_text_layout if cnote_engine == 'text' else None
+        # cnote_engine 'tuned' reads the pages with the lattice settings learned by calibrate_lattice,
+        # or until then with a faster render of the whole page that gives the same tables
+        self.lattice_settings_file_path = os.path.join(compute_path_prefix, self.name, 'lattice_settings.json')
+        self.lattice_settings = None
+        if cnote_engine == 'tuned':
+            self.lattice_settings = load_lattice_settings(self.lattice_settings_file_path) or LatticeSettings()
 
         self.tradeledger_df = None
         self.summary_aggregate_df = None
         self.reconciled_df = None
         self.missing_missing_df = None
-
-    def read_ledger(self, start_date=None, end_date=None):
-        self.tradeledger_df = process_financialledger_file(self.fledger_path,
-                                                           post_process_func=self.fledger_post_process_func,
-                                                           date_column=self.fledger_date_column,
-                                                           date_format=self.fledger_date_format,
-                                                           start_date=start_date,
-                                                           end_date=end_date)
+        self.mismatch_df = None
+        self.cnote_failures = []
+
+    def read_ledger(self, start_date=None, end_date=None, max_count=0, executor=None):
+        (self.tradeledger_df, _) = self.submit_read_ledger(start_date=start_date,
+                                                           end_date=end_date,
+                                                           max_count=max_count,
+                                                           executor=executor).result()
         df_print(self.tradeledger_df, active=False)
 
-    def read_contract_notes(self, start_date=None, end_date=None, dry_run=False, max_count=0):
+    def submit_read_ledger(self, start_date=None, end_date=None, max_count=0, executor=None):
+        # Returns a future of (ledger_df, seconds) so that a caller can load the ledger
+        # while the contract notes are extracted
+        kwargs = dict(post_process_func=self.fledger_post_process_func,
+                      date_column=self.fledger_date_column,
+                      date_format=self.fledger_date_format,
+                      start_date=start_date,
+                      end_date=end_date,
+                      max_count=max_count,
+                      cache=self.fledger_cache)
+        if executor is not None:
+            return executor.submit(timed_call, process_financialledger_file, self.fledger_path, **kwargs)
+
+        future = Future()
+        future.set_result(timed_call(process_financialledger_file, self.fledger_path, **kwargs))
+        return future
+
+    def get_extract_kwargs(self):
+        # The arguments of extract_contractnote for a note of this broker
+        return dict(num_last_pages=self.cnote_num_last_pages,
+                    summary_match_func=self.summary_match_func,
+                    summary_post_process_func=self.summary_post_process_func,
+                    numeric_columns=self.charges_numeric_columns,
+                    cache=self.extraction_cache,
+                    text_layout=self.cnote_text_layout,
+                    table_spec=self.summary_table_spec,
+                    layout_index=self.layout_index,
+                    memory_limit=self.cnote_memory_limit,
+                    lattice_settings=self.lattice_settings)
+
+    def get_worker_spec(self):
+        # How a queue worker recreates this broker: by name from broker_configs, with the options
+        # of this instance that change the extraction. Functions and layouts are not sent.
+        broker_options = dict(cnote_engine=self.cnote_engine,
+                              cnote_num_last_pages=self.cnote_num_last_pages,
+                              cnote_cache=self.cnote_cache,
+                              cnote_cache_max_size=self.cnote_cache_max_size,
+                              cnote_memory_limit=self.cnote_memory_limit)
+        return {'broker': self.name,
+                'input_path_prefix': self.input_path_prefix,
+                'compute_path_prefix': self.compute_path_prefix,
+                'broker_options': broker_options}
+
+    def iter_contract_notes(self, start_date=None, end_date=None, max_count=0, workers=1, skip_processed=True, executor=None, jobs=None, queue=None):
+        # With jobs, only the given (pdf_file_path, date) pairs are extracted instead of the whole folder
+        extract_kwargs = dict(self.get_extract_kwargs(),
+                              max_count=max_count,
+                              workers=workers,
+                              executor=executor,
+                              queue=queue,
+                              queue_spec=self.get_worker_spec() if queue is not None else None)
+        if jobs is not None:
+            return iter_contractnotes(jobs, **extract_kwargs)
+
+        processed_index = None
+        if skip_processed:
+            index_df = self.charges_store.read(columns=[self.charges_date_column, 'Document'])
+            processed_index = get_processed_index(index_df, date_column=self.charges_date_column)
+
+        return iter_contractnotes_folder(self.cnote_folder_path,
+                                         start_date=start_date,
+                                         end_date=end_date,
+                                         processed_index=processed_index,
+                                         note_index=self.note_index,
+                                         **extract_kwargs)
+
+    def read_contract_notes(self, start_date=None, end_date=None, dry_run=False, max_count=0, workers=1, executor=None, profiler=None, queue=None):
+        # With a work queue (see work_queue.py), the notes are extracted by the queue workers instead of workers/executor
+        self.cnote_failures = []
         self.summary_aggregate_df = process_contractnotes_folder(self.cnote_folder_path,
-                                                                 charges_aggregate_file_path=self.charges_file_path,
+                                                                 charges_store=self.charges_store,
                                                                  num_last_pages=self.cnote_num_last_pages,
                                                                  summary_match_func=self.summary_match_func,
                                                                  summary_post_process_func=self.summary_post_process_func,
@@ -368,40 +1065,158 @@ class Broker(Provider):
                                                                  start_date=start_date,
                                                                  end_date=end_date,
                                                                  dry_run=dry_run,
-                                                                 max_count=max_count)
-
-    def reconcile(self, start_date=None, end_date=None):
-        self.reconciled_df = reconcile_charges_and_ledger(self.tradeledger_df,
-                                                          self.summary_aggregate_df,
-                                                          ledger_date_column=self.fledger_date_column,
-                                                          charges_date_column=self.charges_date_column)
-
-        self.missing_missing_df = find_missing_entries(self.reconciled_df,
-                                                       ledger_date_column=self.fledger_date_column,
-                                                       charges_date_column=self.charges_date_column)
-
-        if len(self.missing_missing_df) == 0:
-            debug_log(f"Now we should look for mismatch entries")
-
-    def report(self):
-        if len(self.missing_missing_df):
-            print('Missing Entries')
-            charges_document_name = f'{self.name} Charges Aggregate'
-            financialledger_document_name = f'{self.name} Financial Ledger'
-
-            generate_report_from_unmatched(self.missing_missing_df,
-                                           left_on=self.fledger_date_column,
-                                           right_on=self.charges_date_column,
-                                           left_report=financialledger_document_name,
-                                           right_report=charges_document_name)
+                                                                 max_count=max_count,
+                                                                 workers=workers,
+                                                                 failures=self.cnote_failures,
+                                                                 cache=self.extraction_cache,
+                                                                 executor=executor,
+                                                                 profiler=profiler,
+                                                                 text_layout=self.cnote_text_layout,
+                                                                 table_spec=self.summary_table_spec,
+                                                                 layout_index=self.layout_index,
+                                                                 memory_limit=self.cnote_memory_limit,
+                                                                 lattice_settings=self.lattice_settings,
+                                                                 note_index=self.note_index,
+                                                                 journal=self.cnote_journal,
+                                                                 rollup=self.charges_rollup,
+                                                                 queue=queue,
+                                                                 queue_spec=self.get_worker_spec() if queue is not None else None)
+
+    def calibrate_lattice(self, start_date=None, end_date=None, sample_count=DEFAULT_CALIBRATION_SAMPLES):
+        # Learns the lattice settings of cnote_engine 'tuned' from notes spread over the date range,
+        # so that a change of layout over time is part of the sample
+        notes = [pdf_file_path for (pdf_file_path, date) in iter_contractnote_files(self.cnote_folder_path,
+                                                                                   start_date=start_date,
+                                                                                   end_date=end_date,
+                                                                                   note_index=self.note_index,
+                                                                                   verbose=False)]
+        if not notes:
+            raise RuntimeError(f"No contract notes to calibrate from in '{self.cnote_folder_path}'")
+
+        sample_count = min(sample_count, len(notes))
+        sample = [notes[int(i * len(notes) / sample_count)] for i in range(sample_count)]
+        print(f"Calibrating the lattice settings of {self.name} on {sample_count} contract notes")
+        (settings, calibration) = calibrate_lattice_settings(sample,
+                                                             num_last_pages=self.cnote_num_last_pages,
+                                                             summary_match_func=self.summary_match_func,
+                                                             table_spec=self.summary_table_spec)
+        print(f"    defaults: {calibration['reference_ms_per_page']} ms per page")
+        for candidate in calibration['candidates']:
+            outcome = f"{candidate['ms_per_page']} ms per page" if candidate['identical'] else "different tables"
+            print(f"    {candidate['settings']}: {outcome}")
+        print(f"Selected lattice settings: {calibration['selected']}")
+
+        save_lattice_settings(self.lattice_settings_file_path, settings, calibration)
+        if self.cnote_engine == 'tuned':
+            self.lattice_settings = settings or LatticeSettings()
+        return settings
+
+    def read_charges(self, start_date=None, end_date=None):
+        # The charges aggregate as already written by read_contract_notes, without opening any contract note
+        if not self.charges_store.exists():
+            raise RuntimeError(f"No charges aggregate at '{self.charges_file_path}', read the contract notes first")
+
+        charges_df = self.charges_store.read()
+        self.summary_aggregate_df = filter_date_range(charges_df, self.charges_date_column, start_date=start_date, end_date=end_date)
+        df_print(self.summary_aggregate_df, active=False)
+
+    def read_rollup(self, period='month', start_date=None, end_date=None):
+        # The charges totals by period ('month', 'quarter' or 'fy') and segment, from the rollup
+        # kept with the charges aggregate, which is only read if it changed outside of this broker
+        if self.charges_rollup is None:
+            raise RuntimeError(f"Broker {self.name} has no charges_rollup")
+        if not self.charges_store.exists():
+            raise RuntimeError(f"No charges aggregate at '{self.charges_file_path}', read the contract notes first")
+
+        self.charges_rollup.sync(self.charges_store)
+        return self.charges_rollup.query(period, start_date=start_date, end_date=end_date)
+
+    def read_report(self, input_file_path=None):
+        if input_file_path is None:
+            input_file_path = self.reconciliation_file_path
+
+        if not os.path.exists(input_file_path):
+            raise RuntimeError(f"No reconciliation report at '{input_file_path}', reconcile first")
+
+        self.reconciled_df = read_reconciliation_report(input_file_path)
+        self.missing_missing_df = self.reconciled_df[self.reconciled_df['Status'].isin(MISSING_STATUSES)]
+        self.mismatch_df = self.reconciled_df[self.reconciled_df['Status'] == STATUS_AMOUNT_MISMATCH]
+
+    def export_charges(self, output_file_path=None):
+        if output_file_path is None:
+            output_file_path = self.charges_export_file_path
+
+        if os.path.abspath(output_file_path) == os.path.abspath(self.charges_file_path):
+            return
+
+        print(f"Exporting charges aggregate to '{output_file_path}'")
+        self.charges_store.export_excel(output_file_path)
+
+    def reconcile(self, start_date=None, end_date=None, dates=None):
+        # The charges of a run are those of the whole aggregate, only its dates within the range are reconciled
+        ledger_df = self.tradeledger_df
+        if len(ledger_df):
+            ledger_df = filter_date_range(ledger_df, self.fledger_date_column, start_date=start_date, end_date=end_date)
+        charges_df = self.summary_aggregate_df
+        if len(charges_df):
+            charges_df = filter_date_range(charges_df, self.charges_date_column, start_date=start_date, end_date=end_date)
+        if dates is not None:
+            # Only the given dates are reconciled, as done by the watcher after new notes arrive
+            dates = list(dates)
+            ledger_df = ledger_df[ledger_df[self.fledger_date_column].isin(dates)]
+            if len(charges_df):
+                charges_df = charges_df[charges_df[self.charges_date_column].isin(dates)]
+
+        # One row per date with the summed ledger and contract note amounts and a status
+        self.reconciled_df = reconcile_amounts(ledger_df,
+                                               charges_df,
+                                               ledger_date_column=self.fledger_date_column,
+                                               charges_date_column=self.charges_date_column,
+                                               charges_amount_column=self.charges_amount_column,
+                                               ledger_debit_column=self.fledger_debit_column,
+                                               ledger_credit_column=self.fledger_credit_column,
+                                               tolerance=self.reconcile_tolerance)
+
+        self.missing_missing_df = self.reconciled_df[self.reconciled_df['Status'].isin(MISSING_STATUSES)]
+        self.mismatch_df = self.reconciled_df[self.reconciled_df['Status'] == STATUS_AMOUNT_MISMATCH]
+
+    def report(self, output_file_path=None):
+        counts = summarize_reconciliation(self.reconciled_df)
+        print(f"{self.name} reconciliation: " + ', '.join(f"{count} {status}" for (status, count) in counts.items()))
+
+        unmatched_df = self.reconciled_df[self.reconciled_df['Status'] != STATUS_MATCHED]
+        if len(unmatched_df):
+            print(unmatched_df.to_string(index=False))
         else:
-            debug_log(f"There are no missing entries!", location=False)
-
-    def compute(self, start_date=None, end_date=None, dry_run=False, max_count=0):
-        self.read_ledger(start_date=start_date, end_date=end_date)
-        self.read_contract_notes(start_date=start_date, end_date=end_date, dry_run=dry_run, max_count=max_count)
-        self.reconcile(start_date=start_date, end_date=end_date)
-        self.report()
+            debug_log(f"There are no missing or mismatched entries!", location=False)
+
+        if output_file_path is not None:
+            write_reconciliation_report(self.reconciled_df, output_file_path)
+            print(f"Reconciliation report written to '{output_file_path}'")
+
+    def compute(self, start_date=None, end_date=None, dry_run=False, max_count=0, workers=1, export=False, profiler=None, queue=None):
+        run_timer = NULL_TIMER
+        if profiler is not None:
+            run_timer = profiler.run_timer
+            profiler.start()
+
+        try:
+            with run_timer('ledger'):
+                self.read_ledger(start_date=start_date, end_date=end_date)
+            with run_timer('contract_notes'):
+                self.read_contract_notes(start_date=start_date, end_date=end_date, dry_run=dry_run, max_count=max_count,
+                                         workers=workers, profiler=profiler, queue=queue)
+            if export and not dry_run:
+                with run_timer('export'):
+                    self.export_charges()
+            with run_timer('reconcile'):
+                self.reconcile(start_date=start_date, end_date=end_date)
+            with run_timer('report'):
+                self.report(output_file_path=None if dry_run else self.reconciliation_file_path)
+        finally:
+            if profiler is not None:
+                profiler.close()
+                profiler.print_summary()
 
 
 
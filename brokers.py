@@ -0,0 +1,178 @@
+# Broker definitions: how the ledger and the contract notes of each broker are read.
+# Importing this module only defines them, the brokers are created by create_broker.
+
+from broker import Broker
+from utils.debug import debug_log, lazy
+
+
+def zerodha_post_process_fledger_dataframe(df):
+    return df[df['Voucher Type'] == 'Book Voucher']
+
+
+def zerodha_match_summary_dataframe(df, page_num=None):
+    if df.shape == (11, 5) or df.shape == (11, 4):
+        return {'tag': 'Charges'}
+
+    return None
+
+
+zerodha_numeric_columns = ['Equity', 'Equity (T+1)', 'Futures and Options', 'NET TOTAL']
+
+
+zerodha_summary_layout = {
+    'numeric_columns': zerodha_numeric_columns,
+    'fill_columns': ['Equity (T+1)'],
+    # Between the pay in/pay out obligation and the net amount
+    'sum_rows': '1:-1',
+    # The net amount receivable/(payable) by the client, matched against the ledger Book Voucher
+    'row_values': [{'row': -1, 'columns': {'Net-Total': 'NET TOTAL'}}],
+}
+
+
+# Totals by period kept with the charges aggregate, see charges_rollup.py
+zerodha_charges_rollup = {
+    'Charges': {'Equity': 'Equity', 'Equity (T+1)': 'Equity (T+1)', 'F&O': 'Futures and Options', 'Total': 'NET TOTAL'},
+    'Net': {'Total': 'Net-Total'},
+}
+
+
+# Checked on the raw cells of every detected table before it is converted, the 4 column variant has no Equity (T+1)
+zerodha_summary_table = {
+    'header_labels': ['Equity', 'Futures and Options', 'NET TOTAL'],
+    'row_labels': ['Pay in/Pay out obligation', 'Net amount receivable'],
+    'num_rows': 11,
+    'num_columns': [4, 5],
+}
+
+
+# Used by the text layer extractor (cnote_engine='text') instead of Camelot
+zerodha_text_layout = {
+    'header_labels': zerodha_numeric_columns,
+    'num_rows': 11,
+    'row_total': {'columns': ['Equity', 'Equity (T+1)', 'Futures and Options'], 'total': 'NET TOTAL'},
+}
+
+
+zerodha_broker_config = dict(fledger_date_column='Posting Date',
+                             fledger_post_process_func=zerodha_post_process_fledger_dataframe,
+                             cnote_num_last_pages=2,
+                             charges_date_column='Date',
+                             charges_numeric_columns=zerodha_numeric_columns,
+                             charges_amount_column='Net-Total',
+                             charges_rollup=zerodha_charges_rollup,
+                             summary_match_func=zerodha_match_summary_dataframe,
+                             summary_layout=zerodha_summary_layout,
+                             summary_table=zerodha_summary_table,
+                             cnote_text_layout=zerodha_text_layout
+                             )
+
+axisdirect_numeric_columns = ['NCL-EQUITY', 'NCL F&O', 'NCL CDX', 'Total(Net)']
+
+
+def axisdirect_post_process_fledger_dataframe(df):
+    # Filter rows where Bill number is specified
+    new_df = df[df["Bill No."].notnull()]
+
+    return new_df
+
+
+NUM_TRADE_COLUMNS = 12
+NUM_CHARGES_COLUMNS = 6
+
+
+def axisdirect_match_dataframe(df, page_num=None):
+    if page_num is not None:
+        debug_log(lazy(lambda: f"PageNum:{page_num} Detected table {df.shape} "), active=False)
+
+    num_rows, num_columns = df.shape
+
+    # if num_rows == NUM_TRADE_COLUMNS:
+    #     return True
+
+    # df_print(df, shape=True, active=True)
+
+    # len_df = df.map(lambda cell: len(str(cell)))
+    debug_log(df.columns)
+
+    if num_columns == NUM_CHARGES_COLUMNS:
+        return {'tag': 'Charges'}
+
+    return None
+
+
+axisdirect_summary_layout = {
+    'numeric_columns': axisdirect_numeric_columns,
+    'aggregates': {
+        'columns': {'-EQ': 'NCL-EQUITY', '-FnO': 'NCL F&O', '': 'Total(Net)'},
+        'rows': [
+            {'name': 'Brokerage', 'row': 1, 'aggregate': 'Brokerage'},
+            {'name': 'ExchangeCharges', 'row': 2, 'aggregate': 'ExchangeCharges'},
+            {'name': 'SEBIFees', 'row': 3, 'aggregate': 'SEBIFees'},
+            # {'name': 'TaxableCharges', 'row': 4, 'aggregate': 'TaxableCharges'},
+            {'name': 'CGST', 'row': 6, 'aggregate': 'GST'},
+            {'name': 'SGST', 'row': 8, 'aggregate': 'GST'},
+            {'name': 'IGST', 'row': 10, 'aggregate': 'GST'},
+            {'name': 'UTGST', 'row': 12, 'aggregate': 'GST'},
+            {'name': 'STT', 'row': 13, 'aggregate': 'STT'},
+            {'name': 'StampDuty', 'row': 14, 'aggregate': 'StampDuty'},
+        ],
+    },
+    'row_values': [
+        {'row': 0, 'columns': {'Gross-EQ': 'NCL-EQUITY', 'Gross-FnO': 'NCL F&O', 'Gross-Total': 'Total(Net)'}},
+        {'row': 15, 'columns': {'Net-EQ': 'NCL-EQUITY', 'Net-FnO': 'NCL F&O', 'Net-Total': 'Total(Net)'}},
+    ],
+    'differences': [
+        ('NetGrossDiff', 'Net-Total', 'Gross-Total'),
+        ('Status', 'NetGrossDiff', 'Total(Net)'),
+    ],
+}
+
+
+# The -EQ and -FnO aggregates of the summary layout, with their totals across segments
+axisdirect_charges_rollup = {
+    measure: {'EQ': f'{measure}-EQ', 'FnO': f'{measure}-FnO', 'Total': measure}
+    for measure in ['Brokerage', 'GST', 'STT', 'StampDuty', 'ExchangeCharges', 'SEBIFees']
+}
+axisdirect_charges_rollup['Net'] = {'EQ': 'Net-EQ', 'FnO': 'Net-FnO', 'Total': 'Net-Total'}
+
+
+axisdirect_summary_table = {
+    'header_labels': axisdirect_numeric_columns,
+    'num_columns': NUM_CHARGES_COLUMNS,
+}
+
+
+axisdirect_text_layout = {
+    'header_labels': axisdirect_numeric_columns,
+    'num_rows': 16,
+    'row_total': {'columns': ['NCL-EQUITY', 'NCL F&O', 'NCL CDX'], 'total': 'Total(Net)', 'skip_rows': [5, 7, 9, 11]},
+}
+
+
+axisdirect_broker_config = dict(fledger_date_column='Trn Date',
+                                fledger_date_format='%d-%b-%y',
+                                fledger_post_process_func=axisdirect_post_process_fledger_dataframe,
+                                cnote_num_last_pages=4,
+                                charges_date_column='Date',
+                                charges_numeric_columns=axisdirect_numeric_columns,
+                                charges_amount_column='Net-Total',
+                                charges_rollup=axisdirect_charges_rollup,
+                                summary_match_func=axisdirect_match_dataframe,
+                                summary_layout=axisdirect_summary_layout,
+                                summary_table=axisdirect_summary_table,
+                                cnote_text_layout=axisdirect_text_layout
+                                )
+
+# Used by the command line, the batch runner and the watcher to create brokers for other accounts and path prefixes
+broker_configs = {
+    'Zerodha': zerodha_broker_config,
+    'Axisdirect': axisdirect_broker_config,
+}
+
+
+def create_broker(name, *, input_path_prefix='data', compute_path_prefix='compute', **kwargs):
+    if name not in broker_configs:
+        raise RuntimeError(f"broker '{name}' is not defined, expected one of {list(broker_configs)}")
+
+    config = dict(broker_configs[name], **kwargs)
+    return Broker(name, input_path_prefix=input_path_prefix, compute_path_prefix=compute_path_prefix, **config)
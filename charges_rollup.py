@@ -0,0 +1,145 @@
+import json
+import os
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+
+ROLLUP_VERSION = 1
+
+# A rollup spec names the columns of the charges aggregate that are totalled, by measure and segment:
+#
+#   {measure: {segment: column}}
+#
+# e.g. {'Brokerage': {'EQ': 'Brokerage-EQ', 'FnO': 'Brokerage-FnO', 'Total': 'Brokerage'}}.
+# The totals are kept per month as integers scaled by 10**scale, so that they stay exact however
+# many notes are added, and the quarters and financial years are summed from their months.
+PERIODS = ['month', 'quarter', 'fy']
+
+# Indian financial years run from April to March, the quarters are those of the financial year
+FY_START_MONTH = 4
+
+
+def get_period_key(month, period):
+    # month is 'YYYY-MM', e.g. '2023-02' is in quarter 'FY2022-23 Q4' of financial year 'FY2022-23'
+    if period == 'month':
+        return month
+
+    (year, month_num) = (int(month[0:4]), int(month[5:7]))
+    start_year = year if month_num >= FY_START_MONTH else year - 1
+    fy = f"FY{start_year}-{(start_year + 1) % 100:02d}"
+    if period == 'fy':
+        return fy
+    return f"{fy} Q{(month_num - FY_START_MONTH) % 12 // 3 + 1}"
+
+
+class ChargesRollup:
+    # Monthly totals of the charges aggregate by measure and segment, kept up to date with the rows
+    # added to and removed from the store instead of being grouped again from every note row. The
+    # signature of the store files is saved with the totals, when the store was changed by anything
+    # else the totals are rebuilt from it once.
+    def __init__(self, rollup_file_path, rollup_spec, *, date_column='Date', scale=4):
+        self.rollup_file_path = rollup_file_path
+        self.date_column = date_column
+        self.scale = scale
+        self.measures = list(rollup_spec)
+        self.segments = list(dict.fromkeys(segment for columns in rollup_spec.values() for segment in columns))
+        self.columns = []
+        self.positions = {}
+        for (measure, columns) in rollup_spec.items():
+            for (segment, column) in columns.items():
+                self.positions[(measure, segment)] = len(self.columns)
+                self.columns.append(column)
+        self.identity = {'spec': rollup_spec, 'date_column': date_column, 'scale': scale}
+        self.months = {}
+        self.signature = None
+
+        if os.path.exists(rollup_file_path):
+            with open(rollup_file_path) as f:
+                rollup = json.load(f)
+            if rollup.get('version') == ROLLUP_VERSION and rollup.get('identity') == self.identity:
+                self.months = rollup['months']
+                self.signature = rollup['signature']
+
+    def apply(self, charges_df, sign=1):
+        # Adds (or with sign -1 subtracts) the rows of charges_df to the totals of their months
+        if charges_df is None or not len(charges_df):
+            return
+
+        factor = 10 ** self.scale
+        scaled = np.zeros((len(charges_df), len(self.columns)), dtype=np.int64)
+        for (position, column) in enumerate(self.columns):
+            if column in charges_df.columns:
+                values = pd.to_numeric(charges_df[column], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+                scaled[:, position] = np.rint(np.nan_to_num(values) * factor)
+
+        months = charges_df[self.date_column].astype(str).str.slice(0, 7).to_numpy()
+        month_totals = pd.DataFrame(scaled).groupby(months, sort=True).sum()
+        for (month, values) in zip(month_totals.index, month_totals.to_numpy().tolist()):
+            totals = self.months.get(month, [0] * len(self.columns))
+            self.months[month] = [total + sign * value for (total, value) in zip(totals, values)]
+
+    def rebuild(self, charges_store):
+        print(f"Rebuilding charges rollup '{self.rollup_file_path}' from the charges aggregate")
+        self.months = {}
+        self.apply(charges_store.read())
+        self.signature = charges_store.get_signature()
+        self.save()
+
+    def sync(self, charges_store):
+        if self.signature != charges_store.get_signature():
+            self.rebuild(charges_store)
+
+    def update(self, charges_store, previous_signature, *, added_df=None, removed_df=None):
+        # Called after the store was changed from previous_signature by adding and removing these rows
+        if not previous_signature:
+            # The store was empty, so are the totals
+            self.months = {}
+        elif self.signature != previous_signature:
+            self.rebuild(charges_store)
+            return
+
+        self.apply(removed_df, sign=-1)
+        self.apply(added_df)
+        self.signature = charges_store.get_signature()
+        self.save()
+
+    def query(self, period='month', start_date=None, end_date=None):
+        # One row per period and segment with a Decimal column per measure. The range is applied to
+        # whole months, a month is included when its first day is within [start_date, end_date).
+        if period not in PERIODS:
+            raise RuntimeError(f"period '{period}' is not one of {PERIODS}")
+
+        totals = {}
+        for month in sorted(self.months):
+            if (start_date and f"{month}-01" < start_date) or (end_date and f"{month}-01" >= end_date):
+                continue
+            key = get_period_key(month, period)
+            if key in totals:
+                totals[key] = [total + value for (total, value) in zip(totals[key], self.months[month])]
+            else:
+                totals[key] = list(self.months[month])
+
+        rows = []
+        for (key, values) in totals.items():
+            for segment in self.segments:
+                row = [key, segment]
+                for measure in self.measures:
+                    position = self.positions.get((measure, segment))
+                    row.append(Decimal(values[position]).scaleb(-self.scale) if position is not None else None)
+                rows.append(row)
+        return pd.DataFrame(rows, columns=['Period', 'Segment'] + self.measures)
+
+    def save(self):
+        output_folder = os.path.dirname(self.rollup_file_path)
+        if output_folder and not os.path.exists(output_folder):
+            os.makedirs(output_folder)
+
+        rollup = {'version': ROLLUP_VERSION,
+                  'identity': self.identity,
+                  'signature': self.signature,
+                  'months': self.months}
+        with open(self.rollup_file_path + '.tmp', 'w') as f:
+            json.dump(rollup, f)
+        os.replace(self.rollup_file_path + '.tmp', self.rollup_file_path)
@@ -0,0 +1,242 @@
+import os
+import re
+import uuid
+from datetime import datetime
+
+import pandas as pd
+
+
+# Workbooks written before the index was left out have it as a first 'Unnamed: 0' column, and
+# every later read and rewrite added one more
+legacy_index_column_regex = re.compile(r"^Unnamed: 0(\.\d+)?$")
+
+
+def read_excel_aggregate(file_path):
+    aggregate_df = pd.read_excel(file_path)
+    return aggregate_df.drop(columns=[column for column in aggregate_df.columns if legacy_index_column_regex.match(str(column))])
+
+
+class ExcelChargesStore:
+    # The whole aggregate lives in one workbook that is rewritten on every append
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.aggregate_df = None
+
+    def exists(self):
+        return os.path.exists(self.file_path)
+
+    def get_signature(self):
+        # Changes whenever the workbook is rewritten
+        return [get_file_signature(self.file_path)] if self.exists() else []
+
+    def read(self, columns=None):
+        if not self.exists():
+            return pd.DataFrame()
+
+        if self.aggregate_df is None:
+            print(f"Reading charges aggregate file '{self.file_path}'")
+            self.aggregate_df = read_excel_aggregate(self.file_path)
+
+        if columns is not None:
+            return self.aggregate_df[[column for column in columns if column in self.aggregate_df.columns]]
+        return self.aggregate_df
+
+    def append(self, charges_df, dry_run=False):
+        aggregate_df = pd.concat([self.read(), charges_df], axis=0)
+        if dry_run:
+            return
+
+        self.write(aggregate_df)
+
+    def write(self, aggregate_df):
+        # Written under a temporary name and renamed, so that a crash never leaves a partial workbook
+        create_folder(self.file_path)
+        (base_path, extension) = os.path.splitext(self.file_path)
+        tmp_file_path = f"{base_path}.tmp{extension}"
+        aggregate_df.to_excel(tmp_file_path, index=False)
+        os.replace(tmp_file_path, self.file_path)
+        self.aggregate_df = aggregate_df
+
+    def remove_documents(self, document_paths, *, document_column='Document', dry_run=False):
+        # Returns the rows that were removed
+        aggregate_df = self.read()
+        mask = get_document_mask(aggregate_df, document_paths, document_column)
+        removed_df = aggregate_df[mask]
+        if dry_run or not len(removed_df):
+            return removed_df
+
+        self.write(aggregate_df[~mask])
+        return removed_df
+
+    def import_excel_aggregate(self):
+        # Already a workbook, there is nothing to import
+        pass
+
+    def export_excel(self, output_file_path):
+        aggregate_df = self.read()
+        create_folder(output_file_path)
+        aggregate_df.to_excel(output_file_path, index=False)
+
+
+class PartitionedChargesStore:
+    # Columnar store partitioned as <folder>/year=YYYY/month=MM/part-*.<format>.
+    # An append only adds new part files, nothing already written is rewritten.
+    # With an excel_file_path, the workbook of an aggregate written before the switch to this
+    # store is read in its place until the first change, which imports it once.
+    def __init__(self, folder_path, *, date_column='Date', file_format='parquet', excel_file_path=None):
+        if file_format not in ['parquet', 'feather']:
+            raise RuntimeError(f"file_format '{file_format}' is not supported")
+
+        self.folder_path = folder_path
+        self.date_column = date_column
+        self.file_format = file_format
+        self.excel_file_path = excel_file_path
+
+    def has_excel_aggregate(self):
+        # Until the store folder is created, it never is again once the workbook was imported
+        return (self.excel_file_path is not None and os.path.exists(self.excel_file_path)
+                and not os.path.exists(self.folder_path))
+
+    def import_excel_aggregate(self):
+        if not self.has_excel_aggregate():
+            return
+
+        print(f"Importing charges aggregate '{self.excel_file_path}' into '{self.folder_path}'")
+        aggregate_df = read_excel_aggregate(self.excel_file_path)
+        aggregate_df[self.date_column] = aggregate_df[self.date_column].astype(str)
+        os.makedirs(self.folder_path, exist_ok=True)
+        self.append(aggregate_df)
+
+    def exists(self):
+        return len(self.get_part_file_paths()) > 0 or self.has_excel_aggregate()
+
+    def get_signature(self):
+        # Changes whenever a part file is added, rewritten or removed
+        if self.has_excel_aggregate():
+            return [get_file_signature(self.excel_file_path)]
+        return [get_file_signature(part_file_path) for part_file_path in self.get_part_file_paths()]
+
+    def get_part_file_paths(self):
+        part_file_paths = []
+        if not os.path.exists(self.folder_path):
+            return part_file_paths
+
+        for (root, dirs, files) in os.walk(self.folder_path):
+            dirs.sort()
+            for file in sorted(files):
+                if file.startswith('part-') and file.endswith(f'.{self.file_format}'):
+                    part_file_paths.append(os.path.join(root, file))
+        return part_file_paths
+
+    def read_part(self, part_file_path, columns=None):
+        if self.file_format == 'parquet':
+            import pyarrow.parquet as pq
+            if columns is not None:
+                schema_columns = pq.read_schema(part_file_path).names
+                columns = [column for column in columns if column in schema_columns]
+            return pd.read_parquet(part_file_path, columns=columns)
+
+        df = pd.read_feather(part_file_path)
+        if columns is not None:
+            df = df[[column for column in columns if column in df.columns]]
+        return df
+
+    def read(self, columns=None):
+        if self.has_excel_aggregate():
+            aggregate_df = read_excel_aggregate(self.excel_file_path)
+            if columns is not None:
+                return aggregate_df[[column for column in columns if column in aggregate_df.columns]]
+            return aggregate_df
+
+        part_dfs = [self.read_part(part_file_path, columns=columns) for part_file_path in self.get_part_file_paths()]
+        if not part_dfs:
+            return pd.DataFrame()
+
+        return pd.concat(part_dfs, axis=0, ignore_index=True)
+
+    def get_partition_folder_path(self, date):
+        return os.path.join(self.folder_path, f'year={date[0:4]}', f'month={date[5:7]}')
+
+    def append(self, charges_df, dry_run=False):
+        if dry_run or charges_df is None or charges_df.empty:
+            return
+
+        self.import_excel_aggregate()
+        charges_df = charges_df.reset_index(drop=True)
+        part_name = f"part-{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}.{self.file_format}"
+        for (date_key, partition_df) in charges_df.groupby(charges_df[self.date_column].str.slice(0, 7), sort=True):
+            partition_folder_path = self.get_partition_folder_path(date_key)
+            os.makedirs(partition_folder_path, exist_ok=True)
+
+            # Written under a temporary name so that readers never see a partial part
+            self.write_part(partition_df, os.path.join(partition_folder_path, part_name))
+
+    def write_part(self, part_df, part_file_path):
+        tmp_file_path = part_file_path + '.tmp'
+        part_df = part_df.reset_index(drop=True)
+        if self.file_format == 'parquet':
+            part_df.to_parquet(tmp_file_path, index=False)
+        else:
+            part_df.to_feather(tmp_file_path)
+        os.replace(tmp_file_path, part_file_path)
+
+    def remove_documents(self, document_paths, *, document_column='Document', dry_run=False):
+        # Only the part files holding one of the documents are rewritten, the others are left alone
+        if not dry_run:
+            self.import_excel_aggregate()
+        elif self.has_excel_aggregate():
+            aggregate_df = self.read()
+            return aggregate_df[get_document_mask(aggregate_df, document_paths, document_column)]
+
+        removed_dfs = []
+        for part_file_path in self.get_part_file_paths():
+            part_df = self.read_part(part_file_path)
+            mask = get_document_mask(part_df, document_paths, document_column)
+            if not mask.any():
+                continue
+
+            removed_dfs.append(part_df[mask])
+            if dry_run:
+                continue
+
+            if mask.all():
+                os.remove(part_file_path)
+            else:
+                self.write_part(part_df[~mask], part_file_path)
+
+        if not removed_dfs:
+            return pd.DataFrame()
+        return pd.concat(removed_dfs, axis=0, ignore_index=True)
+
+    def export_excel(self, output_file_path):
+        aggregate_df = self.read()
+        create_folder(output_file_path)
+        aggregate_df.to_excel(output_file_path, index=False)
+
+
+def create_folder(file_path):
+    output_folder = os.path.dirname(file_path)
+    if output_folder and not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+
+
+def get_file_signature(file_path):
+    stat = os.stat(file_path)
+    return [os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size]
+
+
+def get_document_mask(df, document_paths, document_column='Document'):
+    if not len(df) or document_column not in df.columns:
+        return pd.Series(False, index=df.index)
+
+    document_paths = set(os.path.normpath(path) for path in document_paths)
+    documents = df[document_column].map(lambda x: os.path.normpath(x) if isinstance(x, str) else None)
+    return documents.isin(document_paths)
+
+
+def get_charges_store(file_path, *, output_format='parquet', date_column='Date', excel_file_path=None):
+    # excel_file_path is the workbook of the aggregate before it moved to a partitioned store
+    if output_format == 'xlsx':
+        return ExcelChargesStore(file_path)
+
+    return PartitionedChargesStore(file_path, date_column=date_column, file_format=output_format, excel_file_path=excel_file_path)
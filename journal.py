@@ -0,0 +1,137 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from summary_layout import ChargesRecord, ChargesSchema
+
+
+JOURNAL_VERSION = 1
+
+STATUS_EXTRACTED = 'extracted'
+STATUS_FAILED = 'failed'
+
+
+def encode_charges(charges):
+    if isinstance(charges, ChargesRecord):
+        return {'columns': list(charges.schema.columns), 'scale': charges.schema.scale, 'values': charges.values.tolist()}
+
+    # A DataFrame from a custom post-process function
+    return {'frame': json.loads(charges.to_json(orient='split', index=False, double_precision=15))}
+
+
+def decode_charges(encoded, date, document, schemas):
+    if 'frame' in encoded:
+        frame = encoded['frame']
+        return pd.DataFrame(frame['data'], columns=frame['columns'])
+
+    # The decoded records share their schema, as they do when extracted
+    key = (tuple(encoded['columns']), encoded['scale'])
+    if key not in schemas:
+        schemas[key] = ChargesSchema(*key)
+    return ChargesRecord(schemas[key], np.array(encoded['values'], dtype=float), date, document)
+
+
+class NoteJournal:
+    # An append-only log of the notes extracted by a run, one JSON line per note. Every line is
+    # flushed to disk before the next note is extracted, so an interrupted run resumes from the
+    # journal instead of extracting the same notes again. A line cut short by a crash is ignored.
+    # The journal is cleared once its notes are in the charges aggregate.
+    def __init__(self, journal_file_path):
+        self.journal_file_path = journal_file_path
+        self.file = None
+        self.schemas = {}
+
+    def exists(self):
+        return os.path.exists(self.journal_file_path)
+
+    def read(self):
+        # The last entry of each document, in the order the documents were first journaled
+        entries = {}
+        if not self.exists():
+            return entries
+
+        with open(self.journal_file_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get('version') != JOURNAL_VERSION:
+                    continue
+                entries[os.path.normpath(entry['document'])] = entry
+        return entries
+
+    def get_extracted(self, processed_index=None, start_date=None, end_date=None):
+        # (date, document, charges) of the notes extracted by an earlier run that are not yet in the aggregate,
+        # dated within [start_date, end_date)
+        extracted = []
+        for (document, entry) in self.read().items():
+            # Failed notes and notes without charges are extracted again
+            if entry['status'] != STATUS_EXTRACTED or not ('values' in entry or 'frame' in entry):
+                continue
+            if (start_date or end_date) and not entry['date']:
+                continue
+            if (start_date and entry['date'] < start_date) or (end_date and entry['date'] >= end_date):
+                continue
+            if processed_index and ((entry['date'], document) in processed_index or (entry['date'], None) in processed_index):
+                continue
+            extracted.append((entry['date'], document, decode_charges(entry, entry['date'], entry['document'], self.schemas)))
+        return extracted
+
+    def append(self, result):
+        entry = {'version': JOURNAL_VERSION, 'document': result.pdf_file_path, 'date': result.date}
+        if result.error is not None:
+            entry['status'] = STATUS_FAILED
+            entry['error'] = result.error
+        else:
+            entry['status'] = STATUS_EXTRACTED
+            if result.has_charges():
+                entry.update(encode_charges(result.charges))
+
+        if self.file is None:
+            output_folder = os.path.dirname(self.journal_file_path)
+            if output_folder and not os.path.exists(output_folder):
+                os.makedirs(output_folder)
+            self.file = open(self.journal_file_path, 'a')
+            # A crash can leave a partial last line, the first entry must not be appended to it
+            if not self.ends_with_newline():
+                self.file.write('\n')
+
+        # One write per line, so a crash leaves at most a partial last line
+        self.file.write(json.dumps(entry) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def ends_with_newline(self):
+        with open(self.journal_file_path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                return True
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def clear(self, documents=None):
+        # Removes the entries of these documents, all of them by default
+        self.close()
+        if not self.exists():
+            return
+
+        entries = []
+        if documents is not None:
+            documents = set(os.path.normpath(document) for document in documents)
+            entries = [entry for (document, entry) in self.read().items() if document not in documents]
+        if not entries:
+            os.remove(self.journal_file_path)
+            return
+
+        with open(self.journal_file_path + '.tmp', 'w') as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + '\n')
+        os.replace(self.journal_file_path + '.tmp', self.journal_file_path)
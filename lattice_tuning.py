@@ -0,0 +1,151 @@
+import json
+import math
+import os
+
+
+LATTICE_SETTINGS_VERSION = 1
+
+# Camelot's own lattice defaults
+DEFAULT_RESOLUTION = 300
+DEFAULT_LINE_SCALE = 15
+
+# Number of contract notes read by a calibration
+DEFAULT_CALIBRATION_SAMPLES = 5
+
+# Points added around the summary tables seen by the calibration to make the region of a broker
+DEFAULT_REGION_MARGIN = 18
+
+# The lattice settings tried by a calibration, as (engine, resolution, line_scale, use region):
+#
+#   engine      'vector' reads the ruled lines from the drawing instructions of the PDF and renders
+#               nothing, 'raster' finds them in the rendered page, 'combined' does both
+#   resolution  DPI of the rendered page, unused by the vector engine
+#   line_scale  line size scaling factor, larger values detect shorter lines
+#   use region  whether only the region of the summary table is rendered and searched for tables
+#
+# The last one renders the same pixels as Camelot, so it is always kept when nothing faster is.
+CALIBRATION_CANDIDATES = [
+    ('vector', DEFAULT_RESOLUTION, DEFAULT_LINE_SCALE, True),
+    ('vector', DEFAULT_RESOLUTION, DEFAULT_LINE_SCALE, False),
+    ('raster', 150, DEFAULT_LINE_SCALE, True),
+    ('combined', 150, DEFAULT_LINE_SCALE, True),
+    ('raster', 200, DEFAULT_LINE_SCALE, True),
+    ('combined', 200, DEFAULT_LINE_SCALE, True),
+    ('combined', DEFAULT_RESOLUTION, DEFAULT_LINE_SCALE, True),
+    ('combined', DEFAULT_RESOLUTION, DEFAULT_LINE_SCALE, False),
+]
+
+
+class PageRenderBackend:
+    # A Camelot image conversion backend that renders with pdfium straight into the BGR array read
+    # by the lattice parser, instead of going through a PIL image and two channel swaps. With a
+    # region (x1, y1, x2, y2 in PDF points from the bottom left corner) only that part of the page is
+    # rendered and the rest is left white. The array keeps the size of the whole page, so the
+    # coordinates of the detected lines are unchanged.
+    def __init__(self, resolution=DEFAULT_RESOLUTION, region=None):
+        import pypdfium2
+        self.pdfium = pypdfium2
+        self.resolution = resolution
+        self.region = region
+
+    def installed(self):
+        return True
+
+    def to_array(self, pdf_path, resolution=None, page=1):
+        # Camelot does not pass the resolution to to_array, the one of the backend is used
+        import numpy as np
+
+        scale = self.resolution / 72
+        document = self.pdfium.PdfDocument(pdf_path)
+        try:
+            document.init_forms()
+            pdf_page = document[page - 1]
+            if self.region is None:
+                return pdf_page.render(scale=scale).to_numpy()
+
+            (width, height) = pdf_page.get_size()
+            (x1, y1, x2, y2) = self.region
+            crop = (max(x1, 0), max(y1, 0), max(width - x2, 0), max(height - y2, 0))
+            image = np.full((math.ceil(height * scale), math.ceil(width * scale), 3), 255, dtype=np.uint8)
+            region_image = pdf_page.render(scale=scale, crop=crop).to_numpy()
+            # pdfium offsets a cropped render by the crop rounded up to whole pixels
+            (left, top) = (math.ceil(crop[0] * scale), math.ceil(crop[3] * scale))
+            image[top:top + region_image.shape[0], left:left + region_image.shape[1]] = region_image
+            return image
+        finally:
+            document.close()
+
+    def convert(self, pdf_path, png_path, resolution=None, page=1):
+        import cv2
+        cv2.imwrite(png_path, self.to_array(pdf_path, page=page))
+
+
+# One backend per process and settings, kept across pages and notes
+render_backends = {}
+
+
+def get_render_backend(resolution, region):
+    key = (resolution, tuple(region) if region is not None else None)
+    if key not in render_backends:
+        render_backends[key] = PageRenderBackend(resolution, region)
+    return render_backends[key]
+
+
+class LatticeSettings:
+    __slots__ = ('engine', 'resolution', 'line_scale', 'region')
+
+    def __init__(self, engine='combined', resolution=DEFAULT_RESOLUTION, line_scale=DEFAULT_LINE_SCALE, region=None):
+        self.engine = engine
+        self.resolution = resolution
+        self.line_scale = line_scale
+        self.region = list(region) if region is not None else None
+
+    def __repr__(self):
+        region = ','.join(f"{value:g}" for value in self.region) if self.region is not None else 'page'
+        return f"{self.engine} {self.resolution}dpi line_scale {self.line_scale} region {region}"
+
+    def get_read_pdf_kwargs(self):
+        # The keyword arguments of camelot.read_pdf for these settings
+        kwargs = {'engine': self.engine, 'line_scale': self.line_scale}
+        if self.region is not None:
+            # Camelot regions go from the top left to the bottom right corner
+            (x1, y1, x2, y2) = self.region
+            kwargs['table_regions'] = [f"{x1},{y2},{x2},{y1}"]
+        if self.engine != 'vector':
+            kwargs['backend'] = get_render_backend(self.resolution, self.region)
+        return kwargs
+
+    def to_dict(self):
+        return {'engine': self.engine, 'resolution': self.resolution, 'line_scale': self.line_scale, 'region': self.region}
+
+
+def get_region(bboxes, margin=DEFAULT_REGION_MARGIN):
+    # The smallest region holding every bbox, widened by margin and rounded out to whole points
+    return [math.floor(min(bbox[0] for bbox in bboxes) - margin),
+            math.floor(min(bbox[1] for bbox in bboxes) - margin),
+            math.ceil(max(bbox[2] for bbox in bboxes) + margin),
+            math.ceil(max(bbox[3] for bbox in bboxes) + margin)]
+
+
+def load_lattice_settings(settings_file_path):
+    if not os.path.exists(settings_file_path):
+        return None
+
+    with open(settings_file_path) as f:
+        content = json.load(f)
+    if content.get('version') != LATTICE_SETTINGS_VERSION or content.get('settings') is None:
+        return None
+    return LatticeSettings(**content['settings'])
+
+
+def save_lattice_settings(settings_file_path, settings, calibration=None):
+    output_folder = os.path.dirname(settings_file_path)
+    if output_folder and not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+
+    content = {'version': LATTICE_SETTINGS_VERSION,
+               'settings': settings.to_dict() if settings is not None else None,
+               'calibration': calibration}
+    with open(settings_file_path + '.tmp', 'w') as f:
+        json.dump(content, f, indent=4)
+    os.replace(settings_file_path + '.tmp', settings_file_path)
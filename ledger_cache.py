@@ -0,0 +1,129 @@
+import os
+import json
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from utils.cache import get_file_hash
+
+
+SNAPSHOT_VERSION = 2
+
+# Excel stores a date as the number of days since this day, a number cell in a date column is one
+EXCEL_EPOCH = '1899-12-30'
+
+
+def normalize_date_column(series, date_format=None):
+    # Vectorized counterpart of convert_datestr_to_isostr: strings are parsed with date_format,
+    # datetime cells are formatted as ISO, numbers are Excel date serials and anything that does
+    # not parse is left as it is.
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.dt.strftime('%Y-%m-%d').where(series.notna(), series)
+
+    # Parsed on their own, as pandas would otherwise read them as nanoseconds since 1970
+    numeric = series.map(lambda x: isinstance(x, (int, float, np.number)) and not isinstance(x, bool))
+    serials = pd.to_datetime(pd.to_numeric(series.where(numeric), errors='coerce'), unit='D', origin=EXCEL_EPOCH, errors='coerce')
+
+    if date_format is None:
+        parsed = pd.to_datetime(series.where((series.map(type) != str) & ~numeric), errors='coerce')
+    else:
+        parsed = pd.to_datetime(series.where(~numeric), format=date_format, errors='coerce')
+    parsed = parsed.where(~numeric, serials)
+    return parsed.dt.strftime('%Y-%m-%d').where(parsed.notna(), series)
+
+
+def read_financialledger_file(data_file, *, date_column='Date', date_format=None):
+    print(f"Reading financial ledger file '{data_file}'")
+    fledger_df = pd.read_excel(data_file)
+    fledger_df[date_column] = normalize_date_column(fledger_df[date_column], date_format=date_format)
+    return fledger_df
+
+
+class LedgerSnapshotCache:
+    # Keeps a typed snapshot of each ledger workbook so that Excel is parsed only when it changes.
+    # A snapshot is valid while the workbook size and mtime are unchanged, or with use_hash,
+    # while its content hash is unchanged.
+    def __init__(self, cache_folder_path, use_hash=False):
+        self.cache_folder_path = cache_folder_path
+        self.use_hash = use_hash
+        self.hits = 0
+        self.misses = 0
+
+    def _snapshot_paths(self, data_file, date_column, date_format):
+        name = os.path.splitext(os.path.basename(data_file))[0]
+        key = f"{os.path.abspath(data_file)}|{date_column}|{date_format}"
+        suffix = hashlib.sha256(key.encode()).hexdigest()[:16]
+        base_path = os.path.join(self.cache_folder_path, f"{name}-{suffix}")
+        return (base_path + '.pkl', base_path + '.json')
+
+    def _source_metadata(self, data_file):
+        stat = os.stat(data_file)
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    def _is_valid(self, data_file, metadata, source_metadata):
+        if metadata.get('version') != SNAPSHOT_VERSION:
+            return False
+
+        if metadata.get('size') == source_metadata['size'] and metadata.get('mtime_ns') == source_metadata['mtime_ns']:
+            return True
+
+        if self.use_hash and metadata.get('hash') is not None:
+            return metadata['hash'] == get_file_hash(data_file)
+
+        return False
+
+    def load(self, data_file, *, date_column='Date', date_format=None):
+        (snapshot_path, metadata_path) = self._snapshot_paths(data_file, date_column, date_format)
+        source_metadata = self._source_metadata(data_file)
+
+        if os.path.exists(snapshot_path) and os.path.exists(metadata_path):
+            with open(metadata_path) as f:
+                metadata = json.load(f)
+
+            if self._is_valid(data_file, metadata, source_metadata):
+                if metadata.get('mtime_ns') != source_metadata['mtime_ns']:
+                    # Same content under a new mtime, record it so the hash is not computed again
+                    metadata.update(source_metadata)
+                    self._write_metadata(metadata_path, metadata)
+
+                self.hits += 1
+                return pd.read_pickle(snapshot_path)
+
+        self.misses += 1
+        fledger_df = read_financialledger_file(data_file, date_column=date_column, date_format=date_format)
+
+        metadata = dict(source_metadata, version=SNAPSHOT_VERSION, source=os.path.abspath(data_file))
+        if self.use_hash:
+            metadata['hash'] = get_file_hash(data_file)
+
+        os.makedirs(self.cache_folder_path, exist_ok=True)
+        fledger_df.to_pickle(snapshot_path + '.tmp')
+        os.replace(snapshot_path + '.tmp', snapshot_path)
+        self._write_metadata(metadata_path, metadata)
+
+        return fledger_df
+
+    def _write_metadata(self, metadata_path, metadata):
+        with open(metadata_path + '.tmp', 'w') as f:
+            json.dump(metadata, f, indent=4)
+        os.replace(metadata_path + '.tmp', metadata_path)
+
+    def invalidate(self, data_file, *, date_column='Date', date_format=None):
+        for path in self._snapshot_paths(data_file, date_column, date_format):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def filter_date_range(df, date_column, start_date=None, end_date=None):
+    # Same convention as the contract notes: start_date is inclusive and end_date is exclusive
+    if not start_date and not end_date:
+        return df
+
+    dates = df[date_column].astype('string')
+    mask = dates.notna()
+    if start_date:
+        mask &= (dates >= start_date).fillna(False)
+    if end_date:
+        mask &= (dates < end_date).fillna(False)
+    return df[mask.astype(bool)]
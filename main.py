@@ -1,188 +1,166 @@
-from broker import *
-from utils.debug import *
-
-pd_set_options()
-
-data_type = 'sample'
-
-start_date = "2022-04-01"
-if data_type == 'sample':
-    end_date = "2023-01-31"
-    max_count = 1
-else:
-    end_date = "2023-04-01"
-    max_count = 0
-
-
-def zerodha_post_process_fledger_dataframe(df):
-    return df[df['Voucher Type'] == 'Book Voucher']
-
-
-def zerodha_match_summary_dataframe(df):
-    if df.shape == (11, 5) or df.shape == (11, 4):
-        return {'tag': 'Charges'}
-
-    return None
-
-
-zerodha_numeric_columns = ['Equity', 'Equity (T+1)', 'Futures and Options', 'NET TOTAL']
-
-
-def zerodha_post_process_summary_dataframe(cnote_file_path, date, df):
-    if df.shape[1] == 4:
-        print("Fixed the df")
-        df['Equity (T+1)'] = ""
-
-    df = df[zerodha_numeric_columns]
-    summary_df = df.map(convert_to_decimal_or_blank)
-    charges_df = pd.DataFrame(summary_df.values[1:-1,], columns=zerodha_numeric_columns)
-    sum_series = charges_df.sum()
-    charges_sum_df = sum_series.to_frame().transpose()
-
-    charges_sum_df = charges_sum_df.map(float)
-
-    charges_sum_df['Date'] = date
-    charges_sum_df['Document'] = cnote_file_path
-    return charges_sum_df
-
-
-zerodha_broker = Broker('Zerodha',
-                        input_path_prefix=f'data/{data_type}',
-                        compute_path_prefix=f'compute/{data_type}',
-                        fledger_date_column='Posting Date',
-                        fledger_post_process_func=zerodha_post_process_fledger_dataframe,
-                        cnote_num_last_pages=2,
-                        charges_date_column='Date',
-                        charges_numeric_columns=zerodha_numeric_columns,
-                        summary_match_func=zerodha_match_summary_dataframe,
-                        summary_post_process_func=zerodha_post_process_summary_dataframe
-                        )
-
-# zerodha_broker.compute(start_date=start_date, end_date=end_date, dry_run=False, max_count=max_count)
-
-
-axisdirect_numeric_columns = ['NCL-EQUITY', 'NCL F&O', 'NCL CDX', 'Total(Net)']
-
-
-def axisdirect_post_process_fledger_dataframe(df):
-    # Filter rows where Bill number is specified
-    new_df = df[df["Bill No."].notnull()]
-
-    return new_df
-
-
-NUM_TRADE_COLUMNS = 12
-NUM_CHARGES_COLUMNS = 6
-
-
-def axisdirect_match_dataframe(df, page_num=None):
-    if page_num is not None:
-        debug_log(f"PageNum:{page_num} Detected table {df.shape} ", active=False)
-
-    num_rows, num_columns = df.shape
-
-    # if num_rows == NUM_TRADE_COLUMNS:
-    #     return True
-
-    # df_print(df, shape=True, active=True)
-
-    # len_df = df.map(lambda cell: len(str(cell)))
-    debug_log(df.columns)
-
-    if num_columns == NUM_CHARGES_COLUMNS:
-        return {'tag': 'Charges'}
-
-    return None
-
-
-def axisdirect_post_process_charges_dataframe(cnote_file_path, date, df):
-    df_print(df, active=False)
-
-    gross_row_index = 0
-    net_row_index = 15
-
-    charges_rows = [
-        {'name': 'Brokerage', 'row': 1, 'aggregate': 'Brokerage'},
-        {'name': 'ExchangeCharges', 'row': 2, 'aggregate': 'ExchangeCharges'},
-        {'name': 'SEBIFees', 'row': 3, 'aggregate': 'SEBIFees'},
-        # {'name': 'TaxableCharges', 'row': 4, 'aggregate': 'TaxableCharges'},
-        {'name': 'CGST', 'row': 6, 'aggregate': 'GST'},
-        {'name': 'SGST', 'row': 8, 'aggregate': 'GST'},
-        {'name': 'IGST', 'row': 10, 'aggregate': 'GST'},
-        {'name': 'UTGST', 'row': 12, 'aggregate': 'GST'},
-        {'name': 'STT', 'row': 13, 'aggregate': 'STT'},
-        {'name': 'StampDuty', 'row': 14, 'aggregate': 'StampDuty'},
-    ]
-    charges_row_indices = list(map(lambda x: x['row'], charges_rows))
-
-    chrages_aggregate_map = {}
-
-    df = df[axisdirect_numeric_columns]
-
-    charges_df = df.iloc[charges_row_indices]
-    charges_df = charges_df.map(convert_to_decimal_or_blank)
-
-    for index, (dfidx, row) in enumerate(charges_df.iterrows()):
-        debug_log(row['NCL-EQUITY'], row['NCL F&O'], index, active=False)
-        agg_key = charges_rows[index]['aggregate']
-
-        if agg_key not in chrages_aggregate_map:
-            chrages_aggregate_map[agg_key + "-EQ"] = 0
-            chrages_aggregate_map[agg_key + "-FnO"] = 0
-            chrages_aggregate_map[agg_key] = 0
-        chrages_aggregate_map[agg_key + "-EQ"] += row['NCL-EQUITY']
-        chrages_aggregate_map[agg_key + "-FnO"] += row['NCL F&O']
-        chrages_aggregate_map[agg_key] += row['Total(Net)']
-
-    debug_metadata(chrages_aggregate_map, active=False)
-
-    # TBD: We should do the sum here
-    sum_series = charges_df.sum()
-    charges_sum_df = sum_series.to_frame().transpose()
-
-    # Add the values in the chrages_aggregate_map to dateframe
-    for key,value in chrages_aggregate_map.items():
-        charges_sum_df[key] = value
-
-    charges_sum_df['Gross-EQ'] = df.iloc[gross_row_index]['NCL-EQUITY']
-    charges_sum_df['Gross-FnO'] = df.iloc[gross_row_index]['NCL F&O']
-    charges_sum_df['Gross-Total'] = df.iloc[gross_row_index]['Total(Net)']
-
-    charges_sum_df['Net-EQ'] = df.iloc[net_row_index]['NCL-EQUITY']
-    charges_sum_df['Net-FnO'] = df.iloc[net_row_index]['NCL F&O']
-    charges_sum_df['Net-Total'] = df.iloc[net_row_index]['Total(Net)']
-
-    charges_sum_df = charges_sum_df.map(convert_to_decimal_or_blank)
-
-    charges_sum_df['NetGrossDiff'] = charges_sum_df.loc[0, 'Net-Total'] - charges_sum_df.loc[0, 'Gross-Total']
-
-    charges_sum_df['Status'] = charges_sum_df.loc[0, 'NetGrossDiff'] - charges_sum_df.loc[0, 'Total(Net)']
-
-    df_print(charges_sum_df, location=True, active=True)
-
-    # TBD: We need to fix this
-    charges_sum_df = charges_sum_df.map(float)
-
-    charges_sum_df['Date'] = date
-    charges_sum_df['Document'] = cnote_file_path
-
-    return charges_sum_df
-
-
-axisdirect_broker = Broker('Axisdirect',
-                           input_path_prefix=f'data/{data_type}',
-                           compute_path_prefix=f'compute/{data_type}',
-                           fledger_date_column='Trn Date',
-                           fledger_date_format='%d-%b-%y',
-                           fledger_post_process_func=axisdirect_post_process_fledger_dataframe,
-                           cnote_num_last_pages=4,
-                           charges_date_column='Date',
-                           charges_numeric_columns=axisdirect_numeric_columns,
-                           summary_match_func=axisdirect_match_dataframe,
-                           summary_post_process_func=axisdirect_post_process_charges_dataframe
-                           )
-
-
-# axisdirect_broker.read_ledger(start_date=start_date, end_date=end_date)
-axisdirect_broker.read_contract_notes(start_date=start_date, end_date=end_date, dry_run=True, max_count=max_count)
-# axisdirect_broker.compute(start_date=start_date, end_date=end_date, dry_run=True)
\ No newline at end of file
+# Reconciles the charges in the contract notes of a broker against its ledger.
+#
+#   python main.py ledger Zerodha
+#   python main.py notes Axisdirect --workers 4 --dry-run
+#   python main.py notes Zerodha --cache                      # notes parsed before are read from the cache
+#   python main.py reconcile Zerodha --ledger-cache           # the ledger workbook is parsed only when it changes
+#   python main.py reconcile Zerodha --start-date 2022-04-01 --end-date 2023-04-01
+#   python main.py report Zerodha
+#   python main.py rollup Axisdirect --period fy
+#   python main.py compute Zerodha
+#   python main.py compute Zerodha --trace compute/trace.jsonl --cprofile compute/compute.prof
+#   python main.py calibrate Zerodha                         # lattice settings for --engine tuned
+#   python main.py notes Zerodha --queue compute/queue.db    # extracted by work_queue.py workers
+#
+# Only the notes and compute commands read contract notes, so only they import the PDF stack.
+# reconcile works on the charges aggregate written by a previous notes run, and report prints
+# the reconciliation report written by a previous reconcile or compute run. rollup prints the
+# charges totals by period and segment kept with the charges aggregate.
+
+import argparse
+
+from broker import pd_set_options
+from brokers import broker_configs, create_broker
+from lattice_tuning import DEFAULT_CALIBRATION_SAMPLES
+from utils.profiling import get_profiler
+
+
+def run_ledger(broker, args):
+    broker.read_ledger(start_date=args.start_date, end_date=args.end_date)
+    print(broker.tradeledger_df.to_string(index=False))
+    print(f"{len(broker.tradeledger_df)} ledger entries")
+
+
+def get_queue(args):
+    if args.queue is None:
+        return None
+
+    from work_queue import get_work_queue
+    return get_work_queue(args.queue, wait_timeout=args.queue_timeout)
+
+
+def get_args_profiler(args):
+    return get_profiler(profile=args.profile, trace_file_path=args.trace, cprofile_file_path=args.cprofile)
+
+
+def run_notes(broker, args):
+    profiler = get_args_profiler(args)
+    if profiler is not None:
+        profiler.start()
+
+    try:
+        broker.read_contract_notes(start_date=args.start_date, end_date=args.end_date, dry_run=args.dry_run,
+                                   max_count=args.max_count, workers=args.workers, profiler=profiler, queue=get_queue(args))
+    finally:
+        if profiler is not None:
+            profiler.close()
+            profiler.print_summary()
+
+    if args.export and not args.dry_run:
+        broker.export_charges()
+    return 1 if broker.cnote_failures else 0
+
+
+def run_reconcile(broker, args):
+    broker.read_ledger(start_date=args.start_date, end_date=args.end_date)
+    broker.read_charges(start_date=args.start_date, end_date=args.end_date)
+    broker.reconcile(start_date=args.start_date, end_date=args.end_date)
+    broker.report(output_file_path=None if args.dry_run else broker.reconciliation_file_path)
+
+
+def run_report(broker, args):
+    broker.read_report(args.input)
+    broker.report()
+
+
+def run_calibrate(broker, args):
+    broker.calibrate_lattice(start_date=args.start_date, end_date=args.end_date, sample_count=args.sample_count)
+
+
+def run_rollup(broker, args):
+    rollup_df = broker.read_rollup(args.period, start_date=args.start_date, end_date=args.end_date)
+    print(rollup_df.to_string(index=False))
+
+
+def run_compute(broker, args):
+    broker.compute(start_date=args.start_date, end_date=args.end_date, dry_run=args.dry_run,
+                   max_count=args.max_count, workers=args.workers, export=args.export, profiler=get_args_profiler(args),
+                   queue=get_queue(args))
+    return 1 if broker.cnote_failures else 0
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Reconcile contract note charges against the ledger")
+    common_parser = argparse.ArgumentParser(add_help=False)
+    common_parser.add_argument('broker', choices=list(broker_configs))
+    common_parser.add_argument('--input-path-prefix', default='data')
+    common_parser.add_argument('--compute-path-prefix', default='compute')
+    common_parser.add_argument('--start-date', default=None, help="first date, inclusive (YYYY-MM-DD)")
+    common_parser.add_argument('--end-date', default=None, help="last date, exclusive (YYYY-MM-DD)")
+    common_parser.add_argument('--output-format', choices=['parquet', 'feather', 'xlsx'], default=None,
+                               help="format of the charges aggregate, defaults to parquet")
+    common_parser.add_argument('--ledger-cache', action='store_true',
+                               help="keep a snapshot of the ledger workbook, parsed again only when it changes")
+
+    notes_parser = argparse.ArgumentParser(add_help=False)
+    notes_parser.add_argument('--workers', type=int, default=1)
+    notes_parser.add_argument('--max-count', type=int, default=0, help="number of contract notes to read, 0 for all")
+    notes_parser.add_argument('--engine', choices=['camelot', 'text', 'tuned'], default=None,
+                              help="overrides the broker's cnote_engine, tuned uses the settings of the calibrate command")
+    notes_parser.add_argument('--memory-limit', default=None, help="memory limit per contract note, e.g. 1G")
+    notes_parser.add_argument('--cache', action='store_true',
+                              help="cache the summary table of every note by content, so a note is parsed only once")
+    notes_parser.add_argument('--export', action='store_true', help="export the charges aggregate to Excel")
+    notes_parser.add_argument('--queue', default=None, help="work queue (.db or folder) served by work_queue.py workers")
+    notes_parser.add_argument('--queue-timeout', type=float, default=0,
+                              help="give up after this many seconds without a note finished by the queue workers")
+    notes_parser.add_argument('--profile', action='store_true', help="print the time spent per stage")
+    notes_parser.add_argument('--trace', default=None, help="per contract note timings file (jsonl), implies --profile")
+    notes_parser.add_argument('--cprofile', default=None, help="cProfile stats file, implies --profile")
+
+    dry_run_parser = argparse.ArgumentParser(add_help=False)
+    dry_run_parser.add_argument('--dry-run', action='store_true', help="do not write the charges aggregate or the report")
+
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('ledger', parents=[common_parser], help="read and print the ledger").set_defaults(func=run_ledger)
+    subparsers.add_parser('notes', parents=[common_parser, notes_parser, dry_run_parser],
+                          help="extract the charges of new contract notes").set_defaults(func=run_notes)
+    subparsers.add_parser('reconcile', parents=[common_parser, dry_run_parser],
+                          help="reconcile the ledger against the extracted charges").set_defaults(func=run_reconcile)
+    report_parser = subparsers.add_parser('report', parents=[common_parser], help="print the last reconciliation report")
+    report_parser.add_argument('--input', default=None, help="report file, defaults to the broker's reconciliation.csv")
+    report_parser.set_defaults(func=run_report)
+    rollup_parser = subparsers.add_parser('rollup', parents=[common_parser], help="print the charges totals by period and segment")
+    rollup_parser.add_argument('--period', choices=['month', 'quarter', 'fy'], default='month')
+    rollup_parser.set_defaults(func=run_rollup)
+    subparsers.add_parser('compute', parents=[common_parser, notes_parser, dry_run_parser],
+                          help="ledger, contract notes, reconcile and report in one run").set_defaults(func=run_compute)
+    calibrate_parser = subparsers.add_parser('calibrate', parents=[common_parser],
+                                             help="learn the lattice settings of the broker from sample contract notes")
+    calibrate_parser.add_argument('--sample-count', type=int, default=DEFAULT_CALIBRATION_SAMPLES)
+    calibrate_parser.set_defaults(func=run_calibrate)
+    args = parser.parse_args(args)
+
+    pd_set_options()
+
+    broker_kwargs = {}
+    if getattr(args, 'engine', None) is not None:
+        broker_kwargs['cnote_engine'] = args.engine
+    if getattr(args, 'memory_limit', None) is not None:
+        broker_kwargs['cnote_memory_limit'] = args.memory_limit
+    if args.output_format is not None:
+        broker_kwargs['output_format'] = args.output_format
+    if getattr(args, 'cache', False):
+        broker_kwargs['cnote_cache'] = True
+    if args.ledger_cache:
+        broker_kwargs['fledger_cache'] = True
+
+    broker = create_broker(args.broker,
+                           input_path_prefix=args.input_path_prefix,
+                           compute_path_prefix=args.compute_path_prefix,
+                           **broker_kwargs)
+    return args.func(broker, args) or 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
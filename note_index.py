@@ -0,0 +1,144 @@
+import bisect
+import json
+import os
+import time
+from datetime import datetime
+
+
+INDEX_VERSION = 1
+
+# A directory whose mtime is this recent may still get files within the same mtime tick,
+# so its listing is not trusted and it is listed again on the next refresh
+RACY_MTIME_SECONDS = 2
+
+
+def get_date_from_name(name, date_patterns):
+    # date_patterns is a list of (compiled regex, date format), the first one that matches wins
+    for (date_regex, date_format) in date_patterns:
+        match = date_regex.search(name)
+        if match is not None:
+            return datetime.strptime(match.group(1), date_format).strftime("%Y-%m-%d")
+
+    return None
+
+
+class NoteSelection:
+    __slots__ = ('notes', 'num_before', 'num_after', 'num_undated')
+
+    def __init__(self, notes, num_before, num_after, num_undated):
+        self.notes = notes
+        self.num_before = num_before
+        self.num_after = num_after
+        self.num_undated = num_undated
+
+
+class NoteDateIndex:
+    # The (date, path) of every contract note of a folder, sorted by date so that a date range is
+    # selected with two bisections. The listing of each directory is kept with the directory mtime,
+    # which changes when a file is added, removed or renamed in it, so a refresh only lists the
+    # directories that changed and stats the others.
+    def __init__(self, folder_path, *, date_patterns, index_file_path=None):
+        self.folder_path = folder_path
+        self.date_patterns = date_patterns
+        self.index_file_path = index_file_path
+        self.identity = [[date_regex.pattern, date_format] for (date_regex, date_format) in date_patterns]
+        self.dirs = {}
+        self.dates = []
+        self.paths = []
+        self.num_undated = 0
+        self.dirty = False
+        self.listed_dirs = 0
+        self.built = False
+
+        if index_file_path is not None and os.path.exists(index_file_path):
+            with open(index_file_path) as f:
+                index = json.load(f)
+            if (index.get('version') == INDEX_VERSION and index.get('identity') == self.identity
+                    and index.get('folder_path') == os.path.abspath(folder_path)):
+                self.dirs = index['dirs']
+
+    def list_dir(self, rel_path, mtime_ns):
+        dir_path = os.path.join(self.folder_path, rel_path) if rel_path else self.folder_path
+        subdirs = []
+        files = []
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                else:
+                    files.append([entry.name, get_date_from_name(entry.name, self.date_patterns)])
+
+        if time.time_ns() - mtime_ns < RACY_MTIME_SECONDS * 10 ** 9:
+            mtime_ns = None
+        self.listed_dirs += 1
+        return {'mtime_ns': mtime_ns, 'dirs': sorted(subdirs), 'files': files}
+
+    def refresh(self):
+        if not os.path.exists(self.folder_path):
+            raise RuntimeError(f"folder '{self.folder_path}' does not exist")
+
+        self.listed_dirs = 0
+        changed = False
+        dirs = {}
+        pending = ['']
+        while pending:
+            rel_path = pending.pop()
+            dir_path = os.path.join(self.folder_path, rel_path) if rel_path else self.folder_path
+            try:
+                mtime_ns = os.stat(dir_path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+
+            entry = self.dirs.get(rel_path)
+            if entry is None or entry['mtime_ns'] != mtime_ns:
+                entry = self.list_dir(rel_path, mtime_ns)
+                changed = True
+            dirs[rel_path] = entry
+            pending.extend(os.path.join(rel_path, name) for name in entry['dirs'])
+
+        if dirs.keys() != self.dirs.keys():
+            changed = True
+        self.dirs = dirs
+        if changed:
+            self.dirty = True
+        elif self.built:
+            return
+
+        notes = []
+        self.num_undated = 0
+        for (rel_path, entry) in dirs.items():
+            dir_path = os.path.join(self.folder_path, rel_path) if rel_path else self.folder_path
+            for (name, date) in entry['files']:
+                if date is None:
+                    self.num_undated += 1
+                else:
+                    notes.append((date, os.path.join(dir_path, name)))
+        notes.sort()
+        self.dates = [date for (date, path) in notes]
+        self.paths = [path for (date, path) in notes]
+        self.built = True
+
+    def select(self, start_date=None, end_date=None):
+        # Same convention as the ledger: start_date is inclusive and end_date is exclusive
+        lo = bisect.bisect_left(self.dates, start_date) if start_date else 0
+        hi = bisect.bisect_left(self.dates, end_date) if end_date else len(self.dates)
+        hi = max(lo, hi)
+        notes = list(zip(self.dates[lo:hi], self.paths[lo:hi]))
+        return NoteSelection(notes, lo, len(self.dates) - hi, self.num_undated)
+
+    def save(self):
+        if self.index_file_path is None or not self.dirty:
+            return
+
+        output_folder = os.path.dirname(self.index_file_path)
+        if output_folder and not os.path.exists(output_folder):
+            os.makedirs(output_folder)
+
+        index = {'version': INDEX_VERSION,
+                 'identity': self.identity,
+                 'folder_path': os.path.abspath(self.folder_path),
+                 'dirs': self.dirs}
+        with open(self.index_file_path + '.tmp', 'w') as f:
+            json.dump(index, f)
+        os.replace(self.index_file_path + '.tmp', self.index_file_path)
+        self.dirty = False
@@ -0,0 +1,139 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+
+# Amounts are compared as integers at this scale, the same scale as broker.DECIMAL_SCALE
+AMOUNT_SCALE = 4
+DEFAULT_TOLERANCE = 0.01
+
+STATUS_MATCHED = 'matched'
+STATUS_AMOUNT_MISMATCH = 'amount_mismatch'
+STATUS_MISSING_IN_CHARGES = 'missing_in_charges'
+STATUS_MISSING_IN_LEDGER = 'missing_in_ledger'
+# The contract notes of the date have no amount to compare, e.g. an aggregate written before the amount column existed
+STATUS_MISSING_AMOUNT = 'missing_amount'
+
+MISSING_STATUSES = [STATUS_MISSING_IN_CHARGES, STATUS_MISSING_IN_LEDGER]
+
+REPORT_COLUMNS = ['Date', 'LedgerAmount', 'ChargesAmount', 'Difference',
+                  'LedgerEntries', 'ContractNotes', 'Documents', 'Status']
+
+
+def to_scaled_amounts(series, scale=AMOUNT_SCALE):
+    amounts = pd.to_numeric(series, errors='coerce').astype(float)
+    return pd.Series(np.round(amounts * 10 ** scale), index=series.index).astype('Int64')
+
+
+def get_ledger_amounts(ledger_df, *, debit_column='Debit', credit_column='Credit', scale=AMOUNT_SCALE):
+    # A credit in the ledger is an amount receivable by the client, as is a positive net total in a contract note
+    credit = to_scaled_amounts(ledger_df[credit_column], scale).fillna(0)
+    debit = to_scaled_amounts(ledger_df[debit_column], scale).fillna(0)
+    return credit - debit
+
+
+def aggregate_by_date(dates, amounts, count_name, documents=None):
+    df = pd.DataFrame({'Date': dates.astype('string').to_numpy(), 'Amount': amounts.to_numpy()})
+    if documents is not None:
+        df['Documents'] = documents.map(lambda x: os.path.basename(x) if isinstance(x, str) else '').to_numpy()
+
+    grouped = df.groupby('Date', sort=True)
+    # An all NA group sums to a float NaN, the amounts are kept as nullable integers
+    agg_df = grouped['Amount'].sum(min_count=1).astype('Int64').to_frame()
+    agg_df[count_name] = grouped.size()
+    # A date is only given an amount when every one of its rows has one
+    agg_df.loc[grouped['Amount'].count() < agg_df[count_name], 'Amount'] = pd.NA
+    if documents is not None:
+        agg_df['Documents'] = grouped['Documents'].agg(', '.join)
+    return agg_df
+
+
+def reconcile_amounts(ledger_df, charges_df, *,
+                      ledger_date_column='Date',
+                      charges_date_column='Date',
+                      charges_amount_column=None,
+                      ledger_debit_column='Debit',
+                      ledger_credit_column='Credit',
+                      document_column='Document',
+                      tolerance=DEFAULT_TOLERANCE,
+                      scale=AMOUNT_SCALE):
+    # Both sides are summed per date, so several contract notes for one ledger voucher (or the other
+    # way round) are compared as a whole. Without charges_amount_column only the dates are matched.
+    compare_amounts = charges_amount_column is not None
+
+    if compare_amounts:
+        ledger_amounts = get_ledger_amounts(ledger_df, debit_column=ledger_debit_column, credit_column=ledger_credit_column, scale=scale)
+    else:
+        ledger_amounts = pd.Series(pd.NA, index=ledger_df.index, dtype='Int64')
+    ledger_agg_df = aggregate_by_date(ledger_df[ledger_date_column], ledger_amounts, 'LedgerEntries')
+
+    if len(charges_df):
+        if compare_amounts and charges_amount_column in charges_df.columns:
+            charges_amounts = to_scaled_amounts(charges_df[charges_amount_column], scale)
+        else:
+            if compare_amounts:
+                print(f"Warning! The charges aggregate has no '{charges_amount_column}' column, "
+                      f"its dates are reported as '{STATUS_MISSING_AMOUNT}', read the contract notes again to fill it")
+            charges_amounts = pd.Series(pd.NA, index=charges_df.index, dtype='Int64')
+        documents = charges_df[document_column] if document_column in charges_df.columns else None
+        charges_agg_df = aggregate_by_date(charges_df[charges_date_column], charges_amounts, 'ContractNotes', documents)
+    else:
+        charges_agg_df = pd.DataFrame({'Amount': pd.Series(dtype='Int64'), 'ContractNotes': pd.Series(dtype='int64')},
+                                      index=pd.Index([], name='Date', dtype='string'))
+
+    report_df = ledger_agg_df.join(charges_agg_df, how='outer', lsuffix='_ledger', rsuffix='_charges').reset_index()
+    report_df = report_df.rename(columns={'Amount_ledger': 'LedgerAmount', 'Amount_charges': 'ChargesAmount'})
+
+    report_df['LedgerEntries'] = report_df['LedgerEntries'].fillna(0).astype(int)
+    report_df['ContractNotes'] = report_df['ContractNotes'].fillna(0).astype(int)
+    if 'Documents' not in report_df.columns:
+        report_df['Documents'] = ''
+    report_df['Documents'] = report_df['Documents'].fillna('')
+
+    difference = report_df['ChargesAmount'] - report_df['LedgerAmount']
+    within_tolerance = (difference.abs() <= round(tolerance * 10 ** scale)).fillna(not compare_amounts)
+
+    missing_amount = (report_df['ChargesAmount'].isna() & compare_amounts).astype(bool)
+
+    report_df['Status'] = np.select([report_df['ContractNotes'] == 0,
+                                     report_df['LedgerEntries'] == 0,
+                                     missing_amount,
+                                     within_tolerance.astype(bool)],
+                                    [STATUS_MISSING_IN_CHARGES,
+                                     STATUS_MISSING_IN_LEDGER,
+                                     STATUS_MISSING_AMOUNT,
+                                     STATUS_MATCHED],
+                                    default=STATUS_AMOUNT_MISMATCH)
+
+    report_df['LedgerAmount'] = report_df['LedgerAmount'].astype('Float64') / 10 ** scale
+    report_df['ChargesAmount'] = report_df['ChargesAmount'].astype('Float64') / 10 ** scale
+    report_df['Difference'] = difference.astype('Float64') / 10 ** scale
+
+    return report_df[REPORT_COLUMNS]
+
+
+def summarize_reconciliation(report_df):
+    counts = report_df['Status'].value_counts()
+    return {status: int(counts.get(status, 0))
+            for status in [STATUS_MATCHED, STATUS_AMOUNT_MISMATCH, STATUS_MISSING_AMOUNT, STATUS_MISSING_IN_CHARGES, STATUS_MISSING_IN_LEDGER]}
+
+
+def write_reconciliation_report(report_df, output_file_path):
+    output_folder = os.path.dirname(output_file_path)
+    if output_folder and not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+
+    if output_file_path.endswith('.xlsx'):
+        report_df.to_excel(output_file_path, index=False)
+    else:
+        report_df.to_csv(output_file_path, index=False)
+
+
+def read_reconciliation_report(input_file_path):
+    if input_file_path.endswith('.xlsx'):
+        report_df = pd.read_excel(input_file_path, dtype={'Date': str, 'Documents': str})
+    else:
+        report_df = pd.read_csv(input_file_path, dtype={'Date': str, 'Documents': str})
+    report_df['Documents'] = report_df['Documents'].fillna('')
+    return report_df[REPORT_COLUMNS]
@@ -0,0 +1,171 @@
+import numpy as np
+import pandas as pd
+
+
+# A summary layout describes how a matched summary table becomes one row of the charges aggregate:
+#
+#   numeric_columns  columns parsed as decimals, the first columns of the output with their sums
+#   fill_columns     numeric columns some notes leave out, added as blank cells when missing
+#   sum_rows         rows summed into the numeric columns, a list of row positions or a slice
+#                    string such as '1:-1'; defaults to the rows of the aggregates
+#   aggregates       {'columns': {suffix: column}, 'rows': [{'name': ..., 'row': ..., 'aggregate': ...}]}
+#                    each aggregate adds one output column per suffix, summed over its rows
+#   row_values       [{'row': position, 'columns': {output column: numeric column}}], cells copied as they are
+#   differences      [(output column, left column, right column)], computed in order on the output
+#
+# compile_summary_layout turns a layout into a SummaryPlan once, the plan is then called as the
+# summary post-process function for every note and returns a ChargesRecord. The records of a run
+# become one DataFrame with materialize_charges.
+SUMMARY_LAYOUT_KEYS = ['numeric_columns', 'fill_columns', 'sum_rows', 'aggregates', 'row_values', 'differences']
+
+
+def parse_row_selection(sum_rows):
+    if isinstance(sum_rows, str):
+        parts = [int(part) if part.strip() else None for part in sum_rows.split(':')]
+        if len(parts) != 2:
+            raise RuntimeError(f"sum_rows '{sum_rows}' is not a slice")
+        return slice(*parts)
+
+    return np.array(sum_rows, dtype=int)
+
+
+class ChargesSchema:
+    # Shared by all the records of a plan
+    __slots__ = ('columns', 'scale')
+
+    def __init__(self, columns, scale):
+        self.columns = tuple(columns)
+        self.scale = scale
+
+
+class ChargesRecord:
+    # The charges of one note: the values of the schema columns as scaled integers held as floats,
+    # a small fraction of the size of a one row DataFrame
+    __slots__ = ('schema', 'values', 'date', 'document')
+
+    def __init__(self, schema, values, date, document):
+        self.schema = schema
+        self.values = values
+        self.date = date
+        self.document = document
+
+    def to_dict(self):
+        return dict(zip(self.schema.columns, self.values / (10 ** self.schema.scale)), Date=self.date, Document=self.document)
+
+
+def get_records_dataframe(records):
+    schema = records[0].schema
+    values = np.vstack([record.values for record in records]) / (10 ** schema.scale)
+    df = pd.DataFrame(values, columns=list(schema.columns), index=np.zeros(len(records), dtype=int))
+    df['Date'] = [record.date for record in records]
+    df['Document'] = [record.document for record in records]
+    return df
+
+
+def materialize_charges(charges_list):
+    # Consecutive records of the same schema become one block, DataFrames returned by a custom
+    # post-process function are kept as they are. The index is 0 for every row, as a concat of
+    # one row frames would give.
+    frames = []
+    run = []
+    for charges in charges_list:
+        if isinstance(charges, ChargesRecord):
+            if run and run[0].schema.columns != charges.schema.columns:
+                frames.append(get_records_dataframe(run))
+                run = []
+            run.append(charges)
+        else:
+            if run:
+                frames.append(get_records_dataframe(run))
+                run = []
+            frames.append(charges)
+    if run:
+        frames.append(get_records_dataframe(run))
+
+    if not frames:
+        return pd.DataFrame()
+    if len(frames) == 1:
+        return frames[0]
+    return pd.concat(frames, axis=0)
+
+
+class SummaryPlan:
+    def __init__(self, layout, parse_func, scale):
+        unknown_keys = set(layout) - set(SUMMARY_LAYOUT_KEYS)
+        if unknown_keys:
+            raise RuntimeError(f"summary layout has unknown keys {sorted(unknown_keys)}")
+
+        if not layout.get('numeric_columns'):
+            raise RuntimeError(f"summary layout needs numeric_columns")
+
+        self.parse_func = parse_func
+        self.scale = scale
+        self.numeric_columns = list(layout['numeric_columns'])
+        self.fill_columns = list(layout.get('fill_columns', []))
+        column_positions = {column: position for (position, column) in enumerate(self.numeric_columns)}
+
+        def get_position(column):
+            if column not in column_positions:
+                raise RuntimeError(f"column '{column}' is not one of the numeric columns {self.numeric_columns}")
+            return column_positions[column]
+
+        # The aggregates become a one-hot matrix, so all of them are summed with one product
+        aggregates = layout.get('aggregates', {'columns': {}, 'rows': []})
+        rows = aggregates['rows']
+        group_names = list(dict.fromkeys(row['aggregate'] for row in rows))
+        self.aggregate_rows = np.array([row['row'] for row in rows], dtype=int)
+        self.aggregate_matrix = np.zeros((len(group_names), len(rows)))
+        for (position, row) in enumerate(rows):
+            self.aggregate_matrix[group_names.index(row['aggregate']), position] = 1
+        suffixes = list(aggregates['columns'].items())
+        self.aggregate_column_positions = np.array([get_position(column) for (suffix, column) in suffixes], dtype=int)
+        self.aggregate_output_columns = [name + suffix for name in group_names for (suffix, column) in suffixes]
+
+        sum_rows = layout.get('sum_rows')
+        self.sum_rows = parse_row_selection(sum_rows) if sum_rows is not None else self.aggregate_rows
+
+        self.row_values = []
+        for row_value in layout.get('row_values', []):
+            for (output_column, column) in row_value['columns'].items():
+                self.row_values.append((output_column, row_value['row'], get_position(column)))
+
+        self.differences = list(layout.get('differences', []))
+
+        self.output_columns = self.numeric_columns + self.aggregate_output_columns + [name for (name, row, position) in self.row_values]
+        for (name, left, right) in self.differences:
+            if left not in self.output_columns or right not in self.output_columns:
+                raise RuntimeError(f"difference '{name}' refers to a column that is not in the output")
+            self.output_columns.append(name)
+
+        self.schema = ChargesSchema(self.output_columns, scale)
+        column_positions = {column: position for (position, column) in enumerate(self.output_columns)}
+        self.difference_positions = [(column_positions[name], column_positions[left], column_positions[right])
+                                     for (name, left, right) in self.differences]
+
+    def __call__(self, cnote_file_path, date, df):
+        for column in self.fill_columns:
+            if column not in df.columns:
+                df[column] = ""
+
+        # All the cells are parsed in one pass, as scaled integers held as floats which stay exact
+        # well beyond any amount in a contract note
+        cells = df[self.numeric_columns].to_numpy()
+        values = self.parse_func(pd.Series(cells.ravel()), scale=self.scale).to_numpy(dtype=float, na_value=np.nan).reshape(cells.shape)
+        summed_values = np.nan_to_num(values)
+
+        output = [summed_values[self.sum_rows].sum(axis=0)]
+        if len(self.aggregate_output_columns):
+            aggregate_values = self.aggregate_matrix @ summed_values[self.aggregate_rows][:, self.aggregate_column_positions]
+            output.append(aggregate_values.ravel())
+        output.append(np.array([values[row, position] for (name, row, position) in self.row_values]))
+
+        output.append(np.zeros(len(self.differences)))
+        output_values = np.concatenate(output)
+        for (position, left, right) in self.difference_positions:
+            output_values[position] = output_values[left] - output_values[right]
+
+        return ChargesRecord(self.schema, output_values, date, cnote_file_path)
+
+
+def compile_summary_layout(layout, parse_func, scale):
+    return SummaryPlan(layout, parse_func, scale)
@@ -0,0 +1,114 @@
+import json
+import os
+import re
+
+
+# A summary table spec identifies the summary table from the raw cell text of a detected table,
+# before any DataFrame is built from it:
+#
+#   header_labels  labels that must all appear in the header row
+#   row_labels     labels that must all appear in the first column, matched as prefixes (optional)
+#   num_rows       accepted numbers of rows below the header, an int or a list (optional)
+#   num_columns    accepted numbers of columns, an int or a list (optional)
+
+whitespace_run_regex = re.compile(r"\s+")
+
+
+def normalize_cell(text):
+    return whitespace_run_regex.sub(" ", text).strip().casefold()
+
+
+def as_list(value):
+    if value is None or isinstance(value, (list, tuple)):
+        return value
+    return [value]
+
+
+class TableFingerprint:
+    __slots__ = ('num_rows', 'num_columns', 'header', 'labels')
+
+    def __init__(self, cells):
+        self.num_rows = max(len(cells) - 1, 0)
+        self.num_columns = len(cells[0]) if cells else 0
+        self.header = frozenset(normalize_cell(cell) for cell in cells[0]) if cells else frozenset()
+        self.labels = [normalize_cell(row[0]) for row in cells[1:] if row]
+
+    def __repr__(self):
+        return f"({self.num_rows}, {self.num_columns}) {sorted(self.header)}"
+
+
+class SummaryTableSpec:
+    def __init__(self, spec):
+        self.identity = repr(sorted(spec.items()))
+        self.header_labels = [normalize_cell(label) for label in spec.get('header_labels', [])]
+        self.row_labels = [normalize_cell(label) for label in spec.get('row_labels', [])]
+        self.num_rows = as_list(spec.get('num_rows'))
+        self.num_columns = as_list(spec.get('num_columns'))
+
+    def get_mismatches(self, fingerprint):
+        # The reasons the table is not the summary table, none when it is
+        mismatches = []
+        if self.num_rows is not None and fingerprint.num_rows not in self.num_rows:
+            mismatches.append(f"{fingerprint.num_rows} rows instead of {self.num_rows}")
+        if self.num_columns is not None and fingerprint.num_columns not in self.num_columns:
+            mismatches.append(f"{fingerprint.num_columns} columns instead of {self.num_columns}")
+
+        missing_headers = [label for label in self.header_labels if label not in fingerprint.header]
+        if missing_headers:
+            mismatches.append(f"header labels {missing_headers} not found")
+
+        missing_labels = [label for label in self.row_labels
+                          if not any(row_label.startswith(label) for row_label in fingerprint.labels)]
+        if missing_labels:
+            mismatches.append(f"row labels {missing_labels} not found")
+
+        return mismatches
+
+
+class LayoutIndex:
+    # Counts at which (page offset from the last page, table index) the summary table of a broker
+    # was found, so that the most frequent position is tried first
+    def __init__(self, index_file_path=None):
+        self.index_file_path = index_file_path
+        self.counts = {}
+        self.dirty = False
+
+        if index_file_path is not None and os.path.exists(index_file_path):
+            with open(index_file_path) as f:
+                self.counts = {tuple(map(int, key.split(':'))): count for (key, count) in json.load(f).items()}
+
+    def get_preferred(self):
+        if not self.counts:
+            return None
+        return max(self.counts.items(), key=lambda item: item[1])[0]
+
+    def get_ordered_positions(self):
+        return [position for (position, count) in sorted(self.counts.items(), key=lambda item: -item[1])]
+
+    def order_page_nums(self, page_nums, num_pages):
+        # The pages where the summary was seen before come first, the others keep their order
+        offsets = list(dict.fromkeys(page_offset for (page_offset, table_index) in self.get_ordered_positions()))
+        preferred = [num_pages - offset for offset in offsets if num_pages - offset in page_nums]
+        return preferred + [page_num for page_num in page_nums if page_num not in preferred]
+
+    def order_table_indices(self, page_offset, num_tables):
+        preferred = [table_index for (offset, table_index) in self.get_ordered_positions()
+                     if offset == page_offset and table_index < num_tables]
+        return preferred + [table_index for table_index in range(num_tables) if table_index not in preferred]
+
+    def record(self, position):
+        self.counts[position] = self.counts.get(position, 0) + 1
+        self.dirty = True
+
+    def save(self):
+        if self.index_file_path is None or not self.dirty:
+            return
+
+        output_folder = os.path.dirname(self.index_file_path)
+        if output_folder and not os.path.exists(output_folder):
+            os.makedirs(output_folder)
+
+        with open(self.index_file_path + '.tmp', 'w') as f:
+            json.dump({f"{page_offset}:{table_index}": count for ((page_offset, table_index), count) in self.counts.items()}, f, indent=4)
+        os.replace(self.index_file_path + '.tmp', self.index_file_path)
+        self.dirty = False
@@ -0,0 +1,50 @@
+import os
+
+import pandas as pd
+
+from batch import run_broker
+from charges_store import PartitionedChargesStore
+
+
+def write_run_data(tmp_path):
+    # A ledger and a charges aggregate spanning more dates than the run, and no new contract note
+    ledger_folder_path = tmp_path / 'data' / 'FinancialLedger' / 'Zerodha'
+    os.makedirs(ledger_folder_path)
+    os.makedirs(tmp_path / 'data' / 'ContractNotes' / 'Zerodha')
+    dates = ['2019-04-01', '2019-04-02', '2019-04-03', '2019-04-04']
+    pd.DataFrame({'Particulars': ['Net obligation'] * 4,
+                  'Posting Date': dates,
+                  'Voucher Type': ['Book Voucher'] * 4,
+                  'Debit': [0.0] * 4,
+                  'Credit': [10.0, 20.0, 30.0, 40.0]}).to_excel(ledger_folder_path / 'Zerodha_FinancialLedger_Transactions.xlsx', index=False)
+
+    store = PartitionedChargesStore(str(tmp_path / 'compute' / 'Zerodha' / 'charges.parquet'))
+    store.append(pd.DataFrame({'Net-Total': [10.0, 20.0, 30.0, 40.0],
+                               'Date': dates,
+                               'Document': [f'Contract_Note_{date}.pdf' for date in dates]}))
+
+
+def test_run_counts_only_the_notes_within_its_range(tmp_path):
+    write_run_data(tmp_path)
+    run = {'broker': 'Zerodha', 'input_path_prefix': str(tmp_path / 'data'), 'compute_path_prefix': str(tmp_path / 'compute'),
+           'start_date': '2019-04-02', 'end_date': '2019-04-04'}
+
+    summary = run_broker(run, None)
+    assert summary['status'] == 'ok', summary.get('error')
+    assert (summary['contract_notes'], summary['ledger_entries'], summary['missing_entries']) == (2, 2, 0)
+
+    report_df = pd.read_csv(summary['outputs']['reconciliation'])
+    assert report_df['Date'].tolist() == ['2019-04-02', '2019-04-03']
+    assert set(report_df['Status']) == {'matched'}
+    assert len(pd.read_csv(summary['outputs']['missing_entries'])) == 0
+
+
+def test_run_fails_when_the_queue_workers_do_not_finish(tmp_path):
+    write_run_data(tmp_path)
+    (tmp_path / 'data' / 'ContractNotes' / 'Zerodha' / 'Contract_Note_2019-04-05.pdf').write_bytes(b'%PDF-1.4')
+    run = {'broker': 'Zerodha', 'input_path_prefix': str(tmp_path / 'data'), 'compute_path_prefix': str(tmp_path / 'compute')}
+
+    # No work_queue.py worker serves the queue
+    summary = run_broker(run, None, queue_path=str(tmp_path / 'queue'), queue_timeout=0.2)
+    assert summary['status'] == 'error'
+    assert 'finished in 0.2 seconds' in summary['error']
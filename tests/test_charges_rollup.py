@@ -0,0 +1,64 @@
+from decimal import Decimal
+
+import pandas as pd
+
+from charges_rollup import ChargesRollup, get_period_key
+
+
+SPEC = {'Brokerage': {'EQ': 'Brokerage-EQ', 'Total': 'Brokerage'}}
+
+
+def get_charges_df(rows):
+    return pd.DataFrame(rows, columns=['Date', 'Brokerage-EQ', 'Brokerage'])
+
+
+def get_totals(rollup, period, segment='Total', **kwargs):
+    query_df = rollup.query(period, **kwargs)
+    query_df = query_df[query_df['Segment'] == segment]
+    return dict(zip(query_df['Period'], query_df['Brokerage']))
+
+
+def test_period_keys():
+    assert get_period_key('2023-02', 'month') == '2023-02'
+    assert [get_period_key(month, 'quarter') for month in ['2022-04', '2022-06', '2022-07', '2022-12', '2023-01', '2023-03']] == \
+        ['FY2022-23 Q1', 'FY2022-23 Q1', 'FY2022-23 Q2', 'FY2022-23 Q3', 'FY2022-23 Q4', 'FY2022-23 Q4']
+    assert [get_period_key(month, 'fy') for month in ['2023-03', '2023-04', '1999-12']] == ['FY2022-23', 'FY2023-24', 'FY1999-00']
+
+
+def test_bucketing_across_financial_years(tmp_path):
+    rollup = ChargesRollup(str(tmp_path / 'rollup.json'), SPEC)
+    rollup.apply(get_charges_df([['2023-03-31', 1.10, 2.20],
+                                 ['2023-04-01', 0.10, 0.20],
+                                 ['2023-06-30', 0.30, 0.40],
+                                 ['2023-07-03', 1.00, 1.00],
+                                 ['2024-01-15', 0.05, 0.05]]))
+
+    assert get_totals(rollup, 'month') == {'2023-03': Decimal('2.2'), '2023-04': Decimal('0.2'), '2023-06': Decimal('0.4'),
+                                           '2023-07': Decimal('1'), '2024-01': Decimal('0.05')}
+    assert get_totals(rollup, 'quarter') == {'FY2022-23 Q4': Decimal('2.2'), 'FY2023-24 Q1': Decimal('0.6'),
+                                             'FY2023-24 Q2': Decimal('1'), 'FY2023-24 Q4': Decimal('0.05')}
+    assert get_totals(rollup, 'fy') == {'FY2022-23': Decimal('2.2'), 'FY2023-24': Decimal('1.65')}
+    assert get_totals(rollup, 'fy', segment='EQ') == {'FY2022-23': Decimal('1.1'), 'FY2023-24': Decimal('1.45')}
+    assert get_totals(rollup, 'fy', start_date='2023-04-01', end_date='2024-01-01') == {'FY2023-24': Decimal('1.6')}
+
+
+def test_totals_stay_exact(tmp_path):
+    rollup = ChargesRollup(str(tmp_path / 'rollup.json'), SPEC)
+    for _ in range(10):
+        rollup.apply(get_charges_df([['2023-04-03', 0.1, 0.1]]))
+    rollup.apply(get_charges_df([['2023-04-03', 0.3, 0.3]]), sign=-1)
+
+    assert get_totals(rollup, 'month') == {'2023-04': Decimal('0.7')}
+
+
+def test_saved_and_loaded(tmp_path):
+    rollup = ChargesRollup(str(tmp_path / 'rollup.json'), SPEC)
+    rollup.apply(get_charges_df([['2023-04-03', 1.5, 2.5]]))
+    rollup.signature = [['charges.xlsx', 1, 2]]
+    rollup.save()
+
+    loaded = ChargesRollup(str(tmp_path / 'rollup.json'), SPEC)
+    assert loaded.signature == [['charges.xlsx', 1, 2]]
+    assert get_totals(loaded, 'quarter') == {'FY2023-24 Q1': Decimal('2.5')}
+    # A rollup of another spec is not reused
+    assert ChargesRollup(str(tmp_path / 'rollup.json'), {'Brokerage': {'Total': 'Brokerage'}}).months == {}
@@ -0,0 +1,106 @@
+import os
+
+import pandas as pd
+
+from charges_store import ExcelChargesStore, PartitionedChargesStore, get_charges_store
+
+
+def get_charges_df(dates, amounts):
+    return pd.DataFrame({'Net-Total': amounts, 'Date': dates, 'Document': [f'notes/{date}.pdf' for date in dates]})
+
+
+def get_relative_paths(store):
+    return [os.path.relpath(path, store.folder_path) for path in store.get_part_file_paths()]
+
+
+def test_append_writes_month_partitions(tmp_path):
+    store = PartitionedChargesStore(str(tmp_path / 'charges.parquet'))
+    assert not store.exists()
+    assert store.read().empty
+
+    store.append(get_charges_df(['2023-03-30', '2023-04-03', '2023-04-04'], [1.0, 2.0, 3.0]))
+    first_paths = store.get_part_file_paths()
+    assert [os.path.dirname(path) for path in get_relative_paths(store)] == ['year=2023/month=03', 'year=2023/month=04']
+    signature = store.get_signature()
+
+    # A second append only adds parts, the first ones are left as they are
+    store.append(get_charges_df(['2023-04-05'], [4.0]))
+    assert len(store.get_part_file_paths()) == 3
+    assert set(first_paths) <= set(store.get_part_file_paths())
+    assert all(part_signature in store.get_signature() for part_signature in signature)
+
+    aggregate_df = store.read()
+    assert sorted(aggregate_df['Date']) == ['2023-03-30', '2023-04-03', '2023-04-04', '2023-04-05']
+    assert list(store.read(columns=['Date', 'Net-Total', 'Unknown']).columns) == ['Date', 'Net-Total']
+
+
+def test_append_dry_run_and_empty(tmp_path):
+    store = PartitionedChargesStore(str(tmp_path / 'charges.parquet'))
+    store.append(get_charges_df(['2023-04-03'], [1.0]), dry_run=True)
+    store.append(get_charges_df([], []))
+    assert not store.exists()
+
+
+def test_remove_documents_rewrites_only_their_parts(tmp_path):
+    store = PartitionedChargesStore(str(tmp_path / 'charges.feather'), file_format='feather')
+    store.append(get_charges_df(['2023-03-30', '2023-04-03', '2023-04-04'], [1.0, 2.0, 3.0]))
+    (march_path, april_path) = store.get_part_file_paths()
+    march_signature = os.stat(march_path).st_mtime_ns
+
+    removed_df = store.remove_documents(['notes/2023-04-03.pdf'], dry_run=True)
+    assert removed_df['Date'].tolist() == ['2023-04-03']
+    assert len(store.read()) == 3
+
+    removed_df = store.remove_documents(['./notes/2023-04-03.pdf', 'notes/unknown.pdf'])
+    assert removed_df['Date'].tolist() == ['2023-04-03']
+    assert sorted(store.read()['Date']) == ['2023-03-30', '2023-04-04']
+    assert os.stat(march_path).st_mtime_ns == march_signature
+
+    # A part left without rows is removed
+    store.remove_documents(['notes/2023-04-04.pdf'])
+    assert store.get_part_file_paths() == [march_path]
+    assert store.remove_documents(['notes/2023-04-04.pdf']).empty
+
+
+def test_excel_aggregate_is_read_until_imported(tmp_path):
+    excel_file_path = tmp_path / 'charges.xlsx'
+    # Written with its index, as the aggregate was before the switch to the partitioned store
+    get_charges_df(['2023-03-30', '2023-04-03'], [1.0, 2.0]).to_excel(excel_file_path)
+    store = get_charges_store(str(tmp_path / 'charges.parquet'), excel_file_path=str(excel_file_path))
+
+    assert store.exists() and store.has_excel_aggregate()
+    assert list(store.read().columns) == ['Net-Total', 'Date', 'Document']
+    assert store.get_part_file_paths() == []
+    assert store.remove_documents(['notes/2023-03-30.pdf'], dry_run=True)['Date'].tolist() == ['2023-03-30']
+    assert store.get_part_file_paths() == []
+
+    # The first change imports the workbook, which is not read again after
+    store.append(get_charges_df(['2023-04-04'], [3.0]))
+    assert not store.has_excel_aggregate()
+    assert os.path.exists(excel_file_path)
+    aggregate_df = store.read().sort_values('Date')
+    assert aggregate_df['Date'].tolist() == ['2023-03-30', '2023-04-03', '2023-04-04']
+    assert aggregate_df['Net-Total'].tolist() == [1.0, 2.0, 3.0]
+
+    store.import_excel_aggregate()
+    assert len(store.read()) == 3
+
+
+def test_import_excel_aggregate_on_remove(tmp_path):
+    excel_file_path = tmp_path / 'charges.xlsx'
+    get_charges_df(['2023-03-30', '2023-04-03'], [1.0, 2.0]).to_excel(excel_file_path, index=False)
+    store = get_charges_store(str(tmp_path / 'charges.parquet'), excel_file_path=str(excel_file_path))
+
+    store.remove_documents(['notes/2023-03-30.pdf'])
+    assert not store.has_excel_aggregate()
+    assert store.read()['Date'].tolist() == ['2023-04-03']
+
+
+def test_excel_store(tmp_path):
+    store = get_charges_store(str(tmp_path / 'charges.xlsx'), output_format='xlsx')
+    assert isinstance(store, ExcelChargesStore)
+    store.append(get_charges_df(['2023-03-30', '2023-04-03'], [1.0, 2.0]))
+    store.import_excel_aggregate()
+
+    assert store.remove_documents(['notes/2023-03-30.pdf'])['Date'].tolist() == ['2023-03-30']
+    assert ExcelChargesStore(store.file_path).read()['Date'].tolist() == ['2023-04-03']
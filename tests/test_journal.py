@@ -0,0 +1,79 @@
+import json
+
+import numpy as np
+
+from broker import ExtractionResult
+from journal import NoteJournal
+from summary_layout import ChargesRecord, ChargesSchema
+
+
+SCHEMA = ChargesSchema(['Brokerage', 'Net-Total'], 4)
+
+
+def get_result(document, date, values=(1.5, -10.25), error=None):
+    charges = None
+    if error is None:
+        charges = ChargesRecord(SCHEMA, np.array(values, dtype=float) * 10 ** SCHEMA.scale, date, document)
+    return ExtractionResult(document, date, charges=charges, error=error)
+
+
+def test_append_and_read_back(tmp_path):
+    journal = NoteJournal(str(tmp_path / 'journal.jsonl'))
+    journal.append(get_result('notes/a.pdf', '2023-04-03'))
+    journal.append(get_result('notes/b.pdf', '2023-04-04', error='no summary table'))
+    journal.close()
+
+    extracted = journal.get_extracted()
+    assert [(date, document) for (date, document, charges) in extracted] == [('2023-04-03', 'notes/a.pdf')]
+    assert extracted[0][2].to_dict() == {'Brokerage': 1.5, 'Net-Total': -10.25, 'Date': '2023-04-03', 'Document': 'notes/a.pdf'}
+
+
+def test_partial_last_line_is_ignored(tmp_path):
+    journal_file_path = tmp_path / 'journal.jsonl'
+    journal = NoteJournal(str(journal_file_path))
+    journal.append(get_result('notes/a.pdf', '2023-04-03'))
+    journal.close()
+    # A crash in the middle of the second write
+    with open(journal_file_path, 'a') as f:
+        f.write('{"version": 1, "document": "notes/b.pd')
+
+    assert list(journal.read()) == ['notes/a.pdf']
+
+
+def test_append_after_partial_last_line(tmp_path):
+    journal_file_path = tmp_path / 'journal.jsonl'
+    with open(journal_file_path, 'w') as f:
+        f.write('{"version": 1, "document": "notes/b.pd')
+
+    journal = NoteJournal(str(journal_file_path))
+    journal.append(get_result('notes/a.pdf', '2023-04-03'))
+    journal.close()
+
+    lines = journal_file_path.read_text().splitlines()
+    assert len(lines) == 2
+    assert json.loads(lines[1])['document'] == 'notes/a.pdf'
+    assert list(journal.read()) == ['notes/a.pdf']
+
+
+def test_get_extracted_skips_processed_and_out_of_range_notes(tmp_path):
+    journal = NoteJournal(str(tmp_path / 'journal.jsonl'))
+    for (document, date) in [('notes/a.pdf', '2023-03-31'), ('notes/b.pdf', '2023-04-01'),
+                             ('notes/c.pdf', '2023-04-02'), ('notes/d.pdf', '2023-05-01')]:
+        journal.append(get_result(document, date))
+    journal.close()
+
+    extracted = journal.get_extracted({('2023-04-02', 'notes/c.pdf')}, start_date='2023-04-01', end_date='2023-05-01')
+    assert [document for (date, document, charges) in extracted] == ['notes/b.pdf']
+
+
+def test_clear_keeps_the_other_documents(tmp_path):
+    journal = NoteJournal(str(tmp_path / 'journal.jsonl'))
+    journal.append(get_result('notes/a.pdf', '2023-04-03'))
+    journal.append(get_result('notes/b.pdf', '2023-04-04'))
+    journal.close()
+
+    journal.clear(['notes/a.pdf'])
+    assert list(journal.read()) == ['notes/b.pdf']
+
+    journal.clear()
+    assert not journal.exists()
@@ -0,0 +1,28 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from ledger_cache import normalize_date_column
+
+
+def test_datetime_column():
+    series = pd.Series(pd.to_datetime(['2023-04-03', None]))
+    assert normalize_date_column(series).tolist()[0] == '2023-04-03'
+    assert pd.isna(normalize_date_column(series).tolist()[1])
+
+
+def test_mixed_cells_without_date_format():
+    series = pd.Series([datetime(2023, 4, 3), 45019, 45020.0, np.int64(45021), 'Opening Balance', None], dtype=object)
+    assert normalize_date_column(series).tolist()[:5] == ['2023-04-03', '2023-04-03', '2023-04-04', '2023-04-05', 'Opening Balance']
+
+
+def test_mixed_cells_with_date_format():
+    series = pd.Series(['03/04/2023', datetime(2023, 4, 4), 45020, 'Opening Balance'], dtype=object)
+    assert normalize_date_column(series, date_format='%d/%m/%Y').tolist() == ['2023-04-03', '2023-04-04', '2023-04-04',
+                                                                               'Opening Balance']
+
+
+def test_numeric_column():
+    series = pd.Series([45019, 45020])
+    assert normalize_date_column(series).tolist() == ['2023-04-03', '2023-04-04']
@@ -0,0 +1,97 @@
+import os
+import re
+import time
+
+from note_index import NoteDateIndex, get_date_from_name
+
+
+DATE_PATTERNS = [(re.compile(r"(\d{4}-\d{2}-\d{2})"), '%Y-%m-%d'), (re.compile(r"_(\d{8})\."), '%d%m%Y')]
+
+
+def write_notes(folder_path, names):
+    for name in names:
+        file_path = os.path.join(folder_path, name)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'wb') as f:
+            f.write(b'%PDF-1.4')
+
+
+def age_folders(folder_path, seconds=60):
+    # Older than the racy window, so the listings are trusted on the next refresh
+    mtime = time.time() - seconds
+    for (root, dirs, files) in os.walk(folder_path):
+        os.utime(root, (mtime, mtime))
+
+
+def get_dates(selection):
+    return [date for (date, path) in selection.notes]
+
+
+def test_get_date_from_name():
+    assert get_date_from_name('Contract_Note_2023-04-03.pdf', DATE_PATTERNS) == '2023-04-03'
+    assert get_date_from_name('CN_03042023.pdf', DATE_PATTERNS) == '2023-04-03'
+    assert get_date_from_name('readme.txt', DATE_PATTERNS) is None
+
+
+def test_select_date_range(tmp_path):
+    write_notes(tmp_path, ['2023/CN_2023-04-05.pdf', '2023/CN_2023-04-03.pdf', 'CN_01042023.pdf', 'CN_2023-04-04.pdf', 'notes.txt'])
+    index = NoteDateIndex(str(tmp_path), date_patterns=DATE_PATTERNS)
+    index.refresh()
+
+    assert get_dates(index.select()) == ['2023-04-01', '2023-04-03', '2023-04-04', '2023-04-05']
+    assert index.select().notes[1][1] == os.path.join(str(tmp_path), '2023', 'CN_2023-04-03.pdf')
+
+    # start_date is inclusive and end_date exclusive
+    selection = index.select('2023-04-03', '2023-04-05')
+    assert get_dates(selection) == ['2023-04-03', '2023-04-04']
+    assert (selection.num_before, selection.num_after, selection.num_undated) == (1, 1, 1)
+
+    assert get_dates(index.select(start_date='2023-04-02')) == ['2023-04-03', '2023-04-04', '2023-04-05']
+    assert get_dates(index.select(end_date='2023-04-02')) == ['2023-04-01']
+    assert get_dates(index.select('2023-04-05', '2023-04-01')) == []
+
+
+def test_refresh_lists_only_changed_folders(tmp_path):
+    notes_path = tmp_path / 'notes'
+    index_file_path = str(tmp_path / 'index.json')
+    write_notes(notes_path, ['2022/CN_2022-04-01.pdf', '2023/CN_2023-04-03.pdf', 'CN_2023-04-04.pdf'])
+    age_folders(notes_path)
+
+    index = NoteDateIndex(str(notes_path), date_patterns=DATE_PATTERNS, index_file_path=index_file_path)
+    index.refresh()
+    assert index.listed_dirs == 3
+    index.save()
+
+    # Loaded from the saved index, nothing changed so nothing is listed
+    index = NoteDateIndex(str(notes_path), date_patterns=DATE_PATTERNS, index_file_path=index_file_path)
+    index.refresh()
+    assert index.listed_dirs == 0
+    assert get_dates(index.select()) == ['2022-04-01', '2023-04-03', '2023-04-04']
+
+    # Only the folder a note was added to is listed again
+    write_notes(notes_path, ['2023/CN_2023-04-05.pdf'])
+    index.refresh()
+    assert index.listed_dirs == 1
+    assert get_dates(index.select('2023-01-01')) == ['2023-04-03', '2023-04-04', '2023-04-05']
+
+    os.remove(notes_path / '2022' / 'CN_2022-04-01.pdf')
+    os.rmdir(notes_path / '2022')
+    index.refresh()
+    assert get_dates(index.select()) == ['2023-04-03', '2023-04-04', '2023-04-05']
+
+
+def test_saved_index_of_other_patterns_is_ignored(tmp_path):
+    notes_path = tmp_path / 'notes'
+    index_file_path = str(tmp_path / 'index.json')
+    write_notes(notes_path, ['CN_2023-04-03.pdf', 'CN_04042023.pdf'])
+    age_folders(notes_path)
+
+    index = NoteDateIndex(str(notes_path), date_patterns=DATE_PATTERNS, index_file_path=index_file_path)
+    index.refresh()
+    index.save()
+
+    index = NoteDateIndex(str(notes_path), date_patterns=DATE_PATTERNS[:1], index_file_path=index_file_path)
+    index.refresh()
+    assert index.listed_dirs == 1
+    assert get_dates(index.select()) == ['2023-04-03']
+    assert index.select().num_undated == 1
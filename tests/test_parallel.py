@@ -0,0 +1,64 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.synthetic import generate_zerodha_data
+from broker import DECIMAL_SCALE, iter_contractnotes, parse_decimal_series
+from brokers import (zerodha_match_summary_dataframe, zerodha_numeric_columns, zerodha_summary_layout, zerodha_summary_table,
+                     zerodha_text_layout)
+from summary_layout import compile_summary_layout
+from table_match import SummaryTableSpec
+from utils.parallel import iter_ordered
+
+
+def slow_square(value):
+    # Later jobs finish first
+    time.sleep(0.01 * (5 - value % 5))
+    return value * value
+
+
+def test_results_in_submission_order():
+    args = [(value,) for value in range(12)]
+    expected = [value * value for value in range(12)]
+    assert list(iter_ordered(slow_square, args)) == expected
+    assert list(iter_ordered(slow_square, args, workers=3)) == expected
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert list(iter_ordered(slow_square, iter(args), executor=executor, window=3)) == expected
+
+
+def test_early_stop_bounds_the_jobs_in_flight():
+    started = []
+    lock = threading.Lock()
+
+    def record(value):
+        with lock:
+            started.append(value)
+        return value
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = iter_ordered(record, ((value,) for value in range(100)), executor=executor, window=4)
+        assert next(results) == 0
+        results.close()
+    assert len(started) <= 5
+
+
+def test_failed_note_does_not_stop_the_others(tmp_path):
+    cnotes_folder_path = generate_zerodha_data(str(tmp_path), 3)
+    jobs = [(os.path.join(cnotes_folder_path, name), name[-14:-4]) for name in sorted(os.listdir(cnotes_folder_path))]
+    corrupt_file_path = os.path.join(cnotes_folder_path, 'Contract_Note_2019-04-02.pdf')
+    with open(corrupt_file_path, 'wb') as f:
+        f.write(b'not a pdf')
+
+    results = list(iter_contractnotes(jobs,
+                                      numeric_columns=zerodha_numeric_columns,
+                                      summary_match_func=zerodha_match_summary_dataframe,
+                                      summary_post_process_func=compile_summary_layout(zerodha_summary_layout, parse_decimal_series, DECIMAL_SCALE),
+                                      text_layout=zerodha_text_layout,
+                                      table_spec=SummaryTableSpec(zerodha_summary_table),
+                                      workers=2))
+
+    assert [result.pdf_file_path for result in results] == [pdf_file_path for (pdf_file_path, date) in jobs]
+    assert [result.error is None for result in results] == [True, False, True]
+    assert results[1].pdf_file_path == corrupt_file_path
+    assert all(result.has_charges() for result in [results[0], results[2]])
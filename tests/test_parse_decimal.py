@@ -0,0 +1,45 @@
+import pandas as pd
+
+from broker import DECIMAL_SCALE, parse_decimal_series
+
+
+def parse(values):
+    return parse_decimal_series(pd.Series(values, dtype=object)).tolist()
+
+
+def test_plain_numbers():
+    assert parse(['12.5', '-3', '0.0001', '.75', '7.']) == [125000, -30000, 1, 7500, 70000]
+
+
+def test_blanks_are_zero():
+    assert parse(['', '   ', '\n']) == [0, 0, 0]
+
+
+def test_missing_cells_are_na():
+    assert parse([None, '-', 'Nil']) == [pd.NA, pd.NA, pd.NA]
+
+
+def test_bracketed_negatives():
+    assert parse(['(12.50)', '( 1,000 )', '(0.01)']) == [-125000, -10000000, -100]
+
+
+def test_trailing_minus_negatives():
+    assert parse(['12.50-', '1,000 -', 'Rs. 0.75-']) == [-125000, -10000000, -7500]
+
+
+def test_thousands_separators():
+    assert parse(['1,234.56', '12,34,567.8', '-1,000']) == [12345600, 12345678000, -10000000]
+
+
+def test_stray_text():
+    assert parse(['Rs. 12.50', '12.50 Cr', '₹ 1,234', 'Dr 5']) == [125000, 125000, 12340000, 50000]
+
+
+def test_rounding_at_decimal_scale():
+    assert DECIMAL_SCALE == 4
+    assert parse(['0.00004', '0.00005', '1.23456', '-1.23455', '(2.99995)']) == [0, 1, 12346, -12346, -30000]
+
+
+def test_ambiguous_cells_are_na():
+    assert parse(['1e3', '1.5E-2', '2 lots 12.50', '12.50 / 13.50']) == [pd.NA, pd.NA, pd.NA, pd.NA]
+    assert parse(['-12.50-', '- 1,000 -']) == [pd.NA, pd.NA]
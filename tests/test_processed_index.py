@@ -0,0 +1,44 @@
+import os
+
+import pandas as pd
+
+from broker import get_processed_index, is_processed, iter_contractnote_files
+
+
+def write_notes(folder_path, dates):
+    os.makedirs(folder_path, exist_ok=True)
+    for date in dates:
+        with open(os.path.join(folder_path, f'Contract_Note_{date}.pdf'), 'wb') as f:
+            f.write(b'%PDF-1.4')
+
+
+def test_processed_by_date_and_document():
+    aggregate_df = pd.DataFrame({'Date': ['2023-04-03', '2023-04-03', '2023-04-04'],
+                                 'Document': ['notes/a.pdf', './notes/b.pdf', None]})
+    processed_index = get_processed_index(aggregate_df)
+
+    assert is_processed(processed_index, '2023-04-03', 'notes/a.pdf')
+    assert is_processed(processed_index, '2023-04-03', 'notes/b.pdf')
+    # Another note of an already read date is still read
+    assert not is_processed(processed_index, '2023-04-03', 'notes/c.pdf')
+    assert not is_processed(processed_index, '2023-04-05', 'notes/a.pdf')
+    # A row without its document covers the whole date
+    assert is_processed(processed_index, '2023-04-04', 'notes/d.pdf')
+
+
+def test_aggregate_without_documents_is_indexed_by_date():
+    processed_index = get_processed_index(pd.DataFrame({'Date': ['2023-04-03']}))
+    assert is_processed(processed_index, '2023-04-03', 'notes/any.pdf')
+    assert get_processed_index(pd.DataFrame()) == set()
+
+
+def test_processed_notes_are_skipped(tmp_path):
+    cnotes_folder_path = str(tmp_path / 'notes')
+    write_notes(cnotes_folder_path, ['2023-04-03', '2023-04-04', '2023-04-05'])
+    aggregate_df = pd.DataFrame({'Date': ['2023-04-04'], 'Document': [os.path.join(cnotes_folder_path, 'Contract_Note_2023-04-04.pdf')]})
+
+    jobs = list(iter_contractnote_files(cnotes_folder_path, processed_index=get_processed_index(aggregate_df), verbose=False))
+    assert [date for (pdf_file_path, date) in jobs] == ['2023-04-03', '2023-04-05']
+
+    jobs = list(iter_contractnote_files(cnotes_folder_path, start_date='2023-04-04', verbose=False))
+    assert [date for (pdf_file_path, date) in jobs] == ['2023-04-04', '2023-04-05']
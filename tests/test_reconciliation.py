@@ -0,0 +1,88 @@
+import pandas as pd
+
+from reconciliation import (STATUS_AMOUNT_MISMATCH, STATUS_MATCHED, STATUS_MISSING_AMOUNT, STATUS_MISSING_IN_CHARGES,
+                            STATUS_MISSING_IN_LEDGER, reconcile_amounts, summarize_reconciliation)
+
+
+def get_ledger_df(rows):
+    return pd.DataFrame(rows, columns=['Date', 'Debit', 'Credit'])
+
+
+def get_charges_df(rows, columns=('Date', 'Net-Total', 'Document')):
+    return pd.DataFrame(rows, columns=list(columns))
+
+
+def get_statuses(report_df):
+    return dict(zip(report_df['Date'], report_df['Status']))
+
+
+def test_statuses():
+    ledger_df = get_ledger_df([['2023-04-03', 0, 100.25],
+                               ['2023-04-04', 50.0, 0],
+                               ['2023-04-05', 0, 10.0],
+                               ['2023-04-07', 20.0, 0]])
+    charges_df = get_charges_df([['2023-04-03', 100.25, 'a.pdf'],
+                                 ['2023-04-04', -49.0, 'b.pdf'],
+                                 ['2023-04-05', 4.0, 'c.pdf'],
+                                 ['2023-04-05', 6.0, 'd.pdf'],
+                                 ['2023-04-06', 1.0, 'e.pdf']])
+
+    report_df = reconcile_amounts(ledger_df, charges_df, charges_amount_column='Net-Total')
+    assert get_statuses(report_df) == {'2023-04-03': STATUS_MATCHED,
+                                       '2023-04-04': STATUS_AMOUNT_MISMATCH,
+                                       '2023-04-05': STATUS_MATCHED,
+                                       '2023-04-06': STATUS_MISSING_IN_LEDGER,
+                                       '2023-04-07': STATUS_MISSING_IN_CHARGES}
+    assert report_df.set_index('Date').loc['2023-04-05', 'Documents'] == 'c.pdf, d.pdf'
+    assert report_df.set_index('Date').loc['2023-04-04', 'Difference'] == 1.0
+
+
+def test_tolerance():
+    ledger_df = get_ledger_df([['2023-04-03', 0, 100.0], ['2023-04-04', 0, 100.0]])
+    charges_df = get_charges_df([['2023-04-03', 100.01, 'a.pdf'], ['2023-04-04', 100.02, 'b.pdf']])
+
+    report_df = reconcile_amounts(ledger_df, charges_df, charges_amount_column='Net-Total', tolerance=0.01)
+    assert get_statuses(report_df) == {'2023-04-03': STATUS_MATCHED, '2023-04-04': STATUS_AMOUNT_MISMATCH}
+
+
+def test_dates_only_without_amount_column():
+    ledger_df = get_ledger_df([['2023-04-03', 0, 100.0], ['2023-04-04', 0, 1.0]])
+    charges_df = get_charges_df([['2023-04-03', 5.0, 'a.pdf']])
+
+    report_df = reconcile_amounts(ledger_df, charges_df)
+    assert get_statuses(report_df) == {'2023-04-03': STATUS_MATCHED, '2023-04-04': STATUS_MISSING_IN_CHARGES}
+
+
+def test_aggregate_without_amount_column():
+    # An aggregate written before the amount column was added
+    ledger_df = get_ledger_df([['2023-04-03', 0, 100.0], ['2023-04-04', 0, 1.0]])
+    charges_df = get_charges_df([['2023-04-03', 'a.pdf']], columns=['Date', 'Document'])
+
+    report_df = reconcile_amounts(ledger_df, charges_df, charges_amount_column='Net-Total')
+    assert get_statuses(report_df) == {'2023-04-03': STATUS_MISSING_AMOUNT, '2023-04-04': STATUS_MISSING_IN_CHARGES}
+    assert summarize_reconciliation(report_df)[STATUS_MISSING_AMOUNT] == 1
+
+
+def test_blank_amount():
+    ledger_df = get_ledger_df([['2023-04-03', 0, 100.0], ['2023-04-04', 0, 1.0]])
+    charges_df = get_charges_df([['2023-04-03', 60.0, 'a.pdf'], ['2023-04-03', None, 'b.pdf'], ['2023-04-04', 1.0, 'c.pdf']])
+
+    report_df = reconcile_amounts(ledger_df, charges_df, charges_amount_column='Net-Total')
+    assert get_statuses(report_df) == {'2023-04-03': STATUS_MISSING_AMOUNT, '2023-04-04': STATUS_MATCHED}
+
+
+def test_broker_reconcile_within_range(tmp_path):
+    from brokers import create_broker
+
+    broker = create_broker('Zerodha', input_path_prefix=str(tmp_path / 'data'), compute_path_prefix=str(tmp_path / 'compute'))
+    # The ledger is read for the range, the charges are those of the whole aggregate
+    broker.tradeledger_df = pd.DataFrame([['2023-04-04', 0, 10.0], ['2023-04-05', 0, 20.0]],
+                                         columns=[broker.fledger_date_column, broker.fledger_debit_column, broker.fledger_credit_column])
+    broker.summary_aggregate_df = get_charges_df([['2023-04-03', 1.0, 'a.pdf'],
+                                                  ['2023-04-04', 10.0, 'b.pdf'],
+                                                  ['2023-04-05', 20.0, 'c.pdf'],
+                                                  ['2023-04-06', 30.0, 'd.pdf']])
+
+    broker.reconcile(start_date='2023-04-04', end_date='2023-04-06')
+    assert get_statuses(broker.reconciled_df) == {'2023-04-04': STATUS_MATCHED, '2023-04-05': STATUS_MATCHED}
+    assert len(broker.missing_missing_df) == 0
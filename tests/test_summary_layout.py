@@ -0,0 +1,92 @@
+import pandas as pd
+
+from broker import DECIMAL_SCALE, parse_decimal_frame, parse_decimal_series
+from brokers import axisdirect_numeric_columns, axisdirect_summary_layout, zerodha_numeric_columns, zerodha_summary_layout
+from summary_layout import compile_summary_layout, materialize_charges
+
+
+# The post-process functions the layouts replaced, kept here as the reference for their output
+
+def old_zerodha_post_process(cnote_file_path, date, df):
+    if df.shape[1] == 4:
+        df['Equity (T+1)'] = ""
+
+    summary_df = parse_decimal_frame(df[zerodha_numeric_columns])
+    charges_sum_df = summary_df.iloc[1:-1].sum().to_frame().transpose()
+    charges_sum_df['Net-Total'] = summary_df.iloc[-1]['NET TOTAL']
+    charges_sum_df = charges_sum_df.astype('Float64').astype(float) / (10 ** DECIMAL_SCALE)
+    charges_sum_df['Date'] = date
+    charges_sum_df['Document'] = cnote_file_path
+    return charges_sum_df
+
+
+def old_axisdirect_post_process(cnote_file_path, date, df):
+    rows = axisdirect_summary_layout['aggregates']['rows']
+    df = parse_decimal_frame(df[axisdirect_numeric_columns])
+    charges_df = df.iloc[[row['row'] for row in rows]]
+
+    aggregate_map = {}
+    for (index, (dfidx, row)) in enumerate(charges_df.iterrows()):
+        key = rows[index]['aggregate']
+        if key not in aggregate_map:
+            aggregate_map[key + '-EQ'] = 0
+            aggregate_map[key + '-FnO'] = 0
+            aggregate_map[key] = 0
+        aggregate_map[key + '-EQ'] += row['NCL-EQUITY']
+        aggregate_map[key + '-FnO'] += row['NCL F&O']
+        aggregate_map[key] += row['Total(Net)']
+
+    charges_sum_df = charges_df.sum().to_frame().transpose()
+    for (key, value) in aggregate_map.items():
+        charges_sum_df[key] = value
+    for (prefix, row) in [('Gross', 0), ('Net', 15)]:
+        charges_sum_df[f'{prefix}-EQ'] = df.iloc[row]['NCL-EQUITY']
+        charges_sum_df[f'{prefix}-FnO'] = df.iloc[row]['NCL F&O']
+        charges_sum_df[f'{prefix}-Total'] = df.iloc[row]['Total(Net)']
+    charges_sum_df['NetGrossDiff'] = charges_sum_df.loc[0, 'Net-Total'] - charges_sum_df.loc[0, 'Gross-Total']
+    charges_sum_df['Status'] = charges_sum_df.loc[0, 'NetGrossDiff'] - charges_sum_df.loc[0, 'Total(Net)']
+    charges_sum_df = charges_sum_df.astype('Float64').astype(float) / (10 ** DECIMAL_SCALE)
+    charges_sum_df['Date'] = date
+    charges_sum_df['Document'] = cnote_file_path
+    return charges_sum_df
+
+
+def get_zerodha_table(with_t1=True):
+    rows = [['Pay in/Pay out obligation', '1,000.00', '250.50', '(2,000.00)', '(749.50)']]
+    for index in range(1, 10):
+        rows.append([f'Charge {index}', f'({index}.1{index})', '' if index % 3 else '0.05', f'({index * 2}.3333)', f'({index * 3}.45)'])
+    rows.append(['Net amount receivable/(payable) by client', '950.20', '240.00', '(2,100.75)', '(910.5549)'])
+    df = pd.DataFrame(rows, columns=['Particulars'] + zerodha_numeric_columns, dtype=object)
+    if not with_t1:
+        df = df.drop(columns=['Equity (T+1)'])
+    return df
+
+
+def get_axisdirect_table():
+    rows = []
+    for index in range(16):
+        equity = f'({index + 1}.25)' if index % 2 else f'{index * 10}.5'
+        fno = '' if index % 4 == 3 else f'{index}.1234'
+        rows.append([f'Row {index}', equity, fno, '0.00', f'{index * 7}.9', f'{index}'])
+    rows[0][1:5] = ['12,345.67', '(8,765.4321)', '0.00', '3,580.2379']
+    rows[15][1:5] = ['12,300.00', '(8,800.00)', '0.00', '3,500.00']
+    return pd.DataFrame(rows, columns=['Particulars'] + axisdirect_numeric_columns + ['Extra'], dtype=object)
+
+
+def assert_same_rows(layout, old_func, df):
+    plan = compile_summary_layout(layout, parse_decimal_series, DECIMAL_SCALE)
+    new_df = materialize_charges([plan('note.pdf', '2023-04-03', df.copy())])
+    old_df = old_func('note.pdf', '2023-04-03', df.copy())
+    pd.testing.assert_frame_equal(new_df, old_df, check_index_type=False)
+
+
+def test_zerodha_plan_matches_old_post_process():
+    assert_same_rows(zerodha_summary_layout, old_zerodha_post_process, get_zerodha_table())
+
+
+def test_zerodha_plan_matches_old_post_process_without_t1():
+    assert_same_rows(zerodha_summary_layout, old_zerodha_post_process, get_zerodha_table(with_t1=False))
+
+
+def test_axisdirect_plan_matches_old_post_process():
+    assert_same_rows(axisdirect_summary_layout, old_axisdirect_post_process, get_axisdirect_table())
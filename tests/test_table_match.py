@@ -0,0 +1,81 @@
+import pandas as pd
+
+from broker import get_summary_dataframe
+from brokers import axisdirect_summary_table, zerodha_summary_table
+from table_match import LayoutIndex, SummaryTableSpec, TableFingerprint
+
+
+class FakeTable:
+    # The attributes of a camelot table used by get_summary_dataframe
+    def __init__(self, data, page=1):
+        self.data = data
+        self.df = pd.DataFrame(data)
+        self.page = page
+
+
+def get_zerodha_cells(num_columns=5):
+    header = ['', 'Equity', 'Equity (T+1)', 'Futures and\nOptions', 'NET TOTAL']
+    if num_columns == 4:
+        header.remove('Equity (T+1)')
+    rows = [['Pay in/Pay out obligation'] + ['0.00'] * (num_columns - 1)]
+    rows += [[f'Charge {index}'] + ['0.00'] * (num_columns - 1) for index in range(9)]
+    rows.append(['Net amount receivable/(payable) by client'] + ['0.00'] * (num_columns - 1))
+    return [header] + rows
+
+
+def test_spec_matches_both_zerodha_widths():
+    spec = SummaryTableSpec(zerodha_summary_table)
+    assert spec.get_mismatches(TableFingerprint(get_zerodha_cells(5))) == []
+    assert spec.get_mismatches(TableFingerprint(get_zerodha_cells(4))) == []
+
+
+def test_spec_mismatches():
+    spec = SummaryTableSpec(zerodha_summary_table)
+    cells = get_zerodha_cells()
+    assert spec.get_mismatches(TableFingerprint(cells[:-1])) == [
+        "10 rows instead of [11]", "row labels ['net amount receivable'] not found"]
+    assert spec.get_mismatches(TableFingerprint([row + [''] for row in cells])) == ["6 columns instead of [4, 5]"]
+    header = ['', 'Equity', 'Equity (T+1)', 'Futures', 'Total']
+    assert spec.get_mismatches(TableFingerprint([header] + cells[1:])) == ["header labels ['futures and options', 'net total'] not found"]
+    assert spec.get_mismatches(TableFingerprint([])) != []
+
+    # Axisdirect has no row labels nor number of rows
+    spec = SummaryTableSpec(axisdirect_summary_table)
+    header = ['', 'NCL-EQUITY', 'NCL  F&O', 'ncl cdx', 'Total(Net)', '']
+    assert spec.get_mismatches(TableFingerprint([header] + [['x'] * 6] * 3)) == []
+
+
+def test_get_summary_dataframe_converts_only_matching_tables():
+    spec = SummaryTableSpec(zerodha_summary_table)
+    other = FakeTable([['Trade', 'Qty'], ['A', '1']])
+    summary = FakeTable(get_zerodha_cells())
+    match_info = {}
+
+    df = get_summary_dataframe([other, summary], None, page_num=3, table_spec=spec, match_info=match_info)
+    assert list(df.columns) == ['', 'Equity', 'Equity (T+1)', 'Futures and Options', 'NET TOTAL']
+    assert len(df) == 11
+    assert match_info['table_index'] == 1
+    assert list(match_info['mismatches']) == [(3, 0)]
+
+    # The match function still has the last word
+    assert get_summary_dataframe([other, summary], lambda df, page_num=None: False, table_spec=spec) is None
+
+
+def test_layout_index_orders_positions_by_count(tmp_path):
+    index_file_path = str(tmp_path / 'layout_index.json')
+    index = LayoutIndex(index_file_path)
+    assert index.get_preferred() is None
+    assert index.order_page_nums([5, 4, 3], 5) == [5, 4, 3]
+
+    for position in [(1, 2), (0, 0), (1, 2), (1, 0)]:
+        index.record(position)
+    assert index.get_preferred() == (1, 2)
+    # Offsets are counted from the last page
+    assert index.order_page_nums([5, 4, 3], 5) == [4, 5, 3]
+    assert index.order_table_indices(1, 3) == [2, 0, 1]
+    assert index.order_table_indices(1, 2) == [0, 1]
+    index.save()
+
+    index = LayoutIndex(index_file_path)
+    assert index.counts == {(1, 2): 2, (0, 0): 1, (1, 0): 1}
+    assert not index.dirty
@@ -0,0 +1,95 @@
+import os
+
+from benchmarks.synthetic import generate_zerodha_data
+from broker import get_summary_dataframe_from_pdf, get_summary_dataframe_from_text_layer, parse_decimal_frame
+from brokers import zerodha_numeric_columns, zerodha_summary_table, zerodha_text_layout
+from table_match import SummaryTableSpec
+from text_extract import get_summary_dataframe_from_text, validate_summary_dataframe
+
+
+TEXT_LAYOUT = {
+    'header_labels': ['Equity', 'F&O', 'Total'],
+    'num_rows': 2,
+    'row_total': {'columns': ['Equity', 'F&O'], 'total': 'Total'},
+}
+
+
+class FakePage:
+    # Feeds (x, y, text) fragments to the visitor the way pypdf does, with identity matrices
+    def __init__(self, fragments):
+        self.fragments = fragments
+
+    def extract_text(self, visitor_text=None):
+        for (x, y, text) in self.fragments:
+            visitor_text(text, [1, 0, 0, 1, 0, 0], [1, 0, 0, 1, x, y], None, 8)
+
+
+class FakeReader:
+    def __init__(self, pages):
+        self.pages = pages
+
+
+def get_page(rows, header=('Equity', 'F&O', 'Total')):
+    fragments = [(x, 700, label) for (x, label) in zip([200, 300, 400], header)]
+    for (index, (label, *cells)) in enumerate(rows):
+        y = 680 - 20 * index
+        fragments.append((40, y, label))
+        # Right aligned numbers sit a little off their header
+        fragments.extend((x + 10, y + 1, cell) for (x, cell) in zip([200, 300, 400], cells) if cell)
+    # Text outside the table
+    fragments.append((40, 760, 'Contract Note'))
+    return FakePage(fragments)
+
+
+def test_rows_are_rebuilt_from_the_text_layer():
+    page = get_page([['Brokerage', '10.00', '(2.50)', '7.50'], ['Net amount', '', '1,000', '1,000']])
+    df = get_summary_dataframe_from_text(page, TEXT_LAYOUT)
+    assert list(df.columns) == ['', 'Equity', 'F&O', 'Total']
+    assert df.values.tolist() == [['Brokerage', '10.00', '(2.50)', '7.50'], ['Net amount', '', '1,000', '1,000']]
+    assert validate_summary_dataframe(df, TEXT_LAYOUT, parse_decimal_frame)
+
+
+def test_missing_anchors_or_rows():
+    assert get_summary_dataframe_from_text(get_page([['Brokerage', '1', '1', '2']], header=('Equity', 'FnO', 'Total')), TEXT_LAYOUT) is None
+    assert get_summary_dataframe_from_text(get_page([['Brokerage', '1', '1', '2']]), TEXT_LAYOUT) is None
+
+
+def test_validation_failures():
+    for rows in [
+        # Row totals do not add up, e.g. a cell assigned to the wrong column
+        [['Brokerage', '10.00', '', '7.50'], ['Net amount', '0', '1', '1']],
+        # Non numeric cell
+        [['Brokerage', '10.00', 'n/a', '10.00'], ['Net amount', '0', '1', '1']],
+        # Row without a label
+        [['', '10.00', '1', '11.00'], ['Net amount', '0', '1', '1']],
+    ]:
+        df = get_summary_dataframe_from_text(get_page(rows), TEXT_LAYOUT)
+        assert df is not None
+        assert not validate_summary_dataframe(df, TEXT_LAYOUT, parse_decimal_frame)
+
+
+def test_text_layer_falls_through_invalid_pages():
+    invalid_page = get_page([['Brokerage', '10.00', '', '7.50'], ['Net amount', '0', '1', '1']])
+    valid_page = get_page([['Brokerage', '10.00', '(2.50)', '7.50'], ['Net amount', '0', '1', '1']])
+    reader = FakeReader([valid_page, invalid_page, FakePage([])])
+
+    # The last page first, as the pages of a note are scanned
+    df = get_summary_dataframe_from_text_layer(reader, [3, 2, 1], TEXT_LAYOUT)
+    assert df['Total'].tolist() == ['7.50', '1']
+
+    # No valid page, the caller then falls back to Camelot
+    assert get_summary_dataframe_from_text_layer(reader, [3, 2], TEXT_LAYOUT) is None
+
+
+def test_camelot_fallback_reads_the_same_table(tmp_path):
+    cnotes_folder_path = generate_zerodha_data(str(tmp_path), 1)
+    pdf_file_path = os.path.join(cnotes_folder_path, os.listdir(cnotes_folder_path)[0])
+    table_spec = SummaryTableSpec(zerodha_summary_table)
+
+    text_df = get_summary_dataframe_from_pdf(pdf_file_path, text_layout=zerodha_text_layout, table_spec=table_spec)
+    # Anchors missing from the text layer, the table is then read with Camelot
+    broken_layout = dict(zerodha_text_layout, header_labels=['Equity', 'Currency', 'NET TOTAL'])
+    camelot_df = get_summary_dataframe_from_pdf(pdf_file_path, text_layout=broken_layout, table_spec=table_spec)
+
+    assert len(text_df) == len(camelot_df) == 11
+    assert text_df[zerodha_numeric_columns].values.tolist() == camelot_df[zerodha_numeric_columns].values.tolist()
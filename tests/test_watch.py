@@ -0,0 +1,96 @@
+import os
+
+import numpy as np
+import pytest
+
+from broker import ExtractionResult
+from charges_store import PartitionedChargesStore
+from summary_layout import ChargesRecord, ChargesSchema
+from watch import ContractNoteWatcher, NoteManifest
+
+
+SCHEMA = ChargesSchema(['Net-Total'], 4)
+
+
+class FakeBroker:
+    # Just what the watcher uses of a Broker, with notes "extracted" from their file content
+    charges_date_column = 'Date'
+    charges_rollup = None
+    note_index = None
+
+    def __init__(self, tmp_path, interrupt_after=0):
+        self.charges_file_path = str(tmp_path / 'compute' / 'charges.parquet')
+        self.charges_store = PartitionedChargesStore(self.charges_file_path)
+        self.interrupt_after = interrupt_after
+        self.cnote_failures = []
+
+    def iter_contract_notes(self, workers=1, executor=None, jobs=None):
+        for (count, (pdf_file_path, date)) in enumerate(jobs):
+            if self.interrupt_after and count >= self.interrupt_after:
+                raise KeyboardInterrupt()
+            with open(pdf_file_path) as f:
+                content = f.read()
+            if content == 'corrupt':
+                yield ExtractionResult(pdf_file_path, date, error='no summary table')
+                continue
+            charges = ChargesRecord(SCHEMA, np.array([float(content) * 10 ** SCHEMA.scale]), date, pdf_file_path)
+            yield ExtractionResult(pdf_file_path, date, charges=charges)
+
+
+def write_notes(tmp_path, contents):
+    notes = []
+    for (day, content) in enumerate(contents, start=1):
+        pdf_file_path = str(tmp_path / f'Contract_Note_2019-04-{day:02d}.pdf')
+        with open(pdf_file_path, 'w') as f:
+            f.write(content)
+        notes.append((pdf_file_path, f'2019-04-{day:02d}'))
+    return notes
+
+
+def get_watcher(broker, tmp_path):
+    return ContractNoteWatcher(broker, manifest_file_path=str(tmp_path / 'compute' / 'watch_manifest.json'), settle_seconds=0)
+
+
+def test_interrupted_cycle_leaves_the_notes_to_the_next_one(tmp_path):
+    notes = write_notes(tmp_path, ['1', '2', '3'])
+
+    watcher = get_watcher(FakeBroker(tmp_path, interrupt_after=2), tmp_path)
+    with pytest.raises(KeyboardInterrupt):
+        watcher.extract(watcher.manifest.scan(notes, settle_seconds=0))
+    assert not os.path.exists(watcher.manifest.manifest_file_path)
+    assert not watcher.broker.charges_store.exists()
+
+    # The next run extracts all three notes
+    watcher = get_watcher(FakeBroker(tmp_path), tmp_path)
+    pending = watcher.manifest.scan(notes, processed_index_func=watcher.get_processed_index, settle_seconds=0)
+    assert len(pending) == 3
+    watcher.extract(pending)
+    assert sorted(watcher.broker.charges_store.read()['Net-Total']) == [1, 2, 3]
+    assert NoteManifest(watcher.manifest.manifest_file_path).get(notes[0][0])['status'] == 'processed'
+
+
+def test_failed_note_is_retried_after_a_backoff_or_a_change(tmp_path):
+    notes = write_notes(tmp_path, ['1', 'corrupt'])
+    watcher = get_watcher(FakeBroker(tmp_path), tmp_path)
+    watcher.extract(watcher.manifest.scan(notes, settle_seconds=0))
+    entry = watcher.manifest.get(notes[1][0])
+    assert (entry['status'], entry['attempts']) == ('failed', 1)
+
+    # Unchanged and not yet due
+    assert watcher.manifest.scan(notes, settle_seconds=0) == []
+
+    # Due: extracted again, and fails with a longer backoff
+    entry['retry_at'] = 0
+    pending = watcher.manifest.scan(notes, settle_seconds=0)
+    assert [note['path'] for note in pending] == [notes[1][0]]
+    watcher.extract(pending)
+    retried_entry = watcher.manifest.get(notes[1][0])
+    assert retried_entry['attempts'] == 2
+    assert watcher.manifest.scan(notes, settle_seconds=0) == []
+
+    # Fixed: extracted on the next scan
+    with open(notes[1][0], 'w') as f:
+        f.write('2.5')
+    watcher.extract(watcher.manifest.scan(notes, settle_seconds=0))
+    assert watcher.manifest.get(notes[1][0])['status'] == 'processed'
+    assert sorted(watcher.broker.charges_store.read()['Net-Total']) == [1, 2.5]
@@ -0,0 +1,97 @@
+import json
+import time
+
+import pytest
+
+from work_queue import FolderWorkQueue, SqliteWorkQueue, iter_queue_results
+
+
+SPEC = {'broker': 'Zerodha', 'input_path_prefix': 'data', 'compute_path_prefix': 'compute'}
+JOBS = [('notes/a.pdf', '2023-04-03'), ('notes/b.pdf', '2023-04-04')]
+
+
+def get_queue(kind, tmp_path, **kwargs):
+    if kind == 'sqlite':
+        return SqliteWorkQueue(str(tmp_path / 'queue.db'), **kwargs)
+    return FolderWorkQueue(str(tmp_path / 'queue'), **kwargs)
+
+
+def get_result(job, error=None):
+    return json.dumps({'document': job.document, 'date': job.date, 'error': error})
+
+
+@pytest.fixture(params=['sqlite', 'folder'])
+def kind(request):
+    return request.param
+
+
+def test_lease_in_order(kind, tmp_path):
+    queue = get_queue(kind, tmp_path)
+    queue.enqueue('run1', SPEC, JOBS)
+
+    first = queue.lease('w1')
+    second = queue.lease('w2')
+    assert (first.document, first.seq, first.attempts, first.spec) == ('notes/a.pdf', 0, 1, SPEC)
+    assert (second.document, second.seq) == ('notes/b.pdf', 1)
+    assert queue.lease('w3') is None
+
+
+def test_expired_lease_is_leased_again(kind, tmp_path):
+    queue = get_queue(kind, tmp_path, lease_seconds=0.05)
+    queue.enqueue('run1', SPEC, JOBS[:1])
+
+    job = queue.lease('w1')
+    assert queue.lease('w2') is None
+    time.sleep(0.1)
+
+    job_again = queue.lease('w2')
+    assert (job_again.document, job_again.attempts) == ('notes/a.pdf', 2)
+    # The result of the worker that lost the lease is ignored
+    assert not queue.complete(job, 'w1', get_result(job))
+    assert queue.complete(job_again, 'w2', get_result(job_again))
+    assert [seq for (seq, result) in queue.collect('run1')] == [0]
+
+
+def test_lease_deadline_is_the_one_of_the_leasing_worker(kind, tmp_path):
+    # A process with a shorter lease_seconds does not expire the lease of another worker early
+    queue = get_queue(kind, tmp_path, lease_seconds=60)
+    queue.enqueue('run1', SPEC, JOBS[:1])
+    job = queue.lease('w1')
+
+    impatient_queue = get_queue(kind, tmp_path, lease_seconds=0.01)
+    time.sleep(0.05)
+    assert impatient_queue.lease('w2') is None
+    assert queue.complete(job, 'w1', get_result(job))
+    impatient_queue.close()
+
+
+def test_lease_fails_after_max_attempts(kind, tmp_path):
+    queue = get_queue(kind, tmp_path, lease_seconds=0.01, max_attempts=2)
+    queue.enqueue('run1', SPEC, JOBS[:1])
+
+    assert queue.lease('w1').attempts == 1
+    time.sleep(0.05)
+    assert queue.lease('w2').attempts == 2
+    time.sleep(0.05)
+    assert queue.lease('w3') is None
+
+    [(seq, result)] = queue.collect('run1')
+    assert json.loads(result)['error'] == "RuntimeError: lease expired 2 times"
+
+
+def test_release_keeps_the_attempt(kind, tmp_path):
+    queue = get_queue(kind, tmp_path)
+    queue.enqueue('run1', SPEC, JOBS[:1])
+
+    queue.release(queue.lease('w1'), 'w1')
+    assert queue.lease('w2').attempts == 1
+
+
+def test_coordinator_times_out_without_workers(kind, tmp_path):
+    queue = get_queue(kind, tmp_path, wait_timeout=0.1)
+    results = iter_queue_results(queue, JOBS, SPEC, poll_interval=0.01)
+
+    with pytest.raises(RuntimeError, match='finished in 0.1 seconds'):
+        next(results)
+    # The jobs of the run are removed from the queue
+    assert queue.lease('w1') is None
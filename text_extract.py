@@ -0,0 +1,124 @@
+import re
+
+import pandas as pd
+
+from utils.debug import debug_log
+
+
+# A text layout describes a fixed summary table well enough to rebuild it from the text layer:
+#
+#   header_labels     column headers used as anchors, also the DataFrame columns
+#   num_rows          number of rows below the header
+#   label_header      name of the row label column (the first column of the Camelot table)
+#   column_tolerance  max horizontal distance of a cell from its column header
+#   row_tolerance     max vertical distance of fragments on the same row
+#   row_total         optional {'columns': [...], 'total': column, 'skip_rows': [...]}
+#                     checked on every row to validate the column assignment
+TEXT_LAYOUT_DEFAULTS = {
+    'label_header': '',
+    'column_tolerance': 40,
+    'row_tolerance': 2,
+    'row_total': None,
+}
+
+whitespace_run_regex = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    return whitespace_run_regex.sub(" ", text).strip()
+
+
+def get_text_fragments(page):
+    fragments = []
+
+    def visitor(text, cm, tm, font_dict, font_size):
+        text = normalize_text(text)
+        if not text:
+            return
+        x = tm[4] * cm[0] + tm[5] * cm[2] + cm[4]
+        y = tm[4] * cm[1] + tm[5] * cm[3] + cm[5]
+        fragments.append((x, y, text))
+
+    page.extract_text(visitor_text=visitor)
+    return fragments
+
+
+def group_fragments_into_lines(fragments, row_tolerance):
+    # Top of the page first, each line sorted left to right
+    lines = []
+    for fragment in sorted(fragments, key=lambda fragment: -fragment[1]):
+        if lines and abs(lines[-1][0] - fragment[1]) <= row_tolerance:
+            lines[-1][1].append(fragment)
+        else:
+            lines.append((fragment[1], [fragment]))
+
+    return [(y, sorted(line, key=lambda fragment: fragment[0])) for (y, line) in lines]
+
+
+def find_header_line(lines, header_labels):
+    for (index, (y, line)) in enumerate(lines):
+        positions = {}
+        for (x, _, text) in line:
+            if text in header_labels and text not in positions:
+                positions[text] = x
+        if len(positions) == len(header_labels):
+            return (index, [positions[label] for label in header_labels])
+
+    return (None, None)
+
+
+def get_summary_dataframe_from_text(page, text_layout):
+    # Returns None when the anchors are not found, the caller then falls back to Camelot
+    layout = dict(TEXT_LAYOUT_DEFAULTS, **text_layout)
+    header_labels = layout['header_labels']
+    num_rows = layout['num_rows']
+
+    lines = group_fragments_into_lines(get_text_fragments(page), layout['row_tolerance'])
+    (header_index, header_positions) = find_header_line(lines, header_labels)
+    if header_index is None:
+        return None
+
+    label_limit = min(header_positions) - layout['column_tolerance']
+    rows = []
+    for (y, line) in lines[header_index + 1:header_index + 1 + num_rows]:
+        row = [""] * (len(header_labels) + 1)
+        for (x, _, text) in line:
+            if x < label_limit:
+                row[0] = normalize_text(row[0] + " " + text)
+                continue
+
+            distances = [abs(x - header_x) for header_x in header_positions]
+            column = distances.index(min(distances))
+            if distances[column] <= layout['column_tolerance']:
+                row[column + 1] = normalize_text(row[column + 1] + " " + text)
+        rows.append(row)
+
+    if len(rows) != num_rows:
+        return None
+
+    return pd.DataFrame(rows, columns=[layout['label_header']] + header_labels)
+
+
+def validate_summary_dataframe(df, text_layout, parse_func):
+    # Every row needs a label, every non blank cell must be a number and row totals must add up
+    layout = dict(TEXT_LAYOUT_DEFAULTS, **text_layout)
+
+    if (df[layout['label_header']] == "").any():
+        debug_log("Text layout validation failed: row without a label")
+        return False
+
+    numeric_df = df[layout['header_labels']]
+    values_df = parse_func(numeric_df)
+    if (values_df.isna() & (numeric_df != "")).any().any():
+        debug_log("Text layout validation failed: non numeric cell")
+        return False
+
+    row_total = layout['row_total']
+    if row_total is not None:
+        rows = [row for row in range(len(df)) if row not in row_total.get('skip_rows', [])]
+        values_df = values_df.iloc[rows]
+        if (values_df[row_total['columns']].sum(axis=1) != values_df[row_total['total']]).any():
+            debug_log("Text layout validation failed: row totals do not add up")
+            return False
+
+    return True
@@ -0,0 +1,187 @@
+import os
+import hashlib
+import pickle
+import tempfile
+
+
+DEFAULT_CACHE_MAX_SIZE = 512 * 1024 * 1024
+# An eviction goes down to this fraction of max_size, so that the folder is not listed again on the next put
+EVICTION_TARGET = 0.9
+CACHE_FILE_EXTENSION = '.pkl'
+
+
+def get_file_hash(file_path, block_size=1024 * 1024):
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def get_function_identity(func):
+    if func is None:
+        return None
+
+    # The code object is part of the identity so that editing the function invalidates its entries
+    code = getattr(func, '__code__', None)
+    code_hash = None
+    if code is not None:
+        code_hash = hashlib.sha256(code.co_code + repr(code.co_consts).encode()).hexdigest()[:16]
+    return f"{getattr(func, '__module__', '')}.{getattr(func, '__qualname__', repr(func))}:{code_hash}"
+
+
+class ExtractionCache:
+    # The size of the folder is listed once and then kept up to date with the entries written by this
+    # process. Entries written by other workers are only counted at the next listing, done when this
+    # process sees the folder over max_size, so with several workers it can overshoot until then.
+    def __init__(self, cache_folder_path, max_size=DEFAULT_CACHE_MAX_SIZE):
+        self.cache_folder_path = cache_folder_path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_size = None
+
+    def make_key(self, file_path, **config):
+        config_str = repr(sorted(config.items()))
+        config_hash = hashlib.sha256(config_str.encode()).hexdigest()[:16]
+        return f"{get_file_hash(file_path)}-{config_hash}"
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_folder_path, key + CACHE_FILE_EXTENSION)
+
+    def _entries(self):
+        if not os.path.exists(self.cache_folder_path):
+            return []
+
+        entries = []
+        for entry in os.scandir(self.cache_folder_path):
+            if entry.name.endswith(CACHE_FILE_EXTENSION):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def get(self, key):
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, 'rb') as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception:
+            # Truncated, corrupt, or pickled with classes that no longer load: the entry is useless
+            self.misses += 1
+            try:
+                size = os.path.getsize(entry_path)
+                os.remove(entry_path)
+                if self.total_size is not None:
+                    self.total_size -= size
+            except OSError:
+                pass
+            return None
+
+        # mtime doubles as the last access time for eviction
+        try:
+            os.utime(entry_path)
+        except FileNotFoundError:
+            pass
+
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if not os.path.exists(self.cache_folder_path):
+            os.makedirs(self.cache_folder_path, exist_ok=True)
+
+        if self.total_size is None:
+            self.total_size = sum(size for (_, size, _) in self._entries())
+
+        # Write to a temporary file and rename so that concurrent workers never read a partial entry
+        entry_path = self._entry_path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_folder_path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            size = os.path.getsize(tmp_path)
+            try:
+                replaced_size = os.path.getsize(entry_path)
+            except FileNotFoundError:
+                replaced_size = 0
+            os.replace(tmp_path, entry_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self.total_size += size - replaced_size
+        if self.max_size is not None and self.max_size > 0 and self.total_size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        if self.max_size is None or self.max_size <= 0:
+            return
+
+        entries = self._entries()
+        total_size = sum(size for (_, size, _) in entries)
+        self.total_size = total_size
+        if total_size <= self.max_size:
+            return
+
+        # Least recently used first
+        target_size = self.max_size * EVICTION_TARGET
+        for (_, size, entry_path) in sorted(entries):
+            if total_size <= target_size:
+                break
+            try:
+                os.remove(entry_path)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+            total_size -= size
+        self.total_size = total_size
+
+    def invalidate(self, file_path=None, key=None):
+        if key is not None:
+            prefixes = [key]
+        elif file_path is not None:
+            prefixes = [get_file_hash(file_path) + '-']
+        else:
+            raise RuntimeError("either file_path or key has to be provided")
+
+        count = 0
+        for (_, _, entry_path) in self._entries():
+            if any(os.path.basename(entry_path).startswith(prefix) for prefix in prefixes):
+                try:
+                    os.remove(entry_path)
+                    count += 1
+                except FileNotFoundError:
+                    pass
+        # Listed again by the next put
+        self.total_size = None
+        return count
+
+    def clear(self):
+        count = 0
+        for (_, _, entry_path) in self._entries():
+            try:
+                os.remove(entry_path)
+                count += 1
+            except FileNotFoundError:
+                pass
+        self.total_size = None
+        return count
+
+    def stats(self):
+        entries = self._entries()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(entries),
+            'size': sum(size for (_, size, _) in entries),
+            'max_size': self.max_size,
+        }
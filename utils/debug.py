@@ -1,5 +1,5 @@
+import sys
 import pandas as pd
-import inspect
 import json
 
 
@@ -8,6 +8,61 @@ INDENT_STR_DEFAULT = "    "
 FLAG_ACTIVE_DEFAULT = True
 FLAG_FORCE_LOCATION = False
 
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+# Global switch and threshold, checked before anything else is done in debug_log and df_print
+LOG_ENABLED = True
+LOG_LEVEL = DEBUG
+
+DF_PRINT_OPTIONS = (
+    'display.max_rows', None,
+    'display.max_columns', None,
+    'display.width', None,
+    'display.max_colwidth', None,
+    'display.float_format', lambda x: '%.2f' % x,
+)
+
+
+def set_log_level(level):
+    global LOG_LEVEL
+    LOG_LEVEL = level
+
+
+def enable_logging(enabled=True):
+    global LOG_ENABLED
+    LOG_ENABLED = enabled
+
+
+def is_log_enabled(level=DEBUG):
+    return LOG_ENABLED and level >= LOG_LEVEL
+
+
+class Lazy:
+    # Defers building an expensive message until it is actually printed
+    __slots__ = ('func',)
+
+    def __init__(self, func):
+        self.func = func
+
+    def __str__(self):
+        return str(self.func())
+
+    __repr__ = __str__
+
+
+def lazy(func):
+    return Lazy(func)
+
+
+def get_caller_location(offset=0):
+    # A single frame lookup, unlike inspect.stack() which builds (and reads the source of) the whole stack
+    frame = sys._getframe(offset + 1)
+    code = frame.f_code
+    return '[{}:{} {}()]'.format(code.co_filename, frame.f_lineno, code.co_name)
+
 
 # updated
 def print_file_function(active=FLAG_ACTIVE_DEFAULT, offset=0, levels=1, end="\n"):
@@ -15,80 +70,66 @@ def print_file_function(active=FLAG_ACTIVE_DEFAULT, offset=0, levels=1, end="\n"
         return
 
     for level in range(levels):
-        caller_frame_record = inspect.stack()[level+offset+1]
-        frame = caller_frame_record[0]
-        info = inspect.getframeinfo(frame)
-        file = info.filename
-        print('[{}:{} {}()]'.format(file, info.lineno, info.function), end=end)
+        try:
+            location = get_caller_location(offset=level + offset + 1)
+        except ValueError:
+            break
+        print(location, end=end)
 
 
-def df_print(df, dtypes=False, index=False, shape=False, new_line=True, gui=False, active=True, location=True):
-    if not active:
+def df_print(df, dtypes=False, index=False, shape=False, new_line=True, gui=False, active=True, location=True, level=DEBUG):
+    if not active or not LOG_ENABLED or level < LOG_LEVEL:
         return
 
     # https://stackoverflow.com/questions/6810999/how-to-determine-file-function-and-line-number
     if location or FLAG_FORCE_LOCATION:
         print_file_function(offset=1, levels=1, end="")
 
-    pd.set_option('display.max_rows', None)
-    pd.set_option('display.max_columns', None)
-    pd.set_option('display.width', None)
-    pd.set_option('display.max_colwidth', None)
-    pd.set_option('display.float_format', lambda x: '%.2f' % x)
-
-    if gui:
-        # gui = show(df, settings={'block': True})
-        print("pandas_gui not used")
-    else:
-        if new_line:
-            print()
+    # The display options only apply while printing, the global pandas options are left alone
+    with pd.option_context(*DF_PRINT_OPTIONS):
+        if gui:
+            # gui = show(df, settings={'block': True})
+            print("pandas_gui not used")
+        else:
+            if new_line:
+                print()
 
-        print(df)
+            print(df)
 
-        if index:
-            print(df.index)
+            if index:
+                print(df.index)
 
-        if shape:
-            print(df.shape)
+            if shape:
+                print(df.shape)
 
-        if dtypes:
-            print(df.dtypes)
+            if dtypes:
+                print(df.dtypes)
 
 
 def debug_log(*args, **kwargs):
-    if "active" in kwargs:
-        active = kwargs.pop("active")
-        if not active:
-            return
+    if not LOG_ENABLED:
+        return
 
-    if "location" in kwargs:
-        location = kwargs.pop("location")
-    else:
-        location = True
+    if not kwargs.pop("active", True):
+        return
+
+    if kwargs.pop("level", DEBUG) < LOG_LEVEL:
+        return
 
-    if "indent_str" in kwargs:
-        indent_str = kwargs.pop("indent_str")
-    else:
-        indent_str = INDENT_STR_DEFAULT
+    location = kwargs.pop("location", True)
+    indent_str = kwargs.pop("indent_str", INDENT_STR_DEFAULT)
 
     prefix = ""
     if "indent" in kwargs:
         indent = kwargs.pop("indent")
         prefix = indent_str * indent
 
-    line_start =""
-    if "new_line" in kwargs:
-        flag_new_line = kwargs.pop("new_line")
-        if flag_new_line:
-            line_start = "\n"
+    line_start = ""
+    if kwargs.pop("new_line", False):
+        line_start = "\n"
 
-    offset=0
-    if "offset" in kwargs:
-        offset = kwargs.pop("offset")
-
-    end=" "
-    if "end" in kwargs:
-        end = kwargs.pop("end")
+    offset = kwargs.pop("offset", 0)
+    kwargs.pop("end", None)
 
     if location or FLAG_FORCE_LOCATION:
         print_file_function(offset=1+offset, end=" ")
@@ -98,8 +139,11 @@ def debug_log(*args, **kwargs):
 
 
 def debug_metadata(metadata, *args, **kwargs):
+    if not LOG_ENABLED or not kwargs.get("active", True):
+        return
+
     debug_log("Metadata:", offset=1, **kwargs)
     if 'location' in kwargs:
         kwargs.pop('location')
 
-    debug_log(json.dumps(dict(metadata), default=str, indent=4), *args, location=False, **kwargs)
+    debug_log(lazy(lambda: json.dumps(dict(metadata), default=str, indent=4)), *args, location=False, **kwargs)
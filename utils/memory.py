@@ -0,0 +1,87 @@
+import gc
+import os
+
+
+MEMORY_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_memory_size(size):
+    # 512 * 1024 * 1024, '512M' and '2G' are all accepted
+    if size is None or isinstance(size, int):
+        return size
+
+    size = size.strip().upper().rstrip('B')
+    if size and size[-1] in MEMORY_UNITS:
+        return int(float(size[:-1]) * MEMORY_UNITS[size[-1]])
+    return int(size)
+
+
+def format_memory_size(size):
+    return f"{size / 1024 ** 2:.0f}MB"
+
+
+def get_rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return get_peak_rss()
+
+
+def get_peak_rss():
+    try:
+        import resource
+    except ImportError:
+        return 0
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MemoryGuard:
+    # Checked between pages. Over the limit the garbage collector is run first, and if the process
+    # is still over it the note is abandoned with an error instead of the process being killed.
+    def __init__(self, limit=None):
+        self.limit = parse_memory_size(limit)
+        self.collections = 0
+
+    def check(self, context=None):
+        if self.limit is None or get_rss() <= self.limit:
+            return
+
+        gc.collect()
+        self.collections += 1
+        rss = get_rss()
+        if rss > self.limit:
+            raise RuntimeError(f"memory limit of {format_memory_size(self.limit)} exceeded ({format_memory_size(rss)})"
+                               + (f" {context}" if context else ""))
+
+
+NULL_MEMORY_GUARD = MemoryGuard()
+
+# Set in a worker by set_memory_budget
+memory_budget = None
+
+
+def get_memory_budget():
+    return memory_budget
+
+
+def set_memory_budget(budget):
+    # Used as a pool initializer. The data segment of the worker is capped, so an allocation beyond
+    # the budget raises MemoryError in that worker (failing its note) instead of exhausting the container.
+    global memory_budget
+    budget = parse_memory_size(budget)
+    if budget is None:
+        return
+
+    try:
+        import resource
+    except ImportError:
+        print("Memory budget is not supported on this platform")
+        return
+
+    (soft, hard) = resource.getrlimit(resource.RLIMIT_DATA)
+    if hard != resource.RLIM_INFINITY:
+        budget = min(budget, hard)
+    resource.setrlimit(resource.RLIMIT_DATA, (budget, hard))
+    memory_budget = budget
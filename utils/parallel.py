@@ -0,0 +1,44 @@
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+
+def iter_ordered(func, args_iter, *, workers=1, executor=None, window=0, initializer=None, initargs=()):
+    # Results are yielded in submission order. Only 'window' jobs are in flight
+    # so a consumer that stops early (e.g. max_count) does not waste a whole folder.
+    # initializer only applies to the pool created here, not to a given executor.
+    if executor is None and workers <= 1:
+        for args in args_iter:
+            yield func(*args)
+        return
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs)
+    else:
+        workers = getattr(executor, '_max_workers', workers)
+
+    if window <= 0:
+        window = 2 * max(workers, 1)
+
+    pending = deque()
+    try:
+        for args in args_iter:
+            pending.append(executor.submit(func, *args))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+        if own_executor:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+def timed_call(func, *args, **kwargs):
+    # Measures the time spent in the worker itself, without the time waiting in the pool queue
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return (result, time.perf_counter() - start)
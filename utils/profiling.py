@@ -0,0 +1,154 @@
+import cProfile
+import json
+import math
+import os
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+
+
+class _Stage:
+    __slots__ = ('timings', 'stage', 'start')
+
+    def __init__(self, timings, stage):
+        self.timings = timings
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.timings[self.stage] = self.timings.get(self.stage, 0.0) + time.perf_counter() - self.start
+        return False
+
+
+class StageTimer:
+    # Seconds spent per stage of one unit of work, e.g. one contract note
+    enabled = True
+
+    def __init__(self):
+        self.timings = {}
+
+    def __call__(self, stage):
+        return _Stage(self.timings, stage)
+
+
+class NullStageTimer:
+    # Used when profiling is off: every stage is the same reusable no-op context
+    enabled = False
+    timings = None
+    _null_context = nullcontext()
+
+    def __call__(self, stage):
+        return self._null_context
+
+
+NULL_TIMER = NullStageTimer()
+
+
+def get_stage_timer(enabled):
+    return StageTimer() if enabled else NULL_TIMER
+
+
+def get_profiler(profile=False, trace_file_path=None, cprofile_file_path=None):
+    # None when profiling is off, a trace or cProfile file turns it on as well
+    if not (profile or trace_file_path or cprofile_file_path):
+        return None
+    return Profiler(trace_file_path=trace_file_path, cprofile_file_path=cprofile_file_path)
+
+
+def percentile(sorted_values, fraction):
+    # Nearest rank percentile
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class Profiler:
+    def __init__(self, trace_file_path=None, cprofile_file_path=None):
+        self.trace_file_path = trace_file_path
+        self.cprofile_file_path = cprofile_file_path
+        self.stage_timings = defaultdict(list)
+        self.counters = defaultdict(int)
+        self.run_timer = StageTimer()
+        self._trace_file = None
+        self._cprofile = None
+
+        if self.trace_file_path is not None:
+            trace_folder = os.path.dirname(self.trace_file_path)
+            if trace_folder and not os.path.exists(trace_folder):
+                os.makedirs(trace_folder)
+            self._trace_file = open(self.trace_file_path, 'a')
+
+    def stage(self, stage):
+        return self.run_timer(stage)
+
+    def count(self, counter, value=1):
+        self.counters[counter] += value
+
+    def record(self, name, timings, **fields):
+        # One line per unit of work in the trace file, e.g. one line per contract note
+        timings = timings or {}
+        for (stage, seconds) in timings.items():
+            self.stage_timings[stage].append(seconds)
+
+        if self._trace_file is not None:
+            record = {'name': name, 'timings': timings}
+            record.update(fields)
+            self._trace_file.write(json.dumps(record, default=str) + "\n")
+            self._trace_file.flush()
+
+    def start(self):
+        if self.cprofile_file_path is not None and self._cprofile is None:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def stop(self):
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            cprofile_folder = os.path.dirname(self.cprofile_file_path)
+            if cprofile_folder and not os.path.exists(cprofile_folder):
+                os.makedirs(cprofile_folder)
+            self._cprofile.dump_stats(self.cprofile_file_path)
+            print(f"cProfile stats written to '{self.cprofile_file_path}'")
+            self._cprofile = None
+
+    def close(self):
+        self.stop()
+        if self._trace_file is not None:
+            self._trace_file.close()
+            self._trace_file = None
+
+    def summary(self):
+        stages = {}
+        for (stage, values) in self.stage_timings.items():
+            sorted_values = sorted(values)
+            stages[stage] = {
+                'count': len(values),
+                'total': sum(values),
+                'p50': percentile(sorted_values, 0.50),
+                'p95': percentile(sorted_values, 0.95),
+                'max': sorted_values[-1],
+            }
+
+        return {
+            'run': dict(self.run_timer.timings),
+            'stages': stages,
+            'counters': dict(self.counters),
+        }
+
+    def print_summary(self):
+        summary = self.summary()
+        print("Run stages:")
+        for (stage, seconds) in summary['run'].items():
+            print(f"    {stage:<24} {seconds:10.3f}s")
+
+        if summary['stages']:
+            print(f"Per file stages:{'count':>15} {'total':>10} {'p50':>10} {'p95':>10} {'max':>10}")
+            for (stage, stats) in summary['stages'].items():
+                print(f"    {stage:<24} {stats['count']:6d} {stats['total']:10.3f} {stats['p50']:10.4f} {stats['p95']:10.4f} {stats['max']:10.4f}")
+
+        for (counter, value) in summary['counters'].items():
+            print(f"    {counter:<24} {value}")
@@ -0,0 +1,277 @@
+# Watches a broker's contract notes folder and processes the notes as they arrive.
+#
+#   python watch.py Zerodha --interval 30
+#
+# Every processed note is recorded in a manifest (path, size, mtime, hash), so a cycle only
+# extracts the new or changed notes, appends them to the charges aggregate and reconciles
+# the dates they cover against the ledger.
+
+import argparse
+import json
+import os
+import time
+
+from broker import get_processed_index, is_processed, iter_contractnote_files
+from summary_layout import materialize_charges
+from utils.cache import get_file_hash
+
+
+MANIFEST_VERSION = 1
+DEFAULT_WATCH_INTERVAL = 30
+DEFAULT_SETTLE_SECONDS = 2
+# An unchanged note that failed is extracted again after this many seconds, doubled after every
+# further failure up to the maximum. A note whose content changed is extracted on the next cycle.
+RETRY_BACKOFF_SECONDS = 60
+MAX_RETRY_BACKOFF_SECONDS = 6 * 3600
+
+
+def get_file_state(file_path):
+    stat = os.stat(file_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+class NoteManifest:
+    # A note is looked at again only when its size or mtime changes, and is extracted again
+    # only when its content hash changed as well
+    def __init__(self, manifest_file_path):
+        self.manifest_file_path = manifest_file_path
+        self.entries = {}
+        self.dirty = False
+
+        if os.path.exists(manifest_file_path):
+            with open(manifest_file_path) as f:
+                manifest = json.load(f)
+            if manifest.get('version') == MANIFEST_VERSION:
+                self.entries = manifest['entries']
+
+    def save(self):
+        if not self.dirty:
+            return
+
+        output_folder = os.path.dirname(self.manifest_file_path)
+        if output_folder and not os.path.exists(output_folder):
+            os.makedirs(output_folder)
+
+        with open(self.manifest_file_path + '.tmp', 'w') as f:
+            json.dump({'version': MANIFEST_VERSION, 'entries': self.entries}, f, indent=4)
+        os.replace(self.manifest_file_path + '.tmp', self.manifest_file_path)
+        self.dirty = False
+
+    def get(self, pdf_file_path):
+        return self.entries.get(os.path.normpath(pdf_file_path))
+
+    def update(self, pdf_file_path, date, file_state, file_hash, status, error=None, attempts=0, retry_at=None):
+        self.entries[os.path.normpath(pdf_file_path)] = dict(file_state, date=date, hash=file_hash, status=status, error=error,
+                                                             attempts=attempts, retry_at=retry_at)
+        self.dirty = True
+
+    def scan(self, jobs, *, processed_index_func=None, settle_seconds=DEFAULT_SETTLE_SECONDS):
+        # Returns the notes to extract as dicts with the previous manifest entry, if any.
+        # Notes already in the aggregate but unknown to the manifest (first run, or a run
+        # interrupted before the manifest was saved) are recorded without being extracted.
+        pending = []
+        processed_index = None
+        now = time.time()
+        for (pdf_file_path, date) in jobs:
+            try:
+                file_state = get_file_state(pdf_file_path)
+            except FileNotFoundError:
+                continue
+
+            # A note still being written is picked up by a later cycle
+            if now - file_state['mtime_ns'] / 1e9 < settle_seconds:
+                continue
+
+            # A note that failed is extracted again once its retry time has come, or when it changed
+            entry = self.get(pdf_file_path)
+            waiting = entry is not None and not (entry['status'] == 'failed' and now >= (entry.get('retry_at') or 0))
+            if waiting and entry['size'] == file_state['size'] and entry['mtime_ns'] == file_state['mtime_ns']:
+                continue
+
+            file_hash = get_file_hash(pdf_file_path)
+            if waiting and entry['hash'] == file_hash:
+                entry.update(file_state)
+                self.dirty = True
+                continue
+
+            if entry is None and processed_index_func is not None:
+                if processed_index is None:
+                    processed_index = processed_index_func()
+                if is_processed(processed_index, date, pdf_file_path):
+                    self.update(pdf_file_path, date, file_state, file_hash, 'processed')
+                    continue
+
+            pending.append({'path': pdf_file_path, 'date': date, 'state': file_state, 'hash': file_hash, 'previous': entry})
+
+        return pending
+
+
+class ContractNoteWatcher:
+    def __init__(self, broker, *, start_date=None, end_date=None, workers=1, executor=None,
+                 manifest_file_path=None, settle_seconds=DEFAULT_SETTLE_SECONDS):
+        self.broker = broker
+        self.start_date = start_date
+        self.end_date = end_date
+        self.workers = workers
+        self.executor = executor
+        self.settle_seconds = settle_seconds
+        if manifest_file_path is None:
+            manifest_file_path = os.path.join(os.path.dirname(broker.charges_file_path), 'watch_manifest.json')
+        self.manifest = NoteManifest(manifest_file_path)
+        self.ledger_state = None
+        self.cycles = 0
+
+    def get_processed_index(self):
+        index_df = self.broker.charges_store.read(columns=[self.broker.charges_date_column, 'Document'])
+        return get_processed_index(index_df, date_column=self.broker.charges_date_column)
+
+    def refresh_ledger(self):
+        # Returns True when the ledger was (re)loaded
+        ledger_state = get_file_state(self.broker.fledger_path)
+        if ledger_state == self.ledger_state:
+            return False
+
+        self.broker.read_ledger(start_date=self.start_date, end_date=self.end_date)
+        self.ledger_state = ledger_state
+        return True
+
+    def extract(self, pending):
+        dates = set()
+
+        notes = {os.path.normpath(note['path']): note for note in pending}
+        replaced = []
+        charges_list = []
+        failures = []
+        # The manifest is only updated once the aggregate holds the rows, a cycle stopped during the
+        # extraction (e.g. by Ctrl-C) leaves the notes to the next one
+        updates = []
+        for result in self.broker.iter_contract_notes(workers=self.workers,
+                                                      executor=self.executor,
+                                                      jobs=[(note['path'], note['date']) for note in pending]):
+            note = notes[os.path.normpath(result.pdf_file_path)]
+            if result.error is not None:
+                print(f"Error! {result.error} processing file '{result.pdf_file_path}'")
+                failures.append(result)
+                previous = note['previous']
+                attempts = 1
+                if previous is not None and previous['status'] == 'failed' and previous['hash'] == note['hash']:
+                    attempts = previous.get('attempts', 0) + 1
+                backoff = min(RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1), MAX_RETRY_BACKOFF_SECONDS)
+                updates.append((note, 'failed', dict(error=result.error, attempts=attempts, retry_at=time.time() + backoff)))
+                continue
+
+            if result.has_charges():
+                charges_list.append(result.charges)
+                dates.add(result.date)
+            # A known note may still have rows in the aggregate, even when it failed in a previous cycle
+            if note['previous'] is not None:
+                replaced.append(note['path'])
+            updates.append((note, 'processed', {}))
+
+        # The rows of a changed note are replaced rather than added a second time, only once it was
+        # extracted again, so a note that fails keeps its previous rows
+        rollup = self.broker.charges_rollup
+        previous_signature = self.broker.charges_store.get_signature() if rollup is not None else None
+        removed_df = None
+        if replaced:
+            removed_df = self.broker.charges_store.remove_documents(replaced)
+            if len(removed_df):
+                dates.update(removed_df[self.broker.charges_date_column])
+
+        added_df = None
+        if charges_list:
+            added_df = materialize_charges(charges_list)
+            self.broker.charges_store.append(added_df)
+        if rollup is not None and (added_df is not None or replaced):
+            rollup.update(self.broker.charges_store, previous_signature, added_df=added_df, removed_df=removed_df)
+
+        # Saved only once the aggregate holds the new rows
+        for (note, status, fields) in updates:
+            self.manifest.update(note['path'], note['date'], note['state'], note['hash'], status, **fields)
+        self.manifest.save()
+        self.broker.cnote_failures = failures
+        return dates
+
+    def run_once(self):
+        self.cycles += 1
+        summary = {'cycle': self.cycles, 'notes': 0, 'failures': 0, 'dates': [], 'ledger_reloaded': False}
+
+        jobs = iter_contractnote_files(self.broker.cnote_folder_path,
+                                       start_date=self.start_date,
+                                       end_date=self.end_date,
+                                       verbose=self.cycles == 1,
+                                       note_index=self.broker.note_index)
+        pending = self.manifest.scan(jobs,
+                                     processed_index_func=self.get_processed_index,
+                                     settle_seconds=self.settle_seconds)
+        self.manifest.save()
+
+        dates = set()
+        if pending:
+            print(f"{len(pending)} new or changed contract notes in '{self.broker.cnote_folder_path}'")
+            dates = self.extract(pending)
+            summary['notes'] = len(pending)
+            summary['failures'] = len(self.broker.cnote_failures)
+
+        summary['ledger_reloaded'] = self.refresh_ledger()
+        if not dates and not summary['ledger_reloaded']:
+            return summary
+
+        # A changed ledger can affect any date, so everything is reconciled again
+        self.broker.summary_aggregate_df = self.broker.charges_store.read()
+        if summary['ledger_reloaded']:
+            self.broker.reconcile(start_date=self.start_date, end_date=self.end_date)
+        else:
+            summary['dates'] = sorted(dates)
+            print(f"Reconciling {len(dates)} dates: {', '.join(summary['dates'])}")
+            self.broker.reconcile(dates=dates)
+        self.broker.report()
+
+        return summary
+
+    def run(self, interval=DEFAULT_WATCH_INTERVAL, max_cycles=0):
+        print(f"Watching '{self.broker.cnote_folder_path}' every {interval} seconds")
+        try:
+            while True:
+                self.run_once()
+                if max_cycles > 0 and self.cycles >= max_cycles:
+                    break
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            # The manifest holds nothing that is not in the aggregate yet, a stopped cycle is redone by the next run
+            print("Stopped watching")
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Process contract notes as they arrive")
+    parser.add_argument('broker', help="broker name, as defined in brokers.py")
+    parser.add_argument('--input-path-prefix', default='data')
+    parser.add_argument('--compute-path-prefix', default='compute')
+    parser.add_argument('--start-date', default=None)
+    parser.add_argument('--end-date', default=None)
+    parser.add_argument('--output-format', choices=['parquet', 'feather', 'xlsx'], default=None)
+    parser.add_argument('--interval', type=float, default=DEFAULT_WATCH_INTERVAL, help="seconds between two scans")
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--cache', action='store_true', help="cache the summary table of every note by content")
+    parser.add_argument('--ledger-cache', action='store_true', help="keep a snapshot of the ledger workbook")
+    parser.add_argument('--once', action='store_true', help="run a single cycle and exit")
+    args = parser.parse_args(args)
+
+    from brokers import create_broker
+
+    broker_kwargs = {}
+    if args.output_format is not None:
+        broker_kwargs['output_format'] = args.output_format
+    if args.cache:
+        broker_kwargs['cnote_cache'] = True
+    if args.ledger_cache:
+        broker_kwargs['fledger_cache'] = True
+    broker = create_broker(args.broker, input_path_prefix=args.input_path_prefix, compute_path_prefix=args.compute_path_prefix,
+                           **broker_kwargs)
+    watcher = ContractNoteWatcher(broker, start_date=args.start_date, end_date=args.end_date, workers=args.workers)
+    watcher.run(interval=args.interval, max_cycles=1 if args.once else 0)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,430 @@
+# Distributes contract note extraction over any number of worker processes or machines.
+#
+#   python main.py notes Zerodha --queue compute/queue.db          # coordinator
+#   python work_queue.py worker compute/queue.db                   # on every worker
+#   python work_queue.py status compute/queue.db
+#
+# The coordinator enqueues the notes to read and collects the results. A worker leases one note
+# at a time, extracts it with the broker the note was queued for and posts the result back.
+# A lease that is not completed in time (a worker that died or hangs) is handed to another worker,
+# and a note whose lease expired max_attempts times fails instead of being retried forever.
+#
+# A queue is a SQLite database (a path ending in .db or .sqlite), which needs a local filesystem,
+# or a folder, which only needs atomic renames and works on a filesystem shared by several machines.
+# Either way the notes and the compute folders must be at the same paths on every worker.
+
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import time
+import uuid
+
+from broker import ExtractionResult, extract_contractnote
+from journal import decode_charges, encode_charges
+from utils.memory import set_memory_budget
+
+
+DEFAULT_LEASE_SECONDS = 600
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_POLL_INTERVAL = 0.5
+# Seconds without any finished note after which the coordinator warns that no worker may be running
+DEFAULT_PROGRESS_WARNING_SECONDS = 60
+
+JOB_PENDING = 'pending'
+JOB_LEASED = 'leased'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+
+class QueueJob:
+    __slots__ = ('id', 'run_id', 'seq', 'spec', 'document', 'date', 'attempts')
+
+    def __init__(self, id, run_id, seq, spec, document, date, attempts):
+        self.id = id
+        self.run_id = run_id
+        self.seq = seq
+        self.spec = spec
+        self.document = document
+        self.date = date
+        self.attempts = attempts
+
+
+def get_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def encode_result(result):
+    encoded = {'document': result.pdf_file_path, 'date': result.date, 'error': result.error,
+               'timings': result.timings, 'layout_position': result.layout_position, 'layout_drift': result.layout_drift}
+    if result.error is None and result.has_charges():
+        encoded['charges'] = encode_charges(result.charges)
+    return json.dumps(encoded)
+
+
+def decode_result(encoded, schemas):
+    encoded = json.loads(encoded)
+    charges = None
+    if encoded.get('charges') is not None:
+        charges = decode_charges(encoded['charges'], encoded['date'], encoded['document'], schemas)
+
+    result = ExtractionResult(encoded['document'], encoded['date'], charges=charges, error=encoded['error'])
+    result.timings = encoded.get('timings')
+    if encoded.get('layout_position') is not None:
+        result.layout_position = tuple(encoded['layout_position'])
+    result.layout_drift = encoded.get('layout_drift')
+    return result
+
+
+def get_failed_result(job, error):
+    return encode_result(ExtractionResult(job.document, job.date, error=error))
+
+
+class SqliteWorkQueue:
+    def __init__(self, db_path, *, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS, wait_timeout=0):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.wait_timeout = wait_timeout
+
+        output_folder = os.path.dirname(db_path)
+        if output_folder and not os.path.exists(output_folder):
+            os.makedirs(output_folder)
+
+        # Transactions are explicit, a lease is a select and an update under one write lock
+        self.connection = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                                       id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                       run_id TEXT NOT NULL,
+                                       seq INTEGER NOT NULL,
+                                       spec TEXT NOT NULL,
+                                       document TEXT NOT NULL,
+                                       date TEXT,
+                                       status TEXT NOT NULL,
+                                       attempts INTEGER NOT NULL DEFAULT 0,
+                                       worker TEXT,
+                                       lease_expires REAL,
+                                       result TEXT)""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS jobs_run ON jobs (run_id, status)")
+
+    def enqueue(self, run_id, spec, jobs):
+        spec = json.dumps(spec)
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.executemany("INSERT INTO jobs (run_id, seq, spec, document, date, status) VALUES (?, ?, ?, ?, ?, ?)",
+                                        [(run_id, seq, spec, document, date, JOB_PENDING) for (seq, (document, date)) in enumerate(jobs)])
+
+    def expire_leases(self, now):
+        # Expired leases go back to pending, or fail once they used up their attempts
+        for (id, run_id, seq, document, date, attempts) in self.connection.execute(
+                "SELECT id, run_id, seq, document, date, attempts FROM jobs WHERE status = ? AND lease_expires < ?",
+                (JOB_LEASED, now)).fetchall():
+            if attempts >= self.max_attempts:
+                job = QueueJob(id, run_id, seq, None, document, date, attempts)
+                error = f"RuntimeError: lease expired {attempts} times"
+                self.connection.execute("UPDATE jobs SET status = ?, result = ? WHERE id = ?", (JOB_FAILED, get_failed_result(job, error), id))
+            else:
+                self.connection.execute("UPDATE jobs SET status = ?, worker = NULL WHERE id = ?", (JOB_PENDING, id))
+
+    def lease(self, worker_id):
+        now = time.time()
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.expire_leases(now)
+            row = self.connection.execute("SELECT id, run_id, seq, spec, document, date, attempts FROM jobs WHERE status = ? ORDER BY id LIMIT 1",
+                                          (JOB_PENDING,)).fetchone()
+            if row is None:
+                return None
+
+            self.connection.execute("UPDATE jobs SET status = ?, worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+                                    (JOB_LEASED, worker_id, now + self.lease_seconds, row[0]))
+        (id, run_id, seq, spec, document, date, attempts) = row
+        return QueueJob(id, run_id, seq, json.loads(spec), document, date, attempts + 1)
+
+    def complete(self, job, worker_id, result):
+        # Ignored when the lease went to another worker in the meantime
+        with self.connection:
+            cursor = self.connection.execute("UPDATE jobs SET status = ?, result = ? WHERE id = ? AND worker = ? AND status = ?",
+                                             (JOB_DONE, result, job.id, worker_id, JOB_LEASED))
+        return cursor.rowcount > 0
+
+    def release(self, job, worker_id):
+        with self.connection:
+            self.connection.execute("UPDATE jobs SET status = ?, worker = NULL, attempts = attempts - 1 WHERE id = ? AND worker = ? AND status = ?",
+                                    (JOB_PENDING, job.id, worker_id, JOB_LEASED))
+
+    def collect(self, run_id):
+        # The (seq, result) of the finished jobs of a run, removed from the queue
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.expire_leases(time.time())
+            rows = self.connection.execute("SELECT id, seq, result FROM jobs WHERE run_id = ? AND status IN (?, ?)",
+                                           (run_id, JOB_DONE, JOB_FAILED)).fetchall()
+            self.connection.executemany("DELETE FROM jobs WHERE id = ?", [(id,) for (id, seq, result) in rows])
+        return [(seq, result) for (id, seq, result) in rows]
+
+    def cancel(self, run_id):
+        with self.connection:
+            self.connection.execute("DELETE FROM jobs WHERE run_id = ?", (run_id,))
+
+    def get_counts(self):
+        return dict(self.connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def close(self):
+        self.connection.close()
+
+
+class FolderWorkQueue:
+    # A job is a file, and its status is the folder it is in:
+    #
+    #   pending/<run_id>-<seq>-<attempts>.json
+    #   leased/<run_id>-<seq>-<attempts>-<expires>-<worker_id>.json
+    #   done/<run_id>-<seq>.json                                      the result
+    #
+    # A lease is a rename out of pending, which only one worker can win. The lease deadline
+    # (<expires>, in epoch milliseconds) is set by the worker taking the lease, so every process
+    # expires it at the same time whatever its own lease_seconds.
+    def __init__(self, folder_path, *, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS, wait_timeout=0):
+        self.folder_path = folder_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.wait_timeout = wait_timeout
+        for status in [JOB_PENDING, JOB_LEASED, JOB_DONE]:
+            os.makedirs(os.path.join(folder_path, status), exist_ok=True)
+
+    def get_path(self, status, name):
+        return os.path.join(self.folder_path, status, name)
+
+    def write_file(self, file_path, content):
+        with open(file_path + '.tmp', 'w') as f:
+            f.write(content)
+        os.replace(file_path + '.tmp', file_path)
+
+    def enqueue(self, run_id, spec, jobs):
+        for (seq, (document, date)) in enumerate(jobs):
+            self.write_file(self.get_path(JOB_PENDING, f"{run_id}-{seq}-0.json"),
+                            json.dumps({'spec': spec, 'document': document, 'date': date}))
+
+    def list_jobs(self, status):
+        return sorted(name for name in os.listdir(os.path.join(self.folder_path, status)) if name.endswith('.json'))
+
+    def expire_leases(self, now):
+        for name in self.list_jobs(JOB_LEASED):
+            file_path = self.get_path(JOB_LEASED, name)
+            (run_id, seq, attempts, expires) = name[:-len('.json')].split('-')[:4]
+            # A lease taken before the deadline was part of the name has none and is expired
+            if expires.isdigit() and int(expires) / 1000 >= now:
+                continue
+            try:
+                if int(attempts) >= self.max_attempts:
+                    with open(file_path) as f:
+                        job = json.load(f)
+                    job = QueueJob(name, run_id, int(seq), None, job['document'], job['date'], int(attempts))
+                    self.write_file(self.get_path(JOB_DONE, f"{run_id}-{seq}.json"),
+                                    get_failed_result(job, f"RuntimeError: lease expired {attempts} times"))
+                    os.remove(file_path)
+                else:
+                    os.rename(file_path, self.get_path(JOB_PENDING, f"{run_id}-{seq}-{attempts}.json"))
+            except FileNotFoundError:
+                # Completed or expired by another process
+                continue
+
+    def lease(self, worker_id):
+        now = time.time()
+        self.expire_leases(now)
+        for name in self.list_jobs(JOB_PENDING):
+            (run_id, seq, attempts) = name[:-len('.json')].split('-')
+            expires = int((now + self.lease_seconds) * 1000)
+            leased_name = f"{run_id}-{seq}-{int(attempts) + 1}-{expires}-{worker_id}.json"
+            leased_file_path = self.get_path(JOB_LEASED, leased_name)
+            try:
+                os.rename(self.get_path(JOB_PENDING, name), leased_file_path)
+            except FileNotFoundError:
+                continue
+            with open(leased_file_path) as f:
+                job = json.load(f)
+            return QueueJob(leased_name, run_id, int(seq), job['spec'], job['document'], job['date'], int(attempts) + 1)
+
+        return None
+
+    def complete(self, job, worker_id, result):
+        # Ignored when the lease went to another worker or the run was cancelled in the meantime.
+        # The result is written before the lease is removed, so a crash in between loses nothing.
+        leased_file_path = self.get_path(JOB_LEASED, job.id)
+        if not os.path.exists(leased_file_path):
+            return False
+
+        self.write_file(self.get_path(JOB_DONE, f"{job.run_id}-{job.seq}.json"), result)
+        try:
+            os.remove(leased_file_path)
+        except FileNotFoundError:
+            pass
+        return True
+
+    def release(self, job, worker_id):
+        try:
+            os.rename(self.get_path(JOB_LEASED, job.id), self.get_path(JOB_PENDING, f"{job.run_id}-{job.seq}-{job.attempts - 1}.json"))
+        except FileNotFoundError:
+            pass
+
+    def collect(self, run_id):
+        self.expire_leases(time.time())
+        results = []
+        for name in self.list_jobs(JOB_DONE):
+            if not name.startswith(f"{run_id}-"):
+                continue
+            file_path = self.get_path(JOB_DONE, name)
+            with open(file_path) as f:
+                results.append((int(name[:-len('.json')].split('-')[1]), f.read()))
+            os.remove(file_path)
+        return results
+
+    def cancel(self, run_id):
+        for status in [JOB_PENDING, JOB_LEASED, JOB_DONE]:
+            for name in self.list_jobs(status):
+                if name.startswith(f"{run_id}-"):
+                    try:
+                        os.remove(self.get_path(status, name))
+                    except FileNotFoundError:
+                        pass
+
+    def get_counts(self):
+        return {status: len(self.list_jobs(status)) for status in [JOB_PENDING, JOB_LEASED, JOB_DONE]}
+
+    def close(self):
+        pass
+
+
+def get_work_queue(queue_path, **kwargs):
+    if queue_path.endswith('.db') or queue_path.endswith('.sqlite'):
+        return SqliteWorkQueue(queue_path, **kwargs)
+
+    return FolderWorkQueue(queue_path, **kwargs)
+
+
+def iter_queue_results(queue, jobs, spec, *, poll_interval=DEFAULT_POLL_INTERVAL, warning_seconds=DEFAULT_PROGRESS_WARNING_SECONDS):
+    # Yields an ExtractionResult per job in the order of the jobs, as the workers finish them.
+    # The jobs of the run that are still queued are removed when the caller stops early.
+    # Nothing finishing for warning_seconds is reported, and for the wait_timeout of the queue
+    # (0 waits forever) raises a RuntimeError.
+    jobs = list(jobs)
+    run_id = uuid.uuid4().hex[:12]
+    queue.enqueue(run_id, spec, jobs)
+    print(f"Queued {len(jobs)} contract notes as run {run_id}")
+
+    schemas = {}
+    results = {}
+    next_seq = 0
+    progress_time = time.time()
+    warning_time = progress_time
+    try:
+        while next_seq < len(jobs):
+            for (seq, result) in queue.collect(run_id):
+                # A note finished twice, by a worker whose lease had expired, is only yielded once
+                if seq >= next_seq:
+                    results[seq] = decode_result(result, schemas)
+                    progress_time = warning_time = time.time()
+
+            if next_seq not in results:
+                now = time.time()
+                if queue.wait_timeout and now - progress_time > queue.wait_timeout:
+                    raise RuntimeError(f"No contract note of run {run_id} finished in {queue.wait_timeout:g} seconds, "
+                                       f"{len(jobs) - next_seq} left (queue {queue.get_counts()})")
+                if warning_seconds and now - warning_time > warning_seconds:
+                    print(f"Warning! No contract note finished in {now - progress_time:.0f} seconds, is a work_queue.py worker "
+                          f"running? {len(jobs) - next_seq} left (queue {queue.get_counts()})")
+                    warning_time = now
+                time.sleep(poll_interval)
+                continue
+
+            while next_seq in results:
+                yield results.pop(next_seq)
+                next_seq += 1
+            # The time spent by the caller on the results is not waiting for the workers
+            progress_time = warning_time = time.time()
+    finally:
+        queue.cancel(run_id)
+
+
+def create_worker_broker(spec):
+    from brokers import create_broker
+    return create_broker(spec['broker'],
+                         input_path_prefix=spec['input_path_prefix'],
+                         compute_path_prefix=spec['compute_path_prefix'],
+                         **spec.get('broker_options', {}))
+
+
+def run_worker(queue, *, worker_id=None, idle_timeout=0, poll_interval=DEFAULT_POLL_INTERVAL, max_jobs=0):
+    # With idle_timeout, the worker exits after that many seconds without a job, otherwise it waits forever
+    if worker_id is None:
+        worker_id = get_worker_id()
+
+    brokers = {}
+    count = 0
+    idle_start = time.time()
+    print(f"Worker {worker_id} waiting for jobs")
+    while max_jobs <= 0 or count < max_jobs:
+        job = queue.lease(worker_id)
+        if job is None:
+            if idle_timeout and time.time() - idle_start > idle_timeout:
+                break
+            time.sleep(poll_interval)
+            continue
+
+        # A broker is created once per spec, with its caches and learned layout
+        spec_key = json.dumps(job.spec, sort_keys=True)
+        try:
+            if spec_key not in brokers:
+                brokers[spec_key] = create_worker_broker(job.spec)
+            extract_kwargs = dict(brokers[spec_key].get_extract_kwargs(), profile=job.spec.get('profile', False))
+            result = encode_result(extract_contractnote(job.document, job.date, extract_kwargs))
+        except KeyboardInterrupt:
+            queue.release(job, worker_id)
+            raise
+        except Exception as e:
+            result = get_failed_result(job, f"{type(e).__name__}: {e}")
+
+        queue.complete(job, worker_id, result)
+        count += 1
+        idle_start = time.time()
+
+    print(f"Worker {worker_id} processed {count} jobs")
+    return count
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Contract note extraction work queue")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    worker_parser = subparsers.add_parser('worker', help="extract the queued contract notes")
+    worker_parser.add_argument('queue', help="queue database (.db) or folder")
+    worker_parser.add_argument('--worker-id', default=None)
+    worker_parser.add_argument('--lease-seconds', type=float, default=DEFAULT_LEASE_SECONDS)
+    worker_parser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS)
+    worker_parser.add_argument('--idle-timeout', type=float, default=0, help="exit after this many seconds without a job")
+    worker_parser.add_argument('--max-jobs', type=int, default=0)
+    worker_parser.add_argument('--memory-limit', default=None, help="memory limit of the worker, e.g. 1G")
+    status_parser = subparsers.add_parser('status', help="print the number of jobs per status")
+    status_parser.add_argument('queue', help="queue database (.db) or folder")
+    args = parser.parse_args(args)
+
+    if args.command == 'status':
+        queue = get_work_queue(args.queue)
+        print(json.dumps(queue.get_counts(), indent=4))
+        return 0
+
+    set_memory_budget(args.memory_limit)
+    queue = get_work_queue(args.queue, lease_seconds=args.lease_seconds, max_attempts=args.max_attempts)
+    try:
+        run_worker(queue, worker_id=args.worker_id, idle_timeout=args.idle_timeout, max_jobs=args.max_jobs)
+    except KeyboardInterrupt:
+        print(f"Worker interrupted")
+    finally:
+        queue.close()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())